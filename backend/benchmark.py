@@ -0,0 +1,435 @@
+"""
+离线压测：使用本地模拟OVH API (mock_ovh.py) 测量后端在不同规模下的表现，不会访问真实的OVH接口。
+
+场景:
+    task_loop      - 通过 task_execution_loop 执行 N 个任务的一轮下单（吞吐量、尝试耗时、每任务API调用数、事件循环延迟、内存）
+    order_latency  - 无竞争时单次 order_server 的耗时和API调用数
+    ws_fanout      - 通过 /ws 向 C 个客户端广播消息（送达吞吐量和延迟）
+    persistence    - N 个任务/订单的保存与加载耗时
+
+用法 (在 backend 目录下):
+    python benchmark.py
+    python benchmark.py --tasks 10,100,1000,5000 --clients 1,50,200 --latency 30 --rate-limit 0.02
+    python benchmark.py --save-baseline       # 把结果保存为基线 (benchmark_baseline.json)
+    python benchmark.py --compare             # 与基线比较，退化超过容差时以非0状态退出
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmark_baseline.json")
+
+# 指标的优劣方向，用于和基线比较
+METRIC_DIRECTIONS = {
+    "success_rate": "higher",
+    "attempts_per_s": "higher",
+    "attempt_p50_ms": "lower",
+    "attempt_p99_ms": "lower",
+    "api_calls_per_task": "lower",
+    "loop_lag_p99_ms": "lower",
+    "loop_lag_max_ms": "lower",
+    "messages_per_s": "higher",
+    "delivery_p50_ms": "lower",
+    "delivery_p99_ms": "lower",
+    "save_tasks_ms": "lower",
+    "load_tasks_ms": "lower",
+    "save_orders_ms": "lower",
+}
+# 与基线比较时不允许任何退化的指标（模拟API的结果是确定的，成功率下降说明下单流程出错）
+STRICT_METRICS = {"success_rate"}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class LoopLagSampler:
+    """在当前事件循环中每10ms采样一次调度延迟"""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self.task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def __enter__(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self.task.cancel()
+
+
+def reset_backend_state(main):
+    main.startup_state["ready"] = True  # 不经过 lifespan，直接视为已加载
+    main.tasks = {}
+    main.orders = []
+    main.logs.clear()
+    main.inflight_attempts.clear()
+    main.attempt_traces.clear()
+    main.availability_cache.clear()
+    main.ovh_client = None
+
+
+def make_task(main, index: int, plans: int):
+    now = datetime.now()
+    return main.TaskStatus(
+        id=f"bench-{index}",
+        name=f"bench task {index}",
+        planCode=f"bench{index % plans}",
+        datacenter="gra",
+        status="pending",
+        createdAt=now.isoformat(),
+        nextRetryAt=datetime.fromtimestamp(now.timestamp() - 1).isoformat(),
+        taskInterval=60,
+    )
+
+
+async def scenario_task_loop(main, mock_state, count: int, plans: int, timeout: float) -> Dict[str, Any]:
+    reset_backend_state(main)
+    for i in range(count):
+        task = make_task(main, i, plans)
+        main.tasks[task.id] = task
+    mock_state.reset_stats()
+    rss_before = rss_mb()
+
+    started = time.perf_counter()
+    with LoopLagSampler() as sampler:
+        loop_task = asyncio.create_task(main.task_execution_loop())
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+            finished = sum(1 for task in main.tasks.values() if task.retryCount > 0 and task.status not in ("pending", "running"))
+            if finished == count and not main.inflight_attempts:
+                break
+        wall = time.perf_counter() - started
+        loop_task.cancel()
+    for task_id in list(main.inflight_attempts):
+        main.cancel_attempt(task_id)
+    await asyncio.sleep(0)
+
+    durations = [trace["durationMs"] for traces in main.attempt_traces.values() for trace in traces if trace["durationMs"] is not None]
+    finished = sum(1 for task in main.tasks.values() if task.retryCount > 0 and task.status not in ("pending", "running"))
+    # 只统计成功下单的任务，全部失败的运行不能产生看似正常的吞吐量
+    completed = sum(1 for task in main.tasks.values() if task.status == "completed")
+    return {
+        "tasks": count,
+        "finished": finished,
+        "completed": completed,
+        "success_rate": round(completed / max(1, count), 3),
+        "timed_out": finished < count,
+        "wall_s": round(wall, 3),
+        "attempts_per_s": round(completed / wall, 2) if wall else 0.0,
+        "attempt_p50_ms": round(percentile(durations, 50), 1),
+        "attempt_p99_ms": round(percentile(durations, 99), 1),
+        "api_calls_per_task": round(mock_state.total_calls() / max(1, count), 2),
+        "loop_lag_p99_ms": round(percentile(sampler.lags, 99) * 1000, 1),
+        "loop_lag_max_ms": round(max(sampler.lags, default=0.0) * 1000, 1),
+        "rss_mb": rss_mb(),
+        "rss_delta_mb": round(rss_mb() - rss_before, 1),
+    }
+
+
+async def scenario_order_latency(main, mock_state, runs: int) -> Dict[str, Any]:
+    reset_backend_state(main)
+    mock_state.reset_stats()
+    durations = []
+    for i in range(runs):
+        task = make_task(main, i, runs)
+        main.tasks[task.id] = task
+        config = main.ServerConfig(planCode=task.planCode, datacenter=task.datacenter, name=task.name,
+                                   options=[main.AddonOption(label="memory", value="ram-64g")])
+        started = time.perf_counter()
+        await main.order_server(task.id, config)
+        durations.append((time.perf_counter() - started) * 1000)
+    completed = sum(1 for task in main.tasks.values() if task.status == "completed")
+    return {
+        "runs": runs,
+        "completed": completed,
+        "success_rate": round(completed / max(1, runs), 3),
+        "attempt_p50_ms": round(percentile(durations, 50), 1),
+        "attempt_p99_ms": round(percentile(durations, 99), 1),
+        "api_calls_per_task": round(mock_state.total_calls() / max(1, runs), 2),
+    }
+
+
+def start_backend_server(main):
+    import uvicorn
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="bench-backend", daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, server.servers[0].sockets[0].getsockname()[1]
+
+
+async def scenario_ws_fanout(main, port: int, clients: int, messages: int, timeout: float) -> Dict[str, Any]:
+    import websockets
+    import requests
+
+    latencies: List[float] = []
+    received = [0]
+    last_received = [0.0]
+
+    async def client(ready: asyncio.Event, ready_count: List[int]):
+        async with websockets.connect(f"ws://127.0.0.1:{port}/ws", max_size=None, open_timeout=timeout) as ws:
+            await ws.recv()  # initial_data
+            ready_count[0] += 1
+            if ready_count[0] == clients:
+                ready.set()
+            got = 0
+            while got < messages:
+                payload = json.loads(await ws.recv())
+                if payload.get("type") != "bench":
+                    continue
+                last_received[0] = time.perf_counter()
+                latencies.append((last_received[0] - payload["data"]["sent"]) * 1000)
+                received[0] += 1
+                got += 1
+
+    ready = asyncio.Event()
+    ready_count = [0]
+    client_tasks = [asyncio.create_task(client(ready, ready_count)) for _ in range(clients)]
+    await asyncio.wait_for(ready.wait(), timeout)
+
+    started = time.perf_counter()
+    await asyncio.to_thread(requests.post, f"http://127.0.0.1:{port}/_bench/broadcast", params={"count": messages}, timeout=timeout)
+    done, pending = await asyncio.wait(client_tasks, timeout=timeout)
+    # 以最后一条消息送达的时间计算吞吐量，不包括客户端关闭连接的时间
+    wall = (last_received[0] or time.perf_counter()) - started
+    for task in pending:
+        task.cancel()
+    failed = sum(1 for task in done if task.exception() is not None)
+
+    return {
+        "clients": clients,
+        "messages": messages,
+        "delivered": received[0],
+        "expected": clients * messages,
+        "failed_clients": failed,
+        "messages_per_s": round(received[0] / wall, 1) if wall else 0.0,
+        "delivery_p50_ms": round(percentile(latencies, 50), 2),
+        "delivery_p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def scenario_persistence(main, count: int, repeats: int = 3) -> Dict[str, Any]:
+    reset_backend_state(main)
+    for i in range(count):
+        task = make_task(main, i, 50)
+        main.tasks[task.id] = task
+        main.orders.append(main.OrderHistory(id=f"order-{i}", planCode=task.planCode, name=task.name, datacenter="gra",
+                                             orderTime=datetime.now().isoformat(), status="success", orderId=str(i)))
+
+    def timed(func) -> float:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(samples), 2)
+
+    return {
+        "tasks": count,
+        "save_tasks_ms": timed(main.save_tasks_to_file),
+        "load_tasks_ms": timed(main.load_tasks_from_file),
+        "save_orders_ms": timed(main.save_orders_to_file),
+        "tasks_file_kb": round(os.path.getsize(main.TASKS_FILE) / 1024, 1),
+    }
+
+
+def check_results(results: Dict[str, Dict[str, Any]]) -> List[str]:
+    """不依赖基线的检查：没有调用模拟API或没有任何任务成功的场景视为失败"""
+    failures = []
+    for scenario, metrics in results.items():
+        if "api_calls_per_task" in metrics and not metrics["api_calls_per_task"]:
+            failures.append(f"{scenario}: 没有调用模拟API")
+        if "completed" in metrics and not metrics["completed"]:
+            failures.append(f"{scenario}: 没有成功完成的任务")
+    return failures
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for scenario, metrics in results.items():
+        base_metrics = baseline.get("results", {}).get(scenario)
+        if not base_metrics:
+            continue
+        for metric, direction in METRIC_DIRECTIONS.items():
+            if metric not in metrics or metric not in base_metrics:
+                continue
+            current, previous = metrics[metric], base_metrics[metric]
+            if not previous:
+                continue
+            change = (current - previous) / previous
+            allowed = 0.0 if metric in STRICT_METRICS else tolerance
+            worse = change < -allowed if direction == "higher" else change > allowed
+            marker = "退化" if worse else "正常"
+            print(f"  {scenario:<28} {metric:<20} 基线 {previous:>10} 当前 {current:>10} ({change:+.0%}) {marker}")
+            if worse:
+                regressions.append(f"{scenario} {metric}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+async def run_benchmarks(args) -> Dict[str, Dict[str, Any]]:
+    sys.path.insert(0, BACKEND_DIR)
+    import mock_ovh
+
+    workdir = tempfile.mkdtemp(prefix="ovh-bench-")
+    os.chdir(workdir)  # main 会在当前目录写日志和持久化文件
+    os.environ.setdefault("API_LOG_LEVEL", args.api_log_level)
+    import main
+    logging.getLogger("ovh-sniper").setLevel(logging.ERROR)
+
+    mock_state = mock_ovh.MockOVHState(latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+                                       rate_limit_rate=args.rate_limit, seed=1)
+    mock_server, base_url = mock_ovh.start_mock_server(mock_state)
+    mock_ovh.register_mock_endpoint(base_url)
+    main.api_config = main.ApiConfig(appKey="bench", appSecret="bench", consumerKey="bench", endpoint="mock")
+
+    @main.app.post("/_bench/broadcast")
+    async def bench_broadcast(count: int):
+        for seq in range(count):
+            await main.broadcast_message({"type": "bench", "data": {"seq": seq, "sent": time.perf_counter()}})
+        return {"sent": count}
+
+    results: Dict[str, Dict[str, Any]] = {}
+    scenarios = set(args.scenarios.split(","))
+    try:
+        if "order_latency" in scenarios:
+            print("运行 order_latency ...")
+            results["order_latency"] = await scenario_order_latency(main, mock_state, args.order_runs)
+        if "task_loop" in scenarios:
+            for count in args.tasks:
+                print(f"运行 task_loop (任务数 {count}) ...")
+                results[f"task_loop[tasks={count}]"] = await scenario_task_loop(main, mock_state, count, args.plans, args.timeout)
+        if "persistence" in scenarios:
+            for count in args.tasks:
+                print(f"运行 persistence (任务数 {count}) ...")
+                results[f"persistence[tasks={count}]"] = scenario_persistence(main, count)
+        if "ws_fanout" in scenarios:
+            reset_backend_state(main)
+            main.api_config = None  # 后端服务的 lifespan 会重新加载配置，这里避免任务循环访问模拟API
+            # 删除前面场景留下的持久化文件，避免 lifespan 加载这些任务
+            for path in (main.TASKS_FILE, main.ORDERS_FILE, main.CONFIG_FILE):
+                if os.path.exists(path):
+                    os.remove(path)
+            backend_server, port = start_backend_server(main)
+            try:
+                for clients in args.clients:
+                    print(f"运行 ws_fanout (客户端数 {clients}) ...")
+                    results[f"ws_fanout[clients={clients}]"] = await scenario_ws_fanout(main, port, clients, args.messages, args.timeout)
+            finally:
+                backend_server.should_exit = True
+    finally:
+        mock_server.should_exit = True
+    return results
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="OVH Titan Sniper 后端离线压测")
+    parser.add_argument("--scenarios", default="order_latency,task_loop,persistence,ws_fanout")
+    parser.add_argument("--tasks", type=parse_int_list, default=[10, 100, 500], help="任务数，逗号分隔 (10-5000)")
+    parser.add_argument("--clients", type=parse_int_list, default=[1, 50, 200], help="WebSocket客户端数，逗号分隔 (1-200)")
+    parser.add_argument("--plans", type=int, default=50, help="任务使用的不同 planCode 数")
+    parser.add_argument("--messages", type=int, default=50, help="ws_fanout 每个客户端接收的消息数")
+    parser.add_argument("--order-runs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=20, help="模拟API平均延迟(毫秒)")
+    parser.add_argument("--jitter", type=float, default=5, help="模拟API延迟抖动(毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="模拟API返回429的比例")
+    parser.add_argument("--api-log-level", default="DEBUG")
+    parser.add_argument("--timeout", type=float, default=300, help="单个场景的超时时间(秒)")
+    parser.add_argument("--output", help="把结果写入该JSON文件")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--compare", action="store_true", help="与基线比较")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="与基线比较时允许的相对退化")
+    args = parser.parse_args()
+    # 压测会切换到临时工作目录，先把路径转为绝对路径
+    args.baseline = os.path.abspath(args.baseline)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = asyncio.run(run_benchmarks(args))
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "latency_ms": args.latency,
+            "error_rate": args.error_rate,
+            "rate_limit": args.rate_limit,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    failures = check_results(results)
+    if failures:
+        # 失败的结果不保存为基线
+        print("压测场景失败:")
+        for line in failures:
+            print(f"  - {line}")
+        sys.exit(1)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"基线文件不存在: {args.baseline}")
+            sys.exit(2)
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"与基线比较 (容差 {args.tolerance:.0%}):")
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("发现性能退化:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("未发现性能退化")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,22 +1,63 @@
 import asyncio
+import concurrent.futures
+import contextvars
+import hashlib
+import heapq
+import importlib
+import itertools
 import json
 import logging
+import multiprocessing
 import os
+import queue
+import random
+import socket
+import sqlite3
+import sys
+import threading
 import time
 import uuid
+import zlib
+from collections import deque
+from dataclasses import dataclass, field, fields
 from datetime import datetime
-from typing import Dict, List, Optional, Union, Any
+from typing import Dict, List, Literal, Optional, Union, Any
 import traceback
 
-import ovh
-import requests
-import uvicorn
+class DeferredModule:
+    """第一次访问属性时才用普通的 import 导入模块，缩短启动时间。
+    不使用 importlib.util.LazyLoader：其他代码随后 import 子模块（如 mock_ovh 的 import ovh.client）时
+    会得到另一份子模块，对它的修改不会作用到本模块使用的类上。"""
+    def __init__(self, name: str):
+        self._name = name
+    
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self._name), attr)
+
+# 网络客户端在第一次使用时才导入
+ovh = DeferredModule("ovh")
+requests = DeferredModule("requests")
+
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException, Depends, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.websockets import WebSocketState
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+from pydantic import BaseModel, Field, ValidationError
 from pydantic_settings import BaseSettings
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+
+# 可选的更快的JSON编解码库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选的brotli压缩，未安装时只使用gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Helper function to parse FQN (simple version) - Moved to top
 def parse_fqn(fqn: str) -> Dict[str, Optional[str]]:
@@ -34,7 +75,7 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler("ovh_sniper.log"),
+        logging.FileHandler("ovh_sniper.log", delay=True),
     ],
 )
 
@@ -45,7 +86,7 @@ logger = logging.getLogger("ovh-sniper")
 os.makedirs("logs", exist_ok=True)
 api_logger = logging.getLogger("ovh-api-communication")
 api_logger.setLevel(logging.DEBUG)
-api_handler = logging.FileHandler("logs/api_communication.log")
+api_handler = logging.FileHandler("logs/api_communication.log", delay=True)  # 第一次写入时才打开文件
 api_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
 api_logger.addHandler(api_handler)
 api_logger.propagate = False  # 防止API日志也输出到主日志中
@@ -68,7 +109,7 @@ def get_task_logger(task_id):
         return task_logger
         
     # 配置新的记录器
-    task_logger.setLevel(logging.DEBUG)
+    task_logger.setLevel(settings.API_LOG_LEVEL.upper())
     log_file = os.path.join(task_log_dir, f"{task_id}.log")
     file_handler = logging.FileHandler(log_file)
     file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
@@ -90,14 +131,266 @@ class Settings(BaseSettings):
     TARGET_OS: str = "none_64.en"
     TARGET_DURATION: str = "P1M"
     TASK_INTERVAL: int = 60  # 单位：秒
+    ATTEMPT_TIMEOUT: int = 180  # 单次下单尝试的最长执行时间，单位：秒
+    AVAILABILITY_CACHE_TTL: float = 3.0  # 可用性结果缓存时间，单位：秒，0表示不缓存（仍合并并发请求）
+    AVAILABILITY_HEDGING: bool = False  # 可用性请求对冲：首个请求超过近期延迟分位数仍未返回时再发一个请求
+    AVAILABILITY_HEDGE_PERCENTILE: float = 90  # 触发对冲的延迟分位数
+    AVAILABILITY_HEDGE_MAX_RATIO: float = 0.05  # 最近60秒内对冲请求数占可用性请求数的上限
+    ORDER_TRACKER_INTERVAL: int = 60  # 检查已下单订单状态(付款、交付)的周期，单位：秒，0表示不跟踪
+    ORDER_TRACKER_CALLS_PER_MINUTE: int = 20  # 订单状态查询每分钟最多调用OVH接口的次数，调用之间均匀间隔
+    ORDER_TRACKER_MAX_AGE_DAYS: int = 30  # 超过该天数仍未交付的订单不再跟踪
+    CATALOG_CACHE_TTL: int = 300  # 产品目录缓存时间，单位：秒，期间 /api/servers 直接返回缓存（含预压缩副本）
+    COMPRESSION_MIN_SIZE: int = 1024  # 响应体达到该字节数时按 Accept-Encoding 使用 br/gzip 压缩，0表示不压缩
+    AVAILABILITY_LOG_LEVEL: str = "summary"  # 可用性日志级别: off / summary / detail，可在运行时修改
+    AVAILABILITY_SUMMARY_INTERVAL: int = 60  # summary 级别下汇总可用性检查日志的间隔，单位：秒
+    API_LOG_LEVEL: str = "DEBUG"  # API通信日志级别，INFO 及以上时不记录请求/响应内容
+    API_LOG_SAMPLE_RATE: float = 1.0  # 记录响应内容的采样比例 (0~1)
+    API_LOG_BODY_LIMIT: int = 5000  # 日志中响应内容的最大字符数
+    API_CAPTURE_DIR: str = ""  # 设置后由后台线程把完整响应写入该目录，用于调试
+    ATTEMPT_TRACE_LIMIT: int = 20  # 每个任务保留的尝试时间线条数
+    LOOP_LAG_THRESHOLD_MS: int = 100  # 事件循环阻塞超过该时间时记录阻塞位置的调用栈
+    LOOP_BLOCKING_DEBUG: bool = False  # 调试模式：记录在事件循环线程中发生的同步网络/磁盘调用
+    OFFLOAD_THREADS: int = 4  # 用于序列化等较重操作的线程数
+    OFFLOAD_PROCESSES: int = 1  # 用于解析产品目录的进程数，0表示改用线程
+    ATTEMPT_JOURNAL_FILE: str = "attempts.journal"  # 下单步骤日志，用于重启后清理/恢复中断的尝试，留空则不记录
+    SHUTDOWN_GRACE_SECONDS: int = 30  # 关闭时等待进行中的下单尝试完成的时间，单位：秒
+    CHECKOUT_SLOTS: int = 3  # 同时进行建单/结账的数量上限（每个进程），0表示不限制
+    CHECKOUT_SLOT_WAIT_SECONDS: float = 15  # 非高优先级任务等待结账槽位的最长时间，超时后本轮跳过
+    FAST_BOOT: bool = False  # 快速启动：先开始接受连接，任务和订单在后台加载，加载完成前 /readyz 返回503
+    COORDINATION_DB: str = ""  # 多进程/多容器部署时共享的SQLite文件，用于分配任务和转发广播，留空为单进程模式
+    WORKER_LEASE_SECONDS: int = 15  # 任务租约时长，进程停止心跳超过该时间后其任务由其他进程接管
+    RESTOCK_HISTORY_DB: str = "restock_history.db"  # 补货历史数据库文件（不纳入版本控制），留空则不记录
+    RESTOCK_RAW_RETENTION_DAYS: int = 14  # 原始可用性变化记录的保留天数，之后只保留有货时段
+    RESTOCK_HISTORY_RETENTION_DAYS: int = 365  # 有货时段记录的保留天数
+    AVAILABILITY_TRACE_FILE: str = ""  # 可用性轨迹文件（供 simulator.py 回放），留空则不记录
+    TASK_LOOP_INTERVAL: float = 5  # 任务循环检查到期任务的间隔，单位：秒
+    CATALOG_WATCH_INTERVAL: int = 0  # 定期刷新产品目录并检测变化的间隔，单位：秒，0表示只在请求 /api/servers 时检测
 
     class Config:
         env_file = ".env"
 
 settings = Settings()
+api_logger.setLevel(settings.API_LOG_LEVEL.upper())
+
+# 增量序列化为JSON，超过 limit 个字符即停止，不构建完整字符串
+def truncated_json(value, limit: int) -> str:
+    parts = []
+    size = 0
+    for chunk in json.JSONEncoder(ensure_ascii=False, default=str).iterencode(value):
+        parts.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return "".join(parts)[:limit] + "... (已截断)"
+    return "".join(parts)
+
+def json_dumps(value) -> str:
+    """序列化为紧凑的JSON字符串，安装了 orjson 时使用 orjson"""
+    if orjson:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+def json_loads(data: Union[str, bytes]):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# 把较重的CPU操作移出事件循环：序列化放到线程池，解析大JSON放到进程池（只传入字节，返回较小的结果）
+offload_threads = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, settings.OFFLOAD_THREADS), thread_name_prefix="offload")
+offload_processes: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+def get_process_pool() -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    global offload_processes
+    if offload_processes is None and settings.OFFLOAD_PROCESSES > 0:
+        # 使用 spawn，避免在已有多个线程的进程中 fork
+        offload_processes = concurrent.futures.ProcessPoolExecutor(
+            max_workers=settings.OFFLOAD_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return offload_processes
+
+async def run_in_thread_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(offload_threads, func, *args)
+
+async def run_in_process_pool(func, *args):
+    """在进程池中执行 func（必须是模块级函数，参数和返回值可序列化），未启用进程池时改用线程池"""
+    pool = get_process_pool()
+    if pool is None:
+        return await run_in_thread_pool(func, *args)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except concurrent.futures.process.BrokenProcessPool:
+        # 子进程异常退出后重建进程池
+        global offload_processes
+        offload_processes = None
+        return await run_in_thread_pool(func, *args)
+
+# 后台线程把完整的API响应写入磁盘，调用方只做入队操作
+class ResponseCaptureWriter:
+    def __init__(self, directory: str, max_queue: int = 1000):
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+    
+    def submit(self, record: Dict[str, Any]):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self.thread = threading.Thread(target=self._run, name="api-capture-writer", daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+    
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                path = os.path.join(self.directory, f"capture-{datetime.now().strftime('%Y%m%d')}.jsonl")
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            except Exception as e:
+                api_logger.error(f"写入API响应捕获文件失败: {e}")
+
+response_capture = ResponseCaptureWriter(settings.API_CAPTURE_DIR) if settings.API_CAPTURE_DIR else None
+
+# ---- Prometheus 风格的指标 ----
+# 指标可能在工作线程中更新（OVH调用在线程中执行），所以每个指标都带锁
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metric:
+    def __init__(self, name: str, help_text: str, kind: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+    
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _format_labels(self, key: tuple, extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+    
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+class Counter(Metric):
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, "counter", labelnames)
+        self.values: Dict[tuple, float] = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def _samples(self):
+        with self.lock:
+            return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self.values.items()]
+
+class Gauge(Metric):
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        super().__init__(name, help_text, "gauge", labelnames)
+        self.values: Dict[tuple, float] = {}
+        self.func = func  # 可选：渲染时调用以获取当前值
+    
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+    
+    def _samples(self):
+        if self.func:
+            return [f"{self.name} {self.func()}"]
+        with self.lock:
+            return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self.values.items()]
+
+class Histogram(Metric):
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, "histogram", labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[tuple, Dict[str, Any]] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+    
+    def _samples(self):
+        lines = []
+        with self.lock:
+            for key, series in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': str(bound)})} {cumulative}")
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': '+Inf'})} {series['count']}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {series['count']}")
+        return lines
+
+metrics_registry: List[Metric] = []
+
+# 把OVH API路径中的ID替换为占位符，避免每个购物车生成一组新的指标
+def ovh_path_template(path: str) -> str:
+    segments = path.split("?")[0].strip("/").split("/")
+    templated = []
+    for i, segment in enumerate(segments):
+        previous = segments[i - 1] if i > 0 else ""
+        if segment.isdigit() or previous in ("cart", "item"):
+            templated.append("{id}")
+        else:
+            templated.append(segment)
+    return "/" + "/".join(templated)
+
+METRIC_OVH_REQUEST_SECONDS = Histogram("ovh_request_duration_seconds", "OVH API请求耗时", ("method", "path"))
+METRIC_OVH_ERRORS = Counter("ovh_errors_total", "OVH API错误数（按错误类型）", ("error_class",))
+METRIC_AVAILABILITY_CHECKS = Counter("availability_checks_total", "向OVH发起的可用性检查次数")
+METRIC_AVAILABILITY_HEDGES = Counter("availability_hedges_total", "可用性对冲请求（won: 对冲请求先返回, lost: 原请求先返回, skipped: 超出对冲配额）", ("result",))
+METRIC_TASK_LOOP_LAG = Histogram("task_loop_tick_lag_seconds", "任务循环实际间隔超出预期的时间", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+METRIC_TIME_TO_CHECKOUT = Histogram("order_time_to_checkout_seconds", "从发现有货到结账提交完成的时间", buckets=(0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60))
+METRIC_EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "事件循环被阻塞的时间（调度延迟）", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+METRIC_WS_PENDING_BROADCASTS = Gauge("websocket_pending_broadcasts", "尚未发送完成的WebSocket广播数")
+METRIC_PERSISTENCE_WRITES = Counter("persistence_writes_total", "持久化文件写入次数", ("file",))
+METRIC_PERSISTENCE_WRITE_SECONDS = Histogram("persistence_write_duration_seconds", "持久化文件写入耗时", ("file",), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+METRIC_EVENT_LOOP_STALLS = Counter("event_loop_stalls_total", "事件循环阻塞超过阈值的次数")
+METRIC_BLOCKING_CALLS = Counter("event_loop_blocking_calls_total", "调试模式下在事件循环线程中发生的同步调用次数", ("event",))
+METRIC_WS_CONNECTIONS = Gauge("websocket_connections", "当前WebSocket连接数", func=lambda: len(connections))
+METRIC_INFLIGHT_ATTEMPTS = Gauge("inflight_attempts", "进行中的下单尝试数", func=lambda: len(inflight_attempts))
+
+def render_metrics() -> str:
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
 
 # 自定义OVH客户端类，用于记录API通信
-class LoggingOVHClient(ovh.Client):
+# 日志功能以混入类实现，与 ovh.Client 组合成的 LoggingOVHClient 在第一次创建客户端时才生成（届时才导入 ovh）
+class OVHCallLogging:
     def __init__(self, *args, **kwargs):
         self.task_id = kwargs.pop('task_id', None)  # 提取并移除task_id
         super().__init__(*args, **kwargs)
@@ -116,40 +409,54 @@ class LoggingOVHClient(ovh.Client):
         """
         request_id = str(uuid.uuid4())[:8]
         task_prefix = f"[任务: {self.task_id}]" if self.task_id else ""
+        log_info = self.logger.isEnabledFor(logging.INFO)
+        log_body = self.logger.isEnabledFor(logging.DEBUG)
         
         # 记录请求信息
-        self.logger.info(f"{task_prefix} 请求 {request_id}: {method} {path}")
-        if data:
+        if log_info:
+            self.logger.info(f"{task_prefix} 请求 {request_id}: {method} {path}")
+        if data and log_body:
             # 隐藏可能的敏感信息
             safe_data = self._sanitize_params(data) if isinstance(data, dict) else data
-            data_str = json.dumps(safe_data, ensure_ascii=False) if isinstance(safe_data, dict) else str(safe_data)
-            self.logger.info(f"{task_prefix} 请求 {request_id} 数据: {data_str}")
+            self.logger.debug(f"{task_prefix} 请求 {request_id} 数据: {truncated_json(safe_data, settings.API_LOG_BODY_LIMIT)}")
         
+        start_time = time.time()
         try:
             # 调用原始方法
-            start_time = time.time()
             result = super().call(method, path, data, need_auth)
             end_time = time.time()
             
             # 记录响应信息
+            METRIC_OVH_REQUEST_SECONDS.observe(end_time - start_time, method=method, path=ovh_path_template(path))
             duration = round((end_time - start_time) * 1000)
-            self.logger.info(f"{task_prefix} 响应 {request_id}: 耗时 {duration}ms")
+            if log_info:
+                self.logger.info(f"{task_prefix} 响应 {request_id}: 耗时 {duration}ms")
             
             # 尝试记录响应内容，但要避免记录过大的响应
             if result:
                 # 同时记录到主日志和任务特定日志
-                api_logger.info(f"{task_prefix} 响应概要 {request_id}: OVH成功返回数据")
+                if self.logger is not api_logger and api_logger.isEnabledFor(logging.INFO):
+                    api_logger.info(f"{task_prefix} 响应概要 {request_id}: OVH成功返回数据")
                 
-                # 详细内容记录到任务特定日志
-                result_str = str(result)
-                if len(result_str) > 5000:  # 对于非常大的响应，只记录概要
-                    result_summary = f"{result_str[:4997]}... (总长度: {len(result_str)}字节)"
-                    self.logger.info(f"{task_prefix} 响应 {request_id} 内容(截断): {result_summary}")
-                else:
-                    self.logger.info(f"{task_prefix} 响应 {request_id} 内容: {result_str}")
+                # 详细内容按采样比例记录到任务特定日志，超过长度限制时只序列化前面部分
+                if log_body and (settings.API_LOG_SAMPLE_RATE >= 1 or random.random() < settings.API_LOG_SAMPLE_RATE):
+                    self.logger.debug(f"{task_prefix} 响应 {request_id} 内容: {truncated_json(result, settings.API_LOG_BODY_LIMIT)}")
+                # 完整内容交给后台线程写入磁盘
+                if response_capture:
+                    response_capture.submit({
+                        "timestamp": datetime.now().isoformat(),
+                        "requestId": request_id,
+                        "taskId": self.task_id,
+                        "method": method,
+                        "path": path,
+                        "durationMs": duration,
+                        "response": result,
+                    })
             
             return result
         except Exception as e:
+            METRIC_OVH_REQUEST_SECONDS.observe(time.time() - start_time, method=method, path=ovh_path_template(path))
+            METRIC_OVH_ERRORS.inc(error_class=type(e).__name__)
             # 记录错误信息
             error_message = f"{task_prefix} 请求 {request_id} 失败: {str(e)}"
             self.logger.error(error_message)
@@ -174,6 +481,14 @@ class LoggingOVHClient(ovh.Client):
         
         return safe_params
 
+_logging_ovh_client_class = None
+
+def logging_ovh_client_class():
+    global _logging_ovh_client_class
+    if _logging_ovh_client_class is None:
+        _logging_ovh_client_class = type("LoggingOVHClient", (OVHCallLogging, ovh.Client), {})
+    return _logging_ovh_client_class
+
 # 数据模型
 class ServerAvailability(BaseModel):
     fqn: str
@@ -212,16 +527,135 @@ class AddonOption(BaseModel):
 
 class ServerConfig(BaseModel):
     planCode: str
-    datacenter: str
-    quantity: int = 1
+    datacenter: str  # "any" 表示任意数据中心
+    quantity: int = 1  # 台数：默认在一个购物车中一次下单；fleet=True 时为批量任务的目标台数
+    fleet: bool = False  # 批量(fleet)模式：每次结账下单1台，在有货的数据中心并发结账直到达到目标台数
     os: str = "none_64.en"
     duration: str = "P1M"
     options: List[AddonOption] = []
     name: str
     maxRetries: int = -1  # -1表示无限重试
     taskInterval: int = 60  # 默认60秒检查一次
+    maxConcurrent: int = 1  # 批量任务同时进行的结账数上限
+    maxSpend: Optional[float] = None  # 批量任务的花费上限（含税），None表示不限制
+    priority: Literal["high", "normal", "low"] = "normal"  # 有货时按优先级分配结账槽位
+    
+    @property
+    def is_fleet(self) -> bool:
+        return self.fleet and self.quantity > 1
+
+# 批量任务操作的选择条件：按ID列表和/或字段过滤，all=True 表示全部任务
+class TaskSelection(BaseModel):
+    ids: Optional[List[str]] = None
+    status: Optional[List[str]] = None
+    planCode: Optional[str] = None
+    datacenter: Optional[str] = None
+    all: bool = False
+
+class BulkTaskCreate(BaseModel):
+    tasks: List[ServerConfig]
+
+class TaskImport(BaseModel):
+    tasks: List[Dict[str, Any]]  # GET /api/tasks 导出的任务
+
+# 产品目录出现新型号时自动创建任务的规则，planCodePrefix 和 nameContains 都设置时需同时满足
+class CatalogRule(BaseModel):
+    id: Optional[str] = None
+    name: str
+    planCodePrefix: Optional[str] = None  # 如 "25sk"
+    nameContains: Optional[str] = None  # 在商品名称 (invoiceName) 中查找，不区分大小写，如 "KS"
+    datacenter: str = "any"
+    options: List[AddonOption] = []
+    maxRetries: int = -1
+    taskInterval: int = 60
+    priority: Literal["high", "normal", "low"] = "normal"
+    enabled: bool = True
+
+# 任务和订单是内存中的热点对象：使用带 __slots__ 的数据类而不是 pydantic 模型，
+# 只在API边界（请求体、文件、其他进程的消息）做转换；序列化结果缓存到下次修改字段为止。
+# 注意：列表字段需整体赋值（而不是原地 append），修改才会使缓存失效。
+# 每次创建或修改记录都从全局计数器取一个版本号，用于 ETag 和 ?since= 增量查询；
+# 构造过程中的逐个字段赋值不单独计数，构造完成后整条记录只取一个版本号。
+record_versions = itertools.count(1)
+# 记录类型 -> 该类型最近一次修改的版本号
+latest_record_versions: Dict[type, int] = {}
+
+class CachedRecord:
+    __slots__ = ("_cache", "_version")  # _cache: None 或 [字典, JSON字符串]
+    
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "_cache", None)
+        try:
+            self._version
+        except AttributeError:
+            return  # 构造中，由 __post_init__ 统一取版本号
+        self._touch()
+    
+    def __post_init__(self):
+        self._touch()
+    
+    def _touch(self):
+        version = next(record_versions)
+        object.__setattr__(self, "_version", version)
+        latest_record_versions[type(self)] = version
+    
+    def _cached(self) -> list:
+        cache = self._cache
+        if cache is None:
+            cache = [self._build_dict(), None]
+            object.__setattr__(self, "_cache", cache)
+        return cache
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """返回缓存的字典，调用方不应修改"""
+        return self._cached()[0]
+    
+    def to_json(self) -> str:
+        cache = self._cached()
+        if cache[1] is None:
+            cache[1] = json_dumps(cache[0])
+        return cache[1]
+    
+    def _build_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in record_field_names(type(self))}
+    
+    def update_fields(self, data: Dict[str, Any]) -> bool:
+        """
+        把字典中的字段原地应用到记录上（忽略未知字段），保持对象不变（进行中的尝试仍持有该对象）。
+        只赋值有变化的字段，内容相同时不产生新版本；返回是否有变化。
+        """
+        names = record_field_names(type(self))
+        changed = False
+        for name, value in data.items():
+            if name not in names:
+                continue
+            value = self._coerce_field(name, value)
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        return changed
+    
+    def _coerce_field(self, name: str, value: Any) -> Any:
+        """把字典中的字段值转换为记录中的类型"""
+        return value
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        """从字典创建（忽略未知字段）"""
+        names = record_field_names(cls)
+        return cls(**{key: value for key, value in data.items() if key in names})
 
-class OrderHistory(BaseModel):
+_record_field_names: Dict[type, tuple] = {}
+
+def record_field_names(cls) -> tuple:
+    names = _record_field_names.get(cls)
+    if names is None:
+        names = _record_field_names[cls] = tuple(f.name for f in fields(cls))
+    return names
+
+@dataclass(slots=True, eq=False)
+class OrderHistory(CachedRecord):
     id: str
     planCode: str
     name: str
@@ -231,8 +665,15 @@ class OrderHistory(BaseModel):
     orderId: Optional[str] = None
     orderUrl: Optional[str] = None
     error: Optional[str] = None
+    taskId: Optional[str] = None
+    price: Optional[float] = None
+    # 下单后的订单状态跟踪
+    orderStatus: Optional[str] = None  # OVH /me/order/{orderId}/status 的值，如 notPaid、checking、delivering、delivered
+    paidAt: Optional[str] = None
+    deliveredAt: Optional[str] = None
 
-class TaskStatus(BaseModel):
+@dataclass(slots=True, eq=False)
+class TaskStatus(CachedRecord):
     id: str
     name: str
     planCode: str
@@ -245,7 +686,53 @@ class TaskStatus(BaseModel):
     nextRetryAt: Optional[str] = None
     message: Optional[str] = None
     taskInterval: int = 60  # 添加任务间隔属性，默认60秒
-    options: List[AddonOption] = []  # 添加选项字段，保存用户选择的配置
+    options: List[AddonOption] = field(default_factory=list)  # 添加选项字段，保存用户选择的配置
+    quantity: int = 1  # 台数
+    # 批量(fleet)任务字段
+    fleet: bool = False
+    fulfilledCount: int = 0  # 已成功下单台数
+    maxConcurrent: int = 1
+    maxSpend: Optional[float] = None
+    spentAmount: float = 0.0
+    orderIds: List[str] = field(default_factory=list)
+    priority: str = "normal"
+    
+    def _build_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in record_field_names(TaskStatus)}
+        data["options"] = [option.dict() for option in self.options]
+        data["orderIds"] = list(self.orderIds)
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        task = super(TaskStatus, cls).from_dict(data)
+        task.options = [option if isinstance(option, AddonOption) else AddonOption(**option) for option in task.options or []]
+        return task
+    
+    @property
+    def is_fleet(self) -> bool:
+        return self.fleet and self.quantity > 1
+    
+    def _coerce_field(self, name: str, value: Any) -> Any:
+        if name == "options":
+            return [option if isinstance(option, AddonOption) else AddonOption(**option) for option in value or []]
+        return value
+    
+    def server_config(self) -> "ServerConfig":
+        """构建本次尝试的服务器配置（字段已在创建任务时校验，不再重复校验）"""
+        return ServerConfig.model_construct(
+            planCode=self.planCode,
+            datacenter=self.datacenter,
+            name=self.name,
+            maxRetries=self.maxRetries,
+            taskInterval=self.taskInterval,
+            options=self.options, # 恢复选项信息
+            quantity=self.quantity,
+            fleet=self.fleet,
+            maxConcurrent=self.maxConcurrent,
+            maxSpend=self.maxSpend,
+            priority=self.priority,
+        )
 
 # 添加配置持久化
 CONFIG_FILE = "config.json"
@@ -256,6 +743,13 @@ ORDERS_FILE = "orders.json"
 # 添加任务持久化功能
 TASKS_FILE = "tasks.json"
 
+# 下单配方持久化
+CART_RECIPES_FILE = "cart_recipes.json"
+
+# 产品目录指纹和自动创建任务规则持久化
+CATALOG_FINGERPRINTS_FILE = "catalog_fingerprints.json"
+CATALOG_RULES_FILE = "catalog_rules.json"
+
 # 添加全局字典，用于记录各服务器型号的问题参数
 # server_problem_params = {}
 # 记录服务器型号尝试次数的字典
@@ -270,12 +764,22 @@ TASKS_FILE = "tasks.json"
 #     "bandwidth": ["bandwidth", "traffic", "network"]
 # }
 
+# 记录持久化写入次数和耗时
+@contextmanager
+def measure_persistence(name: str):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        METRIC_PERSISTENCE_WRITES.inc(file=name)
+        METRIC_PERSISTENCE_WRITE_SECONDS.observe(time.monotonic() - started, file=name)
+
 # 保存配置到文件
 def save_config_to_file():
     global api_config
     if api_config:
         try:
-            with open(CONFIG_FILE, "w") as f:
+            with measure_persistence("config"), open(CONFIG_FILE, "w") as f:
                 # 转换为字典并保存
                 config_dict = api_config.dict()
                 # 记录日志，但不包含敏感信息
@@ -325,14 +829,34 @@ def load_config_from_file():
         except Exception as e:
             add_log("error", f"从文件加载API配置失败: {str(e)}")
 
+# 任务和订单文件读取完成前不写入，否则会覆盖尚未读取的数据；加载完成后统一保存
+def defer_save_until_loaded(name: str) -> bool:
+    if startup_state["ready"]:
+        return False
+    startup_state["pendingSaves"].add(name)
+    return True
+
+# 多进程模式下只由持有状态文件租约的进程写任务和订单文件，其他进程的修改通过广播同步到该进程后再保存
+def holds_state_files() -> bool:
+    return cluster is None or cluster.holds_state_files
+
+def write_state_file(path: str, content: str):
+    """先写临时文件再替换，写入中断或并发读取时不会看到不完整的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
 # 保存订单到文件
 def save_orders_to_file():
     global orders
+    if defer_save_until_loaded("orders") or not holds_state_files():
+        return
     try:
-        with open(ORDERS_FILE, "w") as f:
+        with measure_persistence("orders"):
             # 将订单列表转换为可序列化的字典列表
-            serializable_orders = [order.dict() for order in orders]
-            json.dump(serializable_orders, f)
+            # 使用每条订单缓存的JSON，未修改的订单不再重新序列化
+            write_state_file(ORDERS_FILE, "[" + ",".join(order.to_json() for order in orders) + "]")
         add_log("info", f"订单历史已保存到文件 {ORDERS_FILE}")
     except Exception as e:
         add_log("error", f"保存订单历史到文件失败: {str(e)}")
@@ -340,23 +864,34 @@ def save_orders_to_file():
 # 从文件加载订单
 def load_orders_from_file():
     global orders
-    if os.path.exists(ORDERS_FILE):
-        try:
-            with open(ORDERS_FILE, "r") as f:
-                orders_data = json.load(f)
-                orders = [OrderHistory(**order_dict) for order_dict in orders_data]
-            add_log("info", f"已从文件 {ORDERS_FILE} 加载 {len(orders)} 条订单历史")
-        except Exception as e:
-            add_log("error", f"从文件加载订单历史失败: {str(e)}")
+    loaded = read_orders_file()
+    if loaded is not None:
+        orders = loaded
+
+def read_orders_file() -> Optional[List[OrderHistory]]:
+    """读取订单文件（可在线程中执行）"""
+    if not os.path.exists(ORDERS_FILE):
+        return None
+    try:
+        with open(ORDERS_FILE, "rb") as f:
+            orders_data = json_loads(f.read())
+        loaded = [OrderHistory.from_dict(order_dict) for order_dict in orders_data]
+        logger.info(f"已从文件 {ORDERS_FILE} 加载 {len(loaded)} 条订单历史")
+        return loaded
+    except Exception as e:
+        logger.error(f"从文件加载订单历史失败: {str(e)}")
+        return None
 
 # 保存任务到文件
 def save_tasks_to_file():
     global tasks
+    if defer_save_until_loaded("tasks") or not holds_state_files():
+        return
     try:
-        with open(TASKS_FILE, "w") as f:
+        with measure_persistence("tasks"):
             # 将任务字典转换为可序列化的字典列表
-            serializable_tasks = [task.dict() for task in tasks.values()]
-            json.dump(serializable_tasks, f)
+            # 使用每个任务缓存的JSON，未修改的任务不再重新序列化
+            write_state_file(TASKS_FILE, "[" + ",".join(task.to_json() for task in tasks.values()) + "]")
         add_log("debug", f"任务已保存到文件 {TASKS_FILE}，共 {len(tasks)} 条")
     except Exception as e:
         add_log("error", f"保存任务到文件失败: {str(e)}")
@@ -364,22 +899,31 @@ def save_tasks_to_file():
 # 从文件加载任务
 def load_tasks_from_file():
     global tasks
-    if os.path.exists(TASKS_FILE):
-        try:
-            with open(TASKS_FILE, "r") as f:
-                tasks_data = json.load(f)
-                # 将列表转换为以任务ID为键的字典
-                tasks = {task_dict["id"]: TaskStatus(**task_dict) for task_dict in tasks_data}
-            add_log("info", f"已从文件 {TASKS_FILE} 加载 {len(tasks)} 条任务")
-        except Exception as e:
-            add_log("error", f"从文件加载任务失败: {str(e)}")
+    loaded = read_tasks_file()
+    if loaded is not None:
+        tasks = loaded
+
+def read_tasks_file() -> Optional[Dict[str, TaskStatus]]:
+    """读取任务文件（可在线程中执行）"""
+    if not os.path.exists(TASKS_FILE):
+        return None
+    try:
+        with open(TASKS_FILE, "rb") as f:
+            tasks_data = json_loads(f.read())
+        # 将列表转换为以任务ID为键的字典
+        loaded = {task_dict["id"]: TaskStatus.from_dict(task_dict) for task_dict in tasks_data}
+        logger.info(f"已从文件 {TASKS_FILE} 加载 {len(loaded)} 条任务")
+        return loaded
+    except Exception as e:
+        logger.error(f"从文件加载任务失败: {str(e)}")
+        return None
 
 # 向订单列表添加新订单并持久化
-def add_order(order: OrderHistory):
+def add_order(order: OrderHistory, dedupe: bool = True):
     global orders
     
-    # 检查是否已有相同planCode和datacenter的订单
-    for i, existing_order in enumerate(orders):
+    # 检查是否已有相同planCode和datacenter的订单（批量任务的成功订单不合并）
+    for i, existing_order in enumerate(orders if dedupe else []):
         if (existing_order.planCode == order.planCode and 
             existing_order.datacenter.lower() == order.datacenter.lower() and
             existing_order.status == order.status):
@@ -395,20 +939,423 @@ def add_order(order: OrderHistory):
     save_orders_to_file()
     add_log("info", f"新订单已添加到历史记录并保存: {order.id}")
 
+# ---- 尝试时间线追踪 ----
+# 每次尝试生成一条时间线，记录各步骤(span)的开始时间、耗时和结果
+attempt_traces: Dict[str, deque] = {}
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+def start_trace(task_id: str, attempt_id: str, kind: str) -> Dict[str, Any]:
+    trace = {
+        "attemptId": attempt_id,
+        "taskId": task_id,
+        "kind": kind,
+        "startedAt": datetime.now().isoformat(),
+        "durationMs": None,
+        "result": None,
+        "message": None,
+        "spans": [],
+        "_started": time.monotonic(),
+    }
+    attempt_traces.setdefault(task_id, deque(maxlen=settings.ATTEMPT_TRACE_LIMIT)).append(trace)
+    current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: Dict[str, Any], result: str, message: Optional[str] = None):
+    trace["durationMs"] = round((time.monotonic() - trace["_started"]) * 1000)
+    trace["result"] = result
+    trace["message"] = message
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """在当前尝试的时间线中记录一个步骤，没有进行中的尝试时不做任何事"""
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    started = time.monotonic()
+    span = {"name": name, "startMs": round((started - trace["_started"]) * 1000), "durationMs": None, "status": "ok", **attributes}
+    trace["spans"].append(span)
+    try:
+        yield span
+    except BaseException as e:
+        span["status"] = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+        span["error"] = str(e)[:500]
+        raise
+    finally:
+        span["durationMs"] = round((time.monotonic() - started) * 1000, 1)
+
+def get_attempt_traces(task_id: str) -> List[Dict[str, Any]]:
+    """返回任务最近的尝试时间线，最新的在前"""
+    return [{key: value for key, value in trace.items() if not key.startswith("_")} for trace in reversed(attempt_traces.get(task_id, []))]
+
+# ---- 下单尝试日志 ----
+# 追加写入的JSONL日志：记录尝试的开始/结束和每个购物车的关键步骤（创建、添加商品、提交结账、结账完成、删除）。
+# 每行写入后立即flush，进程被杀死时已写入的内容不会丢失。重启时根据日志找出中断的尝试：
+# 未提交结账的购物车会被删除，已结账但未记录的订单会补记，提交结账后结果未知的会标记为需人工确认。
+# 内存中的状态在事件循环中立即更新，文件写入在日志专用的单个线程中按顺序执行，调用方等待写入完成后再继续下一步。
+class AttemptJournal:
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = None
+        # 本进程中尚未结束的尝试: attempt_id -> {"taskId", "carts": {cart_id: {"itemId", "state", "orderId"}}}
+        self.attempts: Dict[str, Dict[str, Any]] = {}
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="attempt-journal")
+    
+    async def append(self, event: str, task_id: str, attempt_id: str, **fields):
+        record = {"ts": datetime.now().isoformat(), "event": event, "taskId": task_id, "attemptId": attempt_id, **fields}
+        self._apply(self.attempts, record)
+        # 尝试结束时可能压缩日志，压缩使用此刻的状态快照，写入线程不读取事件循环正在修改的状态
+        snapshot = self.snapshot() if event == "attempt_end" else None
+        await asyncio.get_running_loop().run_in_executor(self.writer, self._write, record, snapshot)
+    
+    def _write(self, record: Dict[str, Any], snapshot: Optional[Dict[str, Dict[str, Any]]]):
+        try:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(json_dumps(record) + "\n")
+            self.file.flush()
+            if snapshot is not None and self.file.tell() > self.max_bytes:
+                self._compact(snapshot)
+        except Exception as e:
+            logger.error(f"写入下单尝试日志失败: {e}")
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {attempt_id: {**attempt, "carts": {cart_id: dict(cart) for cart_id, cart in attempt["carts"].items()}}
+                for attempt_id, attempt in self.attempts.items()}
+    
+    @staticmethod
+    def _apply(attempts: Dict[str, Dict[str, Any]], record: Dict[str, Any]):
+        attempt_id = record.get("attemptId")
+        event = record.get("event")
+        if event == "attempt_end":
+            attempts.pop(attempt_id, None)
+            return
+        if event == "cart_deleted":
+            if attempt_id in attempts:
+                attempts[attempt_id]["carts"].pop(record.get("cartId"), None)
+            return
+        attempt = attempts.setdefault(attempt_id, {"taskId": record.get("taskId"), "startedAt": record.get("ts"), "carts": {}})
+        cart_id = record.get("cartId")
+        if not cart_id:
+            return
+        cart = attempt["carts"].setdefault(cart_id, {"itemId": None, "state": "created", "orderId": None, "datacenter": None})
+        if event == "cart_created":
+            cart["datacenter"] = record.get("datacenter")
+        elif event == "item_added":
+            cart["itemId"] = record.get("itemId")
+        elif event == "checkout_submitting":
+            cart["state"] = "submitting"
+            cart["price"] = record.get("price")
+        elif event == "checkout_done":
+            cart["state"] = "checked_out"
+            cart["orderId"] = record.get("orderId")
+            cart["url"] = record.get("url")
+    
+    def replay(self, path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """读取日志（默认为本进程的日志），返回未结束的尝试"""
+        path = path or self.path
+        attempts: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(path):
+            return attempts
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    self._apply(attempts, json.loads(line))
+                except ValueError:
+                    continue  # 忽略进程被杀死时写了一半的行
+        return attempts
+    
+    @staticmethod
+    def _attempt_records(attempt_id: str, attempt: Dict[str, Any]):
+        """把尝试的当前状态还原为日志记录"""
+        yield {"ts": attempt["startedAt"], "event": "attempt_start", "taskId": attempt["taskId"], "attemptId": attempt_id}
+        for cart_id, cart in attempt["carts"].items():
+            base = {"ts": attempt["startedAt"], "taskId": attempt["taskId"], "attemptId": attempt_id, "cartId": cart_id}
+            yield {**base, "event": "cart_created", "datacenter": cart.get("datacenter")}
+            if cart["itemId"] is not None:
+                yield {**base, "event": "item_added", "itemId": cart["itemId"]}
+            if cart["state"] in ("submitting", "checked_out"):
+                yield {**base, "event": "checkout_submitting", "price": cart.get("price")}
+            if cart["state"] == "checked_out":
+                yield {**base, "event": "checkout_done", "orderId": cart["orderId"], "url": cart.get("url")}
+    
+    async def adopt(self, attempt_id: str, attempt: Dict[str, Any]):
+        """接管其他日志中（已停止的进程或上次运行）尚未清理的尝试，清理成功前一直保留在本进程的日志中"""
+        for record in self._attempt_records(attempt_id, attempt):
+            await self.append(record.pop("event"), record.pop("taskId"), record.pop("attemptId"), **{k: v for k, v in record.items() if k != "ts"})
+    
+    async def compact(self):
+        """重写日志，只保留本进程中尚未结束的尝试（包括购物车尚未清理成功的尝试）"""
+        await asyncio.get_running_loop().run_in_executor(self.writer, self._compact, self.snapshot())
+    
+    def _compact(self, attempts: Dict[str, Dict[str, Any]]):
+        if self.file:
+            self.file.close()
+            self.file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for attempt_id, attempt in attempts.items():
+                for record in self._attempt_records(attempt_id, attempt):
+                    f.write(json_dumps(record) + "\n")
+        os.replace(tmp_path, self.path)
+
+async def journal_cart_event(event: str, cart_id: str, **fields):
+    """在当前尝试的日志中记录购物车步骤，没有进行中的尝试时不做任何事"""
+    trace = current_trace.get()
+    if attempt_journal is None or trace is None:
+        return
+    await attempt_journal.append(event, trace["taskId"], trace["attemptId"], cartId=cart_id, **fields)
+
+async def delete_cart(task_id: str, cart_id: str, attempt_id: Optional[str] = None):
+    client = get_ovh_client(task_id)
+    await ovh_call(client, "delete", f'/order/cart/{cart_id}')
+    if attempt_journal and attempt_id:
+        await attempt_journal.append("cart_deleted", task_id, attempt_id, cartId=cart_id)
+    else:
+        await journal_cart_event("cart_deleted", cart_id)
+
+async def cleanup_attempt_carts(task_id: str, attempt_id: str, carts: Dict[str, Dict[str, Any]]):
+    """删除尝试中创建但未提交结账的购物车，全部删除成功后才在日志中结束该尝试，失败的在下次启动时重试"""
+    failed = 0
+    for cart_id, cart in list(carts.items()):
+        if cart["state"] != "created":
+            continue
+        try:
+            await delete_cart(task_id, cart_id, attempt_id)
+            add_log("info", f"已删除任务 {task_id} 的尝试 {attempt_id} 遗留的购物车 {cart_id}")
+        except Exception as e:
+            failed += 1
+            add_log("warning", f"删除遗留的购物车 {cart_id} 失败: {str(e)}")
+    if attempt_journal and not failed:
+        await attempt_journal.append("attempt_end", task_id, attempt_id, result="carts_cleaned")
+
+def claim_recoverable_journals() -> List[str]:
+    """
+    返回需要由本进程恢复的下单日志。
+    单进程模式下为日志文件本身；多进程模式下为已停止心跳的进程留下的日志（包括升级前共用的日志），
+    先改名为本进程认领的文件再恢复，避免多个进程重复恢复同一个日志。
+    """
+    base = settings.ATTEMPT_JOURNAL_FILE
+    if not cluster:
+        return [base] if os.path.exists(base) else []
+    try:
+        live = cluster.live_workers()
+    except Exception as e:
+        add_log("error", f"读取存活进程失败，暂不恢复其他进程的下单日志: {str(e)}")
+        return []
+    directory = os.path.dirname(base) or "."
+    prefix = os.path.basename(base)
+    claimed = []
+    for name in os.listdir(directory):
+        if name == prefix:
+            owner = None
+        elif name.startswith(prefix + ".") and not name.endswith(".tmp"):
+            # 认领后的文件名为 <日志>.<认领进程ID>#<随机后缀>，进程ID中不会出现 #
+            owner = name[len(prefix) + 1:].split("#")[0]
+            if owner in live:
+                continue
+        else:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if time.time() - os.path.getmtime(path) < cluster.lease_seconds:
+                continue  # 刚启动的进程可能尚未写入心跳，等下一轮再判断
+        except OSError:
+            continue
+        target = f"{base}.{cluster.worker_id}#{uuid.uuid4().hex[:6]}"
+        try:
+            os.rename(path, target)
+        except OSError:
+            continue  # 已被其他进程认领
+        claimed.append(target)
+    return claimed
+
+async def recover_interrupted_attempts():
+    """处理上次运行（或已停止的其他进程）中断的尝试和停留在 running 状态的任务"""
+    journal_paths = claim_recoverable_journals() if attempt_journal else []
+    interrupted: Dict[str, Dict[str, Any]] = {}
+    for path in journal_paths:
+        interrupted.update(attempt_journal.replay(path))
+    review_tasks = set()
+    for attempt_id, attempt in interrupted.items():
+        task_id = attempt["taskId"]
+        task = tasks.get(task_id)
+        for cart_id, cart in attempt["carts"].items():
+            if cart["state"] == "checked_out":
+                order_id = safe_str(cart["orderId"], "N/A")
+                if not any(order.orderId == order_id for order in orders):
+                    add_order(OrderHistory(
+                        id=str(uuid.uuid4()), planCode=task.planCode if task else "", name=task.name if task else "",
+                        datacenter=cart.get("datacenter") or "", orderTime=attempt["startedAt"], status="success",
+                        orderId=order_id, orderUrl=safe_str(cart.get("url"), "N/A"),
+                        error="重启后根据下单日志补记", taskId=task_id, price=cart.get("price")
+                    ), dedupe=False)
+                    add_log("warning", f"任务 {task_id} 的订单 {order_id} 在上次运行中已结账但未记录，已补记")
+                    await send_telegram_msg(f"{api_config.iam if api_config else ''}: 重启后补记订单 {order_id} (任务 {task_id})")
+                    if task and task.is_fleet:
+                        task.fulfilledCount += 1
+                        task.spentAmount = round(task.spentAmount + (cart.get("price") or 0.0), 2)
+                        task.orderIds = task.orderIds + [order_id]
+                if task and not task.is_fleet:
+                    update_task_status(task_id, "completed", f"订单 {order_id} 已在上次运行中创建")
+            elif cart["state"] == "submitting":
+                # 无法确定结账是否已成功，为避免重复下单不再自动重试
+                review_tasks.add(task_id)
+                add_log("warning", f"任务 {task_id} 的购物车 {cart_id} 在提交结账时中断，无法确认是否已下单，请在OVH后台核实")
+                await send_telegram_msg(f"{api_config.iam if api_config else ''}: 购物车 {cart_id} (任务 {task_id}) 在提交结账时中断，请核实是否已下单")
+        if any(cart["state"] == "created" for cart in attempt["carts"].values()):
+            # 未清理的购物车转入本进程的日志，删除成功前一直保留
+            created = {cart_id: cart for cart_id, cart in attempt["carts"].items() if cart["state"] == "created"}
+            await attempt_journal.adopt(attempt_id, {**attempt, "carts": created})
+            if api_config:
+                asyncio.create_task(cleanup_attempt_carts(task_id, attempt_id, created))
+    
+    now = datetime.now().isoformat()
+    # 多进程模式下其他进程的任务可能正在运行，只重置属于已恢复日志的任务
+    interrupted_tasks = {attempt["taskId"] for attempt in interrupted.values()}
+    for task_id, task in list(tasks.items()):
+        if task_id in review_tasks:
+            update_task_status(task_id, "needs_review", "上次运行在提交结账时中断，请核实是否已下单后手动重试")
+        elif task.status == "running" and (not cluster or task_id in interrupted_tasks):
+            update_task_status(task_id, "pending", "服务重启，继续执行")
+            task.nextRetryAt = now  # 立即重新尝试
+            add_log("info", f"任务 {task_id} ({task.name}) 在上次运行中未完成，已重置为等待状态")
+    if attempt_journal and journal_paths:
+        await attempt_journal.compact()
+        for path in journal_paths:
+            # 单进程模式下恢复的就是本进程的日志，已在上面压缩
+            if path != attempt_journal.path and os.path.exists(path):
+                os.remove(path)
+    if interrupted:
+        add_log("info", f"已处理 {len(interrupted)} 个中断的下单尝试")
+
+async def journal_recovery_loop():
+    """多进程模式下定期恢复运行中停止心跳的进程留下的下单日志"""
+    while True:
+        await asyncio.sleep(settings.WORKER_LEASE_SECONDS)
+        try:
+            await recover_interrupted_attempts()
+        except Exception as e:
+            add_log("error", f"恢复其他进程的下单日志失败: {str(e)}")
+
+# 关闭时为 True：不再启动新的尝试，被中止的尝试保留为等待状态
+shutting_down = False
+
+async def drain_inflight_attempts(grace_seconds: float):
+    """等待进行中的尝试完成，超时后取消剩余的尝试（其购物车在下次启动时清理）"""
+    runners = [attempt["runner"] for attempt in inflight_attempts.values()]
+    if not runners:
+        return
+    add_log("info", f"等待 {len(runners)} 个进行中的下单尝试完成（最多 {grace_seconds} 秒）...")
+    done, pending = await asyncio.wait(runners, timeout=grace_seconds)
+    for runner in pending:
+        runner.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=5)
+        add_log("warning", f"关闭时中止了 {len(pending)} 个下单尝试，将在重启后继续")
+
+# 进行中的下单尝试登记表: task_id -> 尝试信息，保证每个任务同一时间只有一个下单流程
+inflight_attempts: Dict[str, Dict[str, Any]] = {}
+
+def get_inflight_attempt(task_id: str) -> Optional[Dict[str, Any]]:
+    """返回任务当前进行中的尝试（不含内部的 asyncio.Task）"""
+    attempt = inflight_attempts.get(task_id)
+    if not attempt:
+        return None
+    return {key: value for key, value in attempt.items() if key != "runner"}
+
+async def run_attempt(task_id: str, attempt_id: str, coro, kind: str = "single"):
+    """执行一次下单尝试，超时或被取消时更新任务状态，结束后从登记表移除"""
+    trace = start_trace(task_id, attempt_id, kind)
+    if attempt_journal:
+        await attempt_journal.append("attempt_start", task_id, attempt_id, kind=kind)
+    aborted_by_shutdown = False
+    try:
+        await asyncio.wait_for(coro, timeout=settings.ATTEMPT_TIMEOUT)
+    except asyncio.TimeoutError:
+        error_msg = f"尝试 {attempt_id} 超过 {settings.ATTEMPT_TIMEOUT} 秒未完成，已中止"
+        add_log("error", f"任务 {task_id}: {error_msg}")
+        update_task_status(task_id, "error", error_msg)
+    except asyncio.CancelledError:
+        if shutting_down:
+            # 关闭时中止：保留为等待状态，日志中不记录结束，下次启动时清理购物车并继续
+            aborted_by_shutdown = True
+            if task_id in tasks and tasks[task_id].status == "running":
+                update_task_status(task_id, "pending", "服务关闭时中止，重启后继续")
+            raise
+        add_log("warning", f"任务 {task_id} 的尝试 {attempt_id} 已被取消")
+        if task_id in tasks and tasks[task_id].status == "running":
+            update_task_status(task_id, "cancelled", "当前尝试已被取消")
+    except Exception as e:
+        add_log("error", f"任务 {task_id} 的尝试 {attempt_id} 异常结束: {str(e)}")
+        update_task_status(task_id, "error", f"尝试异常结束: {str(e)}")
+    finally:
+        task = tasks.get(task_id)
+        finish_trace(trace, task.status if task else "deleted", task.message if task else None)
+        if attempt_journal and not aborted_by_shutdown:
+            journaled = attempt_journal.attempts.get(attempt_id)
+            leftover = {cart_id: cart for cart_id, cart in journaled["carts"].items() if cart["state"] == "created"} if journaled else {}
+            if leftover:
+                # 出错、超时或被取消时删除未提交结账的购物车，删除成功后才结束该尝试
+                if api_config:
+                    asyncio.create_task(cleanup_attempt_carts(task_id, attempt_id, leftover))
+            else:
+                await attempt_journal.append("attempt_end", task_id, attempt_id, result=task.status if task else "deleted")
+        current = inflight_attempts.get(task_id)
+        if current and current["attemptId"] == attempt_id:
+            del inflight_attempts[task_id]
+
+def launch_attempt(task_id: str, config: ServerConfig) -> Optional[str]:
+    """为任务启动一次下单尝试；若该任务已有进行中的尝试则不启动并返回 None"""
+    if task_id in inflight_attempts:
+        return None
+    attempt_id = str(uuid.uuid4())[:8]
+    coro = order_fleet(task_id, config) if config.is_fleet else order_server(task_id, config)
+    started = datetime.now()
+    inflight_attempts[task_id] = {
+        "taskId": task_id,
+        "attemptId": attempt_id,
+        "kind": "fleet" if config.is_fleet else "single",
+        "startedAt": started.isoformat(),
+        "deadline": datetime.fromtimestamp(started.timestamp() + settings.ATTEMPT_TIMEOUT).isoformat(),
+    }
+    # 先登记再创建协程任务，避免任务立即结束时登记表残留
+    inflight_attempts[task_id]["runner"] = asyncio.create_task(run_attempt(task_id, attempt_id, coro, inflight_attempts[task_id]["kind"]))
+    return attempt_id
+
+def cancel_attempt(task_id: str) -> bool:
+    """取消任务进行中的尝试。注意：已提交到OVH的请求无法撤回"""
+    attempt = inflight_attempts.get(task_id)
+    if not attempt:
+        return False
+    attempt["runner"].cancel()
+    return True
+
 # **** 重新加入 task_execution_loop 函数定义 ****
 async def task_execution_loop():
     while True:
         now = datetime.now().timestamp()
         
-        # 检查所有待处理任务
-        active_tasks = list(tasks.items()) # 创建副本以安全迭代
+        # 检查所有待处理任务，高优先级的任务先启动、先排队等待结账槽位
+        active_tasks = sorted(((task_id, task) for task_id, task in tasks.items() if task.status in ["pending", "error"]),
+                              key=lambda item: task_priority_rank(item[1].priority))
         if not active_tasks:
             # add_log("debug", "任务执行循环：当前无活动任务")
             pass # 避免在没有任务时频繁记录日志
             
         for task_id, task in active_tasks:
+            if shutting_down:
+                break
+            # 已暂停、已完成等状态的任务在这里直接跳过，不参与调度
             if task.status not in ["pending", "error"]:
                 continue
+            # 已有进行中的尝试时不再启动新的尝试
+            if task_id in inflight_attempts:
+                continue
+            # 多进程模式下只执行本进程持有租约的任务
+            if cluster and not cluster.owns(task_id):
+                continue
             
             # 如果达到最大重试次数，跳过
             # maxRetries <= 0 表示无限重试
@@ -441,19 +1388,12 @@ async def task_execution_loop():
                 add_log("info", f"开始第 {task.retryCount}/{task.maxRetries} 次尝试任务 {task_id} ({task.name})，间隔时间为 {task.taskInterval} 秒")
             
             # 创建服务器配置
-            server_config = ServerConfig(
-                planCode=task.planCode,
-                datacenter=task.datacenter,
-                name=task.name,
-                maxRetries=task.maxRetries,
-                taskInterval=task.taskInterval,
-                options=task.options # 恢复选项信息
-            )
+            server_config = task.server_config()
             
             # 执行订购 (后台执行，不阻塞循环)
             try:
-                add_log("debug", f"在后台为任务 {task_id} 创建 order_server 协程")
-                asyncio.create_task(order_server(task_id, server_config))
+                attempt_id = launch_attempt(task_id, server_config)
+                add_log("debug", f"在后台为任务 {task_id} 启动尝试 {attempt_id} ({'批量' if task.is_fleet else '单台'})")
                 # 注意：这里启动后并不等待结果，order_server 内部会更新任务状态
             except Exception as e:
                 error_msg = f"启动任务 {task_id} (尝试 {task.retryCount}) 失败: {str(e)}"
@@ -462,7 +1402,9 @@ async def task_execution_loop():
                 update_task_status(task_id, "error", error_msg)
         
         # 等待下一个检查周期
-        await asyncio.sleep(5)  # 每5秒检查一次任务状态
+        sleep_started = time.monotonic()
+        await asyncio.sleep(settings.TASK_LOOP_INTERVAL)  # 默认每5秒检查一次任务状态
+        METRIC_TASK_LOOP_LAG.observe(max(0.0, time.monotonic() - sleep_started - settings.TASK_LOOP_INTERVAL))
 
 # 添加心跳检测和连接状态报告机制
 
@@ -485,26 +1427,394 @@ async def broadcast_connection_status():
             add_log("error", f"广播连接状态时出错: {str(e)}")
             await asyncio.sleep(5)  # 出错时等待5秒后重试
 
+# ---- 事件循环阻塞监控 ----
+# 协程定期更新心跳并记录调度延迟；看门狗线程发现心跳超时后抓取事件循环线程当前的调用栈，即阻塞位置
+class EventLoopWatchdog:
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.interval = min(0.5, max(0.02, threshold / 2))
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat = time.monotonic()
+        self.stalls = deque(maxlen=50)
+        self.current_stall = None
+    
+    def start(self, loop):
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True).start()
+    
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            self.heartbeat = started
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            METRIC_EVENT_LOOP_LAG.observe(lag)
+            stall = self.current_stall
+            if stall is not None:
+                # 阻塞结束，补充实际阻塞时间
+                stall["lagMs"] = round(lag * 1000)
+                self.current_stall = None
+                add_log("warning", f"事件循环被阻塞 {stall['lagMs']}ms，阻塞位置: {stall['location']}")
+    
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            if self.current_stall is not None:
+                continue
+            stale = time.monotonic() - self.heartbeat - self.interval
+            if stale <= self.threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            summary = traceback.extract_stack(frame)
+            stall = {
+                "detectedAt": datetime.now().isoformat(),
+                "lagMs": round(stale * 1000),
+                "location": f"{summary[-1].filename}:{summary[-1].lineno} ({summary[-1].name})" if summary else "未知",
+                "stack": "".join(stack[-15:]),
+            }
+            self.stalls.append(stall)
+            self.current_stall = stall
+            METRIC_EVENT_LOOP_STALLS.inc()
+            logger.warning(f"事件循环已阻塞超过 {stall['lagMs']}ms，当前调用栈:\n{stall['stack']}")
+
+loop_watchdog = EventLoopWatchdog(settings.LOOP_LAG_THRESHOLD_MS / 1000)
+
+# 调试模式下记录在事件循环中执行的同步网络/磁盘调用: 调用位置 -> 统计信息
+blocking_calls: Dict[str, Dict[str, Any]] = {}
+BLOCKING_AUDIT_EVENTS = {"open", "socket.connect", "socket.getaddrinfo", "socket.sendto", "os.listdir", "shutil.copyfile"}
+_audit_state = threading.local()
+
+def blocking_call_audit_hook(event: str, args):
+    if event not in BLOCKING_AUDIT_EVENTS or getattr(_audit_state, "active", False):
+        return
+    # 只关心在事件循环线程中、有协程正在运行时发生的调用
+    if threading.get_ident() != loop_watchdog.loop_thread_id or asyncio._get_running_loop() is None:
+        return
+    _audit_state.active = True
+    try:
+        # 以本模块中最内层的调用位置作为记录键
+        frame = sys._getframe(1)
+        site_frame = None
+        while frame is not None:
+            if frame.f_code.co_filename == __file__:
+                site_frame = frame
+                break
+            frame = frame.f_back
+        site = f"{site_frame.f_code.co_name}:{site_frame.f_lineno}" if site_frame else "外部库"
+        key = f"{event} @ {site}"
+        entry = blocking_calls.get(key)
+        if entry is None:
+            entry = blocking_calls[key] = {"event": event, "site": site, "count": 0, "firstSeen": datetime.now().isoformat(), "lastArgs": None}
+            logger.warning(f"检测到事件循环中的同步调用: {key}")
+        entry["count"] += 1
+        entry["lastArgs"] = str(args[0])[:200] if args else None
+        METRIC_BLOCKING_CALLS.inc(event=event)
+    finally:
+        _audit_state.active = False
+
+# ---- 多进程协调 ----
+# 多个后端进程（uvicorn --workers 或多个容器）共享一个SQLite文件：
+# - task_leases: 每个任务同一时间只由持有租约的进程执行，按 rendezvous 哈希在存活进程间分配，
+#   进程停止心跳后租约过期，由其余进程接管
+# - bus: 广播消息表，各进程把广播写入该表并读取其他进程的消息，
+#   转发给本进程的WebSocket连接，同时同步任务、订单和配置的变化
+COORDINATION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL, started REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS task_leases (task_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS bus (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, created REAL NOT NULL, payload TEXT NOT NULL);
+"""
+# 只在本进程内有意义的消息，不转发给其他进程（日志逐条转发会占满消息表，各进程只保留自己的日志）
+CLUSTER_LOCAL_MESSAGE_TYPES = {"connection_status", "ping", "pong", "initial_data", "log"}
+# 任务和订单文件的写入租约，与任务租约存放在同一张表中
+STATE_FILES_LEASE = "__state_files__"
+# 进程间的控制消息，不发送给WebSocket客户端
+CLUSTER_INTERNAL_MESSAGE_TYPES = {"config_updated", "attempt_cancel", "catalog_rules_updated"}
+
+class ClusterCoordinator:
+    def __init__(self, path: str, lease_seconds: int):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.owned: frozenset = frozenset()
+        self.holds_state_files = False
+        self.workers: List[str] = [self.worker_id]
+        self.outbox = queue.Queue()
+        self.loop = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.last_seen_id = 0
+        self.stats = {"published": 0, "received": 0, "acquired": 0, "released": 0}
+    
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        conn = self.connect()
+        try:
+            conn.executescript(COORDINATION_SCHEMA)
+            # 不重放启动前的广播
+            self.last_seen_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus").fetchone()[0]
+        finally:
+            conn.close()
+        self.thread = threading.Thread(target=self._run, name="cluster-coordinator", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """停止心跳并释放本进程的全部租约，使其他进程可以立即接管"""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join(timeout=5)
+        conn = self.connect()
+        try:
+            self._flush_outbox(conn)
+            conn.execute("DELETE FROM task_leases WHERE owner = ?", (self.worker_id,))
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        finally:
+            conn.close()
+        self.owned = frozenset()
+        self.holds_state_files = False
+    
+    def owns(self, task_id: str) -> bool:
+        return task_id in self.owned
+    
+    def live_workers(self) -> set:
+        """直接从数据库读取心跳未过期的进程（可在协调线程启动前调用），本进程始终视为存活"""
+        conn = self.connect()
+        try:
+            conn.executescript(COORDINATION_SCHEMA)
+            rows = conn.execute("SELECT worker_id FROM workers WHERE heartbeat >= ?", (time.time() - self.lease_seconds,))
+            return {row[0] for row in rows} | {self.worker_id}
+        finally:
+            conn.close()
+    
+    def preferred_owner(self, task_id: str) -> str:
+        return max(self.workers, key=lambda worker: hashlib.sha1(f"{worker}:{task_id}".encode()).digest())
+    
+    def publish(self, message: Dict[str, Any]):
+        self.outbox.put(json_dumps(message))
+    
+    def _run(self):
+        conn = self.connect()
+        last_heartbeat = 0.0
+        while not self.stopping.is_set():
+            try:
+                if time.time() - last_heartbeat >= self.lease_seconds / 3:
+                    self._heartbeat(conn)
+                    last_heartbeat = time.time()
+                self._flush_outbox(conn)
+                self._poll(conn)
+            except Exception as e:
+                logger.error(f"多进程协调失败: {e}")
+            self.stopping.wait(0.05)
+        conn.close()
+    
+    def _snapshot_local_state(self):
+        """在事件循环中复制任务ID和进行中的尝试，协调线程不直接遍历事件循环中的字典"""
+        async def snapshot():
+            return frozenset(tasks), frozenset(inflight_attempts)
+        future = asyncio.run_coroutine_threadsafe(snapshot(), self.loop)
+        deadline = time.monotonic() + self.lease_seconds / 3
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                if self.stopping.is_set() or time.monotonic() > deadline:
+                    future.cancel()
+                    raise RuntimeError("事件循环无响应，跳过本次心跳")
+    
+    def _heartbeat(self, conn: sqlite3.Connection):
+        local_tasks, running = self._snapshot_local_state()
+        now = time.time()
+        expires = now + self.lease_seconds
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO workers VALUES (?, ?, ?) ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                         (self.worker_id, now, now))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - self.lease_seconds,))
+            self.workers = sorted(row[0] for row in conn.execute("SELECT worker_id FROM workers")) or [self.worker_id]
+            conn.execute("DELETE FROM bus WHERE created < ?", (now - 60,))
+            
+            # 释放已删除的任务，以及按当前进程列表不再属于本进程的空闲任务（新进程加入后重新分配）
+            release = [task_id for task_id in self.owned
+                       if task_id not in local_tasks or (self.preferred_owner(task_id) != self.worker_id and task_id not in running)]
+            for task_id in release:
+                conn.execute("DELETE FROM task_leases WHERE task_id = ? AND owner = ?", (task_id, self.worker_id))
+            self.stats["released"] += len(release)
+            # 续约自己的租约，并获取分配给本进程且未被占用（或租约已过期）的任务
+            conn.execute("UPDATE task_leases SET expires = ? WHERE owner = ?", (expires, self.worker_id))
+            for task_id in local_tasks:
+                if task_id in self.owned or self.preferred_owner(task_id) != self.worker_id:
+                    continue
+                cursor = conn.execute(
+                    "INSERT INTO task_leases VALUES (?, ?, ?) ON CONFLICT(task_id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                    "WHERE task_leases.expires < ?", (task_id, self.worker_id, expires, now))
+                self.stats["acquired"] += cursor.rowcount
+            # 任务和订单文件只由一个进程写入，租约过期后由其他进程接管
+            conn.execute(
+                "INSERT INTO task_leases VALUES (?, ?, ?) ON CONFLICT(task_id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE task_leases.owner = excluded.owner OR task_leases.expires < ?", (STATE_FILES_LEASE, self.worker_id, expires, now))
+            owned = frozenset(row[0] for row in conn.execute(
+                "SELECT task_id FROM task_leases WHERE owner = ? AND expires > ?", (self.worker_id, now)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        holds_state_files = STATE_FILES_LEASE in owned
+        self.owned = owned - {STATE_FILES_LEASE}
+        if holds_state_files and not self.holds_state_files:
+            self.loop.call_soon_threadsafe(save_state_files)
+        self.holds_state_files = holds_state_files
+    
+    def _flush_outbox(self, conn: sqlite3.Connection):
+        batch = []
+        while True:
+            try:
+                batch.append(self.outbox.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT INTO bus (origin, created, payload) VALUES (?, ?, ?)", [(self.worker_id, now, payload) for payload in batch])
+        conn.execute("COMMIT")
+        self.stats["published"] += len(batch)
+    
+    def _poll(self, conn: sqlite3.Connection):
+        rows = conn.execute("SELECT id, origin, payload FROM bus WHERE id > ? ORDER BY id", (self.last_seen_id,)).fetchall()
+        if not rows:
+            return
+        self.last_seen_id = rows[-1][0]
+        messages = [json_loads(payload) for _, origin, payload in rows if origin != self.worker_id]
+        if messages:
+            self.stats["received"] += len(messages)
+            self.loop.call_soon_threadsafe(handle_cluster_messages, messages)
+    
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "workerId": self.worker_id,
+            "workers": self.workers,
+            "ownedTasks": sorted(self.owned),
+            "holdsStateFiles": self.holds_state_files,
+            "stats": dict(self.stats),
+        }
+
+cluster = ClusterCoordinator(settings.COORDINATION_DB, settings.WORKER_LEASE_SECONDS) if settings.COORDINATION_DB else None
+
+# 多进程模式下每个进程写自己的下单日志（文件名以进程ID为后缀），只恢复已停止心跳的进程留下的日志
+def attempt_journal_path() -> str:
+    if cluster:
+        return f"{settings.ATTEMPT_JOURNAL_FILE}.{cluster.worker_id}"
+    return settings.ATTEMPT_JOURNAL_FILE
+
+attempt_journal = AttemptJournal(attempt_journal_path()) if settings.ATTEMPT_JOURNAL_FILE else None
+
+# 启动状态：任务和订单加载完成后 ready 为 True
+startup_state: Dict[str, Any] = {"ready": False, "startedAt": time.time(), "loadMs": None, "pendingSaves": set()}
+
+# 加载完成前拒绝修改数据的请求，避免在合并已保存的数据前产生冲突的修改
+class RejectWritesUntilReadyMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http" and not startup_state["ready"] and scope["path"].startswith("/api/")
+                and scope["method"] in ("POST", "PUT", "PATCH", "DELETE")):
+            response = JSONResponse(status_code=503, content={"detail": "正在加载任务和订单，请稍后重试"}, headers={"Retry-After": "2"})
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+async def load_state():
+    """在线程中读取订单和任务，合并加载期间新建的数据，处理中断的尝试后启动任务循环"""
+    global tasks, orders
+    load_started = time.monotonic()
+    try:
+        loaded_orders, loaded_tasks = await asyncio.gather(run_in_thread_pool(read_orders_file), run_in_thread_pool(read_tasks_file))
+        if loaded_orders:
+            orders = loaded_orders + orders
+        if loaded_tasks:
+            tasks = {**loaded_tasks, **tasks}
+        add_log("info", f"已加载 {len(tasks)} 条任务和 {len(orders)} 条订单历史")
+        await recover_interrupted_attempts()
+    except Exception as e:
+        add_log("error", f"加载任务和订单失败: {str(e)}")
+    startup_state["loadMs"] = round((time.monotonic() - load_started) * 1000)
+    startup_state["ready"] = True
+    # 加载期间被推迟的保存（如其他进程的消息、恢复中断的尝试）
+    if "orders" in startup_state["pendingSaves"]:
+        save_orders_to_file()
+    if "tasks" in startup_state["pendingSaves"]:
+        save_tasks_to_file()
+    startup_state["pendingSaves"].clear()
+    if not shutting_down:
+        asyncio.create_task(task_execution_loop())
+
 # 在lifespan中启动状态广播
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global shutting_down
     # 启动事件
-    # 加载配置和订单历史
+    # 加载配置（很小，同步加载），订单和任务在线程中加载
     load_config_from_file()
-    load_orders_from_file()
-    load_tasks_from_file()  # 加载保存的任务
+    load_cart_recipes()
+    load_catalog_state()
+    if settings.FAST_BOOT:
+        # 快速启动：不等待任务和订单加载完成就开始接受连接，加载完成后才启动任务循环
+        asyncio.create_task(load_state())
+    else:
+        await load_state()
     
-    # 启动任务执行循环和状态广播
-    asyncio.create_task(task_execution_loop())
+    # 启动状态广播
     asyncio.create_task(broadcast_connection_status())  # 添加状态广播
+    if settings.CATALOG_WATCH_INTERVAL > 0:
+        asyncio.create_task(catalog_watch_loop())
+    if settings.ORDER_TRACKER_INTERVAL > 0:
+        asyncio.create_task(order_tracker.run())
+    loop_watchdog.start(asyncio.get_running_loop())
+    asyncio.create_task(loop_watchdog.run())
+    if cluster:
+        cluster.start(asyncio.get_running_loop())
+        add_log("info", f"多进程协调已启用: {cluster.worker_id}")
+        if attempt_journal:
+            asyncio.create_task(journal_recovery_loop())
+    if get_process_pool():
+        # 预先启动子进程，避免第一次获取产品目录时等待进程启动
+        get_process_pool().submit(int)
+    if settings.LOOP_BLOCKING_DEBUG:
+        # 审计钩子无法移除，只在调试模式下安装
+        sys.addaudithook(blocking_call_audit_hook)
+        add_log("warning", "已启用事件循环同步调用检测（调试模式）")
     
     add_log("info", "OVH Titan Sniper 后端已启动")
     yield
     # 关闭事件
-    # 保存配置和订单历史
-    save_config_to_file()
-    save_orders_to_file()
-    save_tasks_to_file()  # 保存任务
+    # 停止启动新的尝试，等待进行中的结账完成
+    shutting_down = True
+    await drain_inflight_attempts(settings.SHUTDOWN_GRACE_SECONDS)
+    # 保存配置和订单历史（状态尚未加载完成时不保存，避免覆盖文件；多进程模式下在释放状态文件租约前由持有者保存）
+    if startup_state["ready"] and holds_state_files():
+        save_config_to_file()
+        save_orders_to_file()
+        save_tasks_to_file()  # 保存任务
+    if cluster:
+        await asyncio.to_thread(cluster.stop)
+    if restock_history:
+        restock_history.flush()
+    if availability_trace:
+        availability_trace.flush()
+    if offload_processes:
+        offload_processes.shutdown(wait=False, cancel_futures=True)
     
     add_log("info", "OVH Titan Sniper 后端已关闭，所有数据已保存")
 
@@ -518,51 +1828,244 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Age", "X-Availability-Age", "ETag", "X-State-Version"],
 )
 
+# ---- 响应压缩 ----
+# 按 Accept-Encoding 优先使用brotli，其次gzip。流式响应逐块压缩，不在内存中拼接完整响应体；
+# 已带 Content-Encoding 的响应（如预压缩的产品目录）、非JSON/文本响应和小于 COMPRESSION_MIN_SIZE 的响应原样发送。
+COMPRESSIBLE_MEDIA_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip())
+    if brotli and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=4)
+            self.compress, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(5, zlib.DEFLATED, 31)  # wbits=31: gzip格式
+            self.compress, self.finish = compressor.compress, compressor.flush
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        if_none_match = [tag.strip() for tag in Headers(scope=scope).get("if-none-match", "").split(",")]
+        start_message = None
+        compressor = None
+        
+        async def send_compressed(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                # 等第一块响应体到达后再决定是否压缩
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(scope=start)
+                body = message.get("body", b"")
+                etag = headers.get("etag")
+                if start["status"] == 304 and etag and not etag.startswith("W/") and "W/" + etag in if_none_match:
+                    # 客户端持有的是压缩后的弱校验 ETag，304 返回与之相同的形式
+                    headers["ETag"] = "W/" + etag
+                if ("content-encoding" in headers or start["status"] != 200
+                        or not headers.get("content-type", "").startswith(COMPRESSIBLE_MEDIA_TYPES)
+                        or (not message.get("more_body", False) and len(body) < self.minimum_size)):
+                    await send(start)
+                    return await send(message)
+                compressor = StreamCompressor(encoding)
+                if "content-length" in headers:
+                    del headers["content-length"]
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # 压缩后的表示与原始字节不同，ETag 改为弱校验
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                await send(start)
+            if compressor is None:
+                return await send(message)
+            more_body = message.get("more_body", False)
+            body = compressor.compress(message.get("body", b""))
+            if not more_body:
+                body += compressor.finish()
+            elif not body:
+                return
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+        
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+app.add_middleware(RejectWritesUntilReadyMiddleware)
+
 # 初始化状态变量
 api_config: Optional[ApiConfig] = None
 tasks: Dict[str, TaskStatus] = {}
 orders: List[OrderHistory] = []
 connections: List[WebSocket] = []
 logs: List[Dict[str, str]] = []
+logs_appended = 0  # 累计追加的日志条数，作为日志的版本号
+
+def append_log_entry(log_entry: Dict[str, str]):
+    global logs_appended
+    logs.append(log_entry)
+    logs_appended += 1
+    # 保持日志数量在合理范围内
+    if len(logs) > 1000:
+        logs.pop(0)
 
 # OVH客户端实例
 ovh_client = None
 
 # WebSocket连接管理
 async def broadcast_message(message: Dict[str, Any]):
-    """广播消息给所有WebSocket连接"""
+    """广播消息给所有WebSocket连接（多进程模式下同时转发给其他进程）"""
+    if cluster and message['type'] not in CLUSTER_LOCAL_MESSAGE_TYPES:
+        cluster.publish(message)
     # 只为非日志消息和非心跳消息记录广播信息
     if message['type'] not in ['log', 'ping', 'pong']:
         add_log("debug", f"广播消息: type={message['type']}")
-    
+    await send_to_connections(message)
+
+async def send_to_connections(message: Dict[str, Any]):
+    """把消息发送给本进程的所有WebSocket连接"""
     global connections  # 确保我们使用全局连接列表
-    disconnected = []
+    METRIC_WS_PENDING_BROADCASTS.inc()
+    try:
+        disconnected = []
+        # 只序列化一次，所有连接发送同一个字符串
+        payload = None
     
-    # 在开始前先检查连接是否有效
-    for i, websocket in enumerate(connections):
-        try:
-            # 检查连接是否打开
-            if websocket.client_state != 1:  # CONNECTED状态
-                add_log("debug", f"连接 {i} 已关闭，标记为断开")
-                disconnected.append(websocket)
-                continue
+        # 在开始前先检查连接是否有效
+        for i, websocket in enumerate(connections):
+            try:
+                # 检查连接是否打开
+                if websocket.client_state != WebSocketState.CONNECTED:  # CONNECTED状态
+                    add_log("debug", f"连接 {i} 已关闭，标记为断开")
+                    disconnected.append(websocket)
+                    continue
                 
-            await websocket.send_json(message)
-            # 取消每次发送的成功日志，减少日志数量
-        except WebSocketDisconnect:
-            add_log("warning", f"广播消息时发现断开的连接 (索引 {i})")
-            disconnected.append(websocket)
-        except Exception as e:
-            add_log("error", f"广播消息失败 (索引 {i}): {str(e)}")
-            # 任何错误都表示连接可能有问题，添加到断开列表
-            disconnected.append(websocket)
+                if payload is None:
+                    payload = json_dumps(message)
+                await websocket.send_text(payload)
+                # 取消每次发送的成功日志，减少日志数量
+            except WebSocketDisconnect:
+                add_log("warning", f"广播消息时发现断开的连接 (索引 {i})")
+                disconnected.append(websocket)
+            except Exception as e:
+                add_log("error", f"广播消息失败 (索引 {i}): {str(e)}")
+                # 任何错误都表示连接可能有问题，添加到断开列表
+                disconnected.append(websocket)
     
-    # 移除已断开的连接
-    if disconnected:
-        connections = [conn for conn in connections if conn not in disconnected]
-        add_log("info", f"已清理 {len(disconnected)} 个断开的WebSocket连接，剩余 {len(connections)} 个活动连接")
+        # 移除已断开的连接
+        if disconnected:
+            connections = [conn for conn in connections if conn not in disconnected]
+            add_log("info", f"已清理 {len(disconnected)} 个断开的WebSocket连接，剩余 {len(connections)} 个活动连接")
+    finally:
+        METRIC_WS_PENDING_BROADCASTS.dec()
+
+def handle_cluster_messages(messages: List[Dict[str, Any]]):
+    """应用其他进程广播的变化，并转发给本进程的WebSocket连接"""
+    global tasks, orders, ovh_client
+    tasks_changed = orders_changed = False
+    for message in messages:
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        try:
+            if msg_type in ("task_created", "task_updated"):
+                tasks_changed |= apply_task_data(data)
+            elif msg_type == "task_deleted":
+                tasks.pop(data["id"], None)
+                cancel_attempt(data["id"])
+                attempt_traces.pop(data["id"], None)
+                tasks_changed = True
+            elif msg_type == "tasks_bulk_updated":
+                for task_data in data.get("tasks", []):
+                    tasks_changed |= apply_task_data(task_data)
+                for task_id in data.get("deleted", []):
+                    if tasks.pop(task_id, None) is not None:
+                        tasks_changed = True
+                    cancel_attempt(task_id)
+                    attempt_traces.pop(task_id, None)
+            elif msg_type == "tasks_cleared":
+                tasks = {}
+                for task_id in list(inflight_attempts):
+                    cancel_attempt(task_id)
+                attempt_traces.clear()
+                tasks_changed = True
+            elif msg_type in ("order_completed", "order_failed"):
+                existing = next((existing for existing in orders if existing.id == data["id"]), None)
+                if existing is not None:
+                    orders_changed |= existing.update_fields(data)
+                else:
+                    order = OrderHistory.from_dict(data)
+                    fleet_task = order.taskId in tasks and tasks[order.taskId].is_fleet
+                    add_order(order, dedupe=not fleet_task)
+            elif msg_type == "config_updated":
+                load_config_from_file()
+                ovh_client = None
+            elif msg_type == "attempt_cancel":
+                cancel_attempt(data["id"])
+            elif msg_type == "orders_updated":
+                updated = {order_data["id"]: order_data for order_data in data.get("orders", [])}
+                for order in orders:
+                    if order.id in updated:
+                        orders_changed |= order.update_fields(updated[order.id])
+            elif msg_type == "catalog_changed":
+                catalog_events.extend(data.get("events", []))
+            elif msg_type == "catalog_rules_updated":
+                load_catalog_state()
+        except Exception as e:
+            logger.error(f"处理其他进程的消息失败 (type={msg_type}): {e}")
+            continue
+        if msg_type not in CLUSTER_INTERNAL_MESSAGE_TYPES:
+            asyncio.create_task(send_to_connections(message))
+    # 每批消息只保存一次，且只有持有状态文件租约的进程真正写入
+    if tasks_changed:
+        save_tasks_to_file()
+    if orders_changed:
+        save_orders_to_file()
+
+def apply_task_data(data: Dict[str, Any]) -> bool:
+    """
+    应用其他进程广播的任务，返回是否有变化。已有的任务直接按字典原地更新（不构造临时记录），
+    本进程进行中的尝试持有的任务对象保持有效，内容未变化的消息不改变版本号和 ETag。
+    """
+    task = tasks.get(data["id"])
+    if task is None:
+        tasks[data["id"]] = TaskStatus.from_dict(data)
+        return True
+    return task.update_fields(data)
+
+def save_state_files():
+    """取得状态文件租约后写入当前的任务和订单"""
+    if startup_state["ready"]:
+        save_orders_to_file()
+        save_tasks_to_file()
+def publish_cluster_event(msg_type: str, data: Dict[str, Any]):
+    """只发送给其他进程的控制消息"""
+    if cluster:
+        cluster.publish({"type": msg_type, "data": data})
 
 def add_log(level: str, message: str):
     timestamp = datetime.now().isoformat()
@@ -571,11 +2074,7 @@ def add_log(level: str, message: str):
         "level": level,
         "message": message
     }
-    logs.append(log_entry)
-    
-    # 保持日志数量在合理范围内
-    if len(logs) > 1000:
-        logs.pop(0)
+    append_log_entry(log_entry)
     
     # 将日志广播给所有连接的客户端
     asyncio.create_task(broadcast_message({
@@ -592,7 +2091,7 @@ def get_ovh_client(task_id=None):
     
     if not ovh_client:
         try:
-            ovh_client = LoggingOVHClient(
+            ovh_client = logging_ovh_client_class()(
                 endpoint=api_config.endpoint,
                 application_key=api_config.appKey,
                 application_secret=api_config.appSecret,
@@ -606,8 +2105,13 @@ def get_ovh_client(task_id=None):
     
     return ovh_client
 
+# 在线程中执行同步的OVH客户端调用，避免阻塞事件循环，使多个结账可以并发进行
+async def ovh_call(client, method: str, path: str, **kwargs):
+    return await asyncio.to_thread(getattr(client, method), path, **kwargs)
+
 # 发送Telegram消息
-def send_telegram_msg(message: str):
+async def send_telegram_msg(message: str):
+    """发送Telegram通知；HTTP请求在线程中执行，不阻塞事件循环"""
     if not api_config:
         add_log("warning", "Telegram消息未发送: API配置不存在")
         return False
@@ -632,7 +2136,7 @@ def send_telegram_msg(message: str):
 
     try:
         add_log("info", f"发送HTTP请求到Telegram API: {url[:45]}...")
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = await asyncio.to_thread(requests.post, url, json=payload, headers=headers, timeout=10)
         add_log("info", f"Telegram API响应: 状态码={response.status_code}")
         
         if response.status_code == 200:
@@ -658,33 +2162,717 @@ def send_telegram_msg(message: str):
         return False
 
 # 获取服务器列表
-async def fetch_product_catalog(subsidiary: str = 'IE'):
+# 最近一次获取的产品目录: subsidiary -> {"raw": 原始JSON字节, "sha1", "index": planCode -> 概要, "compressed": 编码 -> 压缩副本, "fetchedAt"}
+catalog_cache: Dict[str, Dict[str, Any]] = {}
+
+def build_catalog_index(raw: bytes) -> Dict[str, Dict[str, Any]]:
+    """解析产品目录并建立 planCode 索引（在进程池中执行）"""
+    catalog = json_loads(raw)
+    index = {}
+    for plan in catalog.get("plans", []):
+        plan_code = plan.get("planCode")
+        if not plan_code:
+            continue
+        prices = [pricing.get("price") for pricing in plan.get("pricings", [])
+                  if "installation" not in (pricing.get("capacities") or []) and isinstance(pricing.get("price"), (int, float))]
+        index[plan_code] = {
+            "planCode": plan_code,
+            "invoiceName": plan.get("invoiceName"),
+            "product": plan.get("product"),
+            "addonFamilies": {
+                family.get("name"): {
+                    "mandatory": family.get("mandatory", False),
+                    "default": family.get("default"),
+                    "addons": family.get("addons", []),
+                }
+                for family in plan.get("addonFamilies", [])
+            },
+            "price": min(prices) if prices else None,
+        }
+        # 每个型号的指纹，刷新目录时只需要详细比较指纹变化的型号
+        index[plan_code]["fingerprint"] = hashlib.sha1(json.dumps(index[plan_code], sort_keys=True, default=str).encode()).hexdigest()
+    return index
+
+def download_catalog(subsidiary: str) -> bytes:
+    response = requests.get(
+        f"https://eu.api.ovh.com/v1/order/catalog/public/eco?ovhSubsidiary={subsidiary}",
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.content
+
+def compress_catalog(raw: bytes) -> Dict[str, bytes]:
+    """压缩产品目录（在进程池中执行），返回 编码 -> 压缩后的字节；只在目录内容变化时执行，使用中等压缩级别"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    compressed = {"gzip": compressor.compress(raw) + compressor.flush()}
+    if brotli:
+        compressed["br"] = brotli.compress(raw, quality=5)
+    return compressed
+
+catalog_fetch_locks: Dict[str, asyncio.Lock] = {}
+
+async def fetch_product_catalog(subsidiary: str = 'IE', force: bool = False) -> bytes:
+    """
+    获取产品目录，返回原始JSON字节，事件循环不解析目录。
+    缓存未超过 CATALOG_CACHE_TTL 时直接返回；否则在线程中下载，内容（SHA1）变化时才在进程池中重新建立索引和压缩副本。
+    同一区域的并发请求共用一次下载。
+    """
+    lock = catalog_fetch_locks.setdefault(subsidiary, asyncio.Lock())
+    async with lock:
+        cached = catalog_cache.get(subsidiary)
+        if cached and not force and time.time() - cached["fetchedAt"] < settings.CATALOG_CACHE_TTL:
+            return cached["raw"]
+        try:
+            raw = await asyncio.to_thread(download_catalog, subsidiary)
+            digest = await asyncio.to_thread(lambda: hashlib.sha1(raw).hexdigest())
+            if cached and cached["sha1"] == digest:
+                cached["fetchedAt"] = time.time()
+                return cached["raw"]
+            index, compressed = await asyncio.gather(run_in_process_pool(build_catalog_index, raw), run_in_process_pool(compress_catalog, raw))
+            catalog_cache[subsidiary] = {"raw": raw, "sha1": digest, "index": index, "compressed": compressed, "fetchedAt": time.time()}
+        except Exception as e:
+            add_log("error", f"获取产品目录失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"获取产品目录失败: {str(e)}")
     try:
-        response = requests.get(
-            f"https://eu.api.ovh.com/v1/order/catalog/public/eco?ovhSubsidiary={subsidiary}",
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
+        await detect_catalog_changes(subsidiary, index)
     except Exception as e:
-        add_log("error", f"获取产品目录失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"获取产品目录失败: {str(e)}")
+        add_log("error", f"检测产品目录变化失败: {str(e)}")
+    return raw
+
+# ---- 产品目录变化检测 ----
+# 保存每个型号的指纹和概要（价格、附加选项），刷新目录时与上一次比较，
+# 产生 plan_added / plan_removed / addons_added / addons_removed / price_changed 事件，
+# 通过 WebSocket (catalog_changed) 和 Telegram 通知，并按规则为新型号自动创建任务。
+catalog_fingerprints: Dict[str, Dict[str, Dict[str, Any]]] = {}
+catalog_events = deque(maxlen=500)
+catalog_rules: List[CatalogRule] = []
 
-# 检查服务器可用性
+def catalog_plan_summary(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "fingerprint": entry["fingerprint"],
+        "invoiceName": entry.get("invoiceName"),
+        "price": entry.get("price"),
+        "addons": sorted({addon for family in entry["addonFamilies"].values() for addon in family.get("addons") or []}),
+    }
+
+def diff_catalog(previous: Dict[str, Dict[str, Any]], index: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    events = []
+    for plan_code, entry in index.items():
+        old = previous.get(plan_code)
+        if old is None:
+            events.append({"type": "plan_added", "planCode": plan_code, "invoiceName": entry.get("invoiceName"), "price": entry.get("price")})
+            continue
+        if old["fingerprint"] == entry["fingerprint"]:
+            continue
+        new = catalog_plan_summary(entry)
+        added = sorted(set(new["addons"]) - set(old["addons"]))
+        removed = sorted(set(old["addons"]) - set(new["addons"]))
+        if added:
+            events.append({"type": "addons_added", "planCode": plan_code, "addons": added})
+        if removed:
+            events.append({"type": "addons_removed", "planCode": plan_code, "addons": removed})
+        if old["price"] != new["price"]:
+            events.append({"type": "price_changed", "planCode": plan_code, "oldPrice": old["price"], "price": new["price"]})
+    for plan_code, old in previous.items():
+        if plan_code not in index:
+            events.append({"type": "plan_removed", "planCode": plan_code, "invoiceName": old.get("invoiceName")})
+    return events
+
+def load_catalog_state():
+    global catalog_fingerprints, catalog_rules
+    if os.path.exists(CATALOG_FINGERPRINTS_FILE):
+        try:
+            with open(CATALOG_FINGERPRINTS_FILE, "r") as f:
+                catalog_fingerprints = json.load(f)
+        except Exception as e:
+            add_log("error", f"加载产品目录指纹失败: {str(e)}")
+    if os.path.exists(CATALOG_RULES_FILE):
+        try:
+            with open(CATALOG_RULES_FILE, "r") as f:
+                catalog_rules = [CatalogRule(**rule) for rule in json.load(f)]
+        except Exception as e:
+            add_log("error", f"加载产品目录规则失败: {str(e)}")
+
+def save_catalog_fingerprints():
+    try:
+        with measure_persistence("catalog_fingerprints"), open(CATALOG_FINGERPRINTS_FILE, "w") as f:
+            json.dump(catalog_fingerprints, f)
+    except Exception as e:
+        add_log("error", f"保存产品目录指纹失败: {str(e)}")
+
+def save_catalog_rules():
+    try:
+        with measure_persistence("catalog_rules"), open(CATALOG_RULES_FILE, "w") as f:
+            json.dump([rule.dict() for rule in catalog_rules], f)
+    except Exception as e:
+        add_log("error", f"保存产品目录规则失败: {str(e)}")
+
+def catalog_rule_matches(rule: CatalogRule, event: Dict[str, Any]) -> bool:
+    if not rule.enabled or not (rule.planCodePrefix or rule.nameContains):
+        return False
+    if rule.planCodePrefix and not event["planCode"].startswith(rule.planCodePrefix):
+        return False
+    if rule.nameContains and rule.nameContains.lower() not in (event.get("invoiceName") or "").lower():
+        return False
+    return True
+
+def format_catalog_event(event: Dict[str, Any]) -> str:
+    plan = event["planCode"]
+    if event["type"] == "plan_added":
+        return f"新型号 {plan} ({event.get('invoiceName') or '-'})，价格 {event.get('price')}"
+    if event["type"] == "plan_removed":
+        return f"型号下架 {plan} ({event.get('invoiceName') or '-'})"
+    if event["type"] == "addons_added":
+        return f"{plan} 新增选项: {', '.join(event['addons'])}"
+    if event["type"] == "addons_removed":
+        return f"{plan} 移除选项: {', '.join(event['addons'])}"
+    return f"{plan} 价格变化: {event.get('oldPrice')} -> {event.get('price')}"
+
+async def detect_catalog_changes(subsidiary: str, index: Dict[str, Dict[str, Any]]):
+    global catalog_fingerprints
+    # 多进程模式下只由一个进程检测，避免重复通知和重复创建任务
+    if cluster and cluster.workers and cluster.preferred_owner(f"catalog:{subsidiary}") != cluster.worker_id:
+        return
+    previous = catalog_fingerprints.get(subsidiary)
+    if previous is not None:
+        unchanged = all(previous.get(plan_code, {}).get("fingerprint") == entry["fingerprint"] for plan_code, entry in index.items())
+        if unchanged and len(previous) == len(index):
+            return
+    summaries = {plan_code: catalog_plan_summary(entry) for plan_code, entry in index.items()}
+    catalog_fingerprints = {**catalog_fingerprints, subsidiary: summaries}
+    save_catalog_fingerprints()
+    if previous is None:
+        # 第一次获取该区域的目录，只记录基线
+        add_log("info", f"已记录产品目录基线 ({subsidiary})，共 {len(index)} 个型号")
+        return
+    
+    events = diff_catalog(previous, index)
+    if not events:
+        return
+    detected_at = datetime.now().isoformat()
+    for event in events:
+        event["subsidiary"] = subsidiary
+        event["timestamp"] = detected_at
+        catalog_events.append(event)
+    add_log("info", f"产品目录 ({subsidiary}) 发生 {len(events)} 项变化")
+    await broadcast_message({"type": "catalog_changed", "data": {"subsidiary": subsidiary, "events": events}})
+    lines = [format_catalog_event(event) for event in events]
+    more = f"\n... 另有 {len(lines) - 20} 项变化" if len(lines) > 20 else ""
+    await send_telegram_msg(f"{api_config.iam if api_config else 'OVH'}: 产品目录 ({subsidiary}) 变化\n" + "\n".join(lines[:20]) + more)
+    
+    # 按规则为新型号创建任务，全部创建后只保存和广播一次
+    created = []
+    for event in events:
+        if event["type"] != "plan_added":
+            continue
+        for rule in catalog_rules:
+            if not catalog_rule_matches(rule, event):
+                continue
+            config = ServerConfig(
+                name=f"{rule.name}: {event.get('invoiceName') or event['planCode']}",
+                planCode=event["planCode"], datacenter=rule.datacenter, options=rule.options,
+                maxRetries=rule.maxRetries, taskInterval=rule.taskInterval, priority=rule.priority,
+            )
+            created.append(build_task(config))
+            add_log("info", f"规则 {rule.name} 为新型号 {event['planCode']} 创建了任务")
+            break
+    if created:
+        for task in created:
+            tasks[task.id] = task
+        await commit_bulk_change("create", created)
+
+async def catalog_watch_loop():
+    while True:
+        await asyncio.sleep(settings.CATALOG_WATCH_INTERVAL)
+        try:
+            await fetch_product_catalog(api_config.zone if api_config else settings.ZONE, force=True)
+        except Exception as e:
+            add_log("warning", f"定期刷新产品目录失败: {str(e)}")
+
+# 可用性结果缓存: (planCode, 排序后的选项) -> {"data", "fetchedAt"}，REST接口和任务引擎共用
+availability_cache: Dict[tuple, Dict[str, Any]] = {}
+# 正在进行的上游请求，相同键的并发请求共用同一个结果
+availability_inflight: Dict[tuple, asyncio.Task] = {}
+availability_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+def availability_cache_key(planCode: str, options=None) -> tuple:
+    option_pairs = sorted((option.label, option.value) for option in options or [] if option.label and option.value)
+    return (planCode, tuple(option_pairs))
+
+async def get_availability(planCode: str, options=None, task_id=None):
+    """
+    获取服务器可用性，优先使用缓存
+    :return: (可用性数据, 数据已存在的秒数)
+    """
+    key = availability_cache_key(planCode, options)
+    cached = availability_cache.get(key)
+    if cached:
+        age = time.monotonic() - cached["fetchedAt"]
+        if age < settings.AVAILABILITY_CACHE_TTL:
+            availability_cache_stats["hits"] += 1
+            return cached["data"], age
+    
+    fetch = availability_inflight.get(key)
+    if fetch:
+        availability_cache_stats["coalesced"] += 1
+    else:
+        availability_cache_stats["misses"] += 1
+        fetch = asyncio.create_task(fetch_availability(planCode, options, task_id))
+        availability_inflight[key] = fetch
+        fetch.add_done_callback(lambda _: availability_inflight.pop(key, None))
+    
+    # shield: 单个调用方被取消（如尝试超时）时不影响其他等待同一结果的调用方
+    data = await asyncio.shield(fetch)
+    entry = availability_cache.get(key)
+    return data, (time.monotonic() - entry["fetchedAt"]) if entry else 0.0
+
+def store_availability(key: tuple, data):
+    now = time.monotonic()
+    if len(availability_cache) > 500:
+        for stale_key in [k for k, v in availability_cache.items() if now - v["fetchedAt"] >= settings.AVAILABILITY_CACHE_TTL]:
+            del availability_cache[stale_key]
+    availability_cache[key] = {"data": data, "fetchedAt": now}
+
+# 检查服务器可用性（带缓存）
 async def check_availability(planCode: str, options=None, task_id=None):
+    data, _ = await get_availability(planCode, options, task_id)
+    return data
+
+# 可用性日志级别: "off" 只更新内存表, "summary" 每 AVAILABILITY_SUMMARY_INTERVAL 秒汇总记录一条日志,
+# "detail" 每次检查记录一条概要日志并逐条记录每个数据中心
+AVAILABILITY_LOG_LEVELS = ["off", "summary", "detail"]
+availability_log_level = settings.AVAILABILITY_LOG_LEVEL if settings.AVAILABILITY_LOG_LEVEL in AVAILABILITY_LOG_LEVELS else "summary"
+# summary 级别下尚未输出的汇总: 检查次数、总耗时、涉及的 planCode 和有货的数据中心
+availability_summary = {"checks": 0, "durationMs": 0, "plans": set(), "inStock": set(), "since": time.monotonic()}
+
+def flush_availability_summary():
+    """输出并清空累计的可用性检查汇总"""
+    summary = availability_summary
+    if summary["checks"]:
+        add_log("info", f"可用性检查汇总: {summary['checks']} 次检查, {len(summary['plans'])} 个型号, "
+                        f"有货数据中心: {', '.join(sorted(summary['inStock'])) or '无'} "
+                        f"(平均 {summary['durationMs'] // summary['checks']}ms)")
+    summary.update(checks=0, durationMs=0, plans=set(), inStock=set(), since=time.monotonic())
+# 最近的可用性检查事件（每次检查一条结构化概要）
+availability_events = deque(maxlen=500)
+# 每个 planCode 最近一次检查的紧凑表: planCode -> {"checkedAt", "options", "fqns": {fqn: {datacenter: availability}}}
+availability_table: Dict[str, Dict[str, Any]] = {}
+
+def record_availability_check(planCode: str, options, response, duration_ms: int):
+    """记录一次可用性检查：更新内存表和事件列表，按日志级别决定是否输出日志"""
+    fqns = {}
+    in_stock = set()
+    if isinstance(response, list):
+        for item in response:
+            if not isinstance(item, dict):
+                continue
+            dcs = {}
+            for dc in item.get("datacenters", []):
+                dc_name = dc.get("datacenter")
+                dc_avail = dc.get("availability")
+                dcs[dc_name] = dc_avail
+                if dc_avail not in ["unavailable", "unknown", None]:
+                    in_stock.add(dc_name)
+            fqns[item.get("fqn")] = dcs
+    option_values = [option.value for option in options or []]
+    checked_at = datetime.now().isoformat()
+    availability_table[planCode] = {"checkedAt": checked_at, "options": option_values, "fqns": fqns}
+    if restock_history:
+        restock_history.submit(planCode, fqns)
+    if availability_trace:
+        availability_trace.submit(planCode, fqns)
+    
+    if availability_log_level == "off":
+        return
+    event = {
+        "timestamp": checked_at,
+        "planCode": planCode,
+        "options": option_values,
+        "records": len(fqns),
+        "inStock": sorted(in_stock),
+        "durationMs": duration_ms,
+    }
+    availability_events.append(event)
+    
+    if availability_log_level == "summary":
+        # 不逐次记录日志和广播，按间隔输出一条汇总
+        summary = availability_summary
+        summary["checks"] += 1
+        summary["durationMs"] += duration_ms
+        summary["plans"].add(planCode)
+        summary["inStock"].update(in_stock)
+        if time.monotonic() - summary["since"] >= settings.AVAILABILITY_SUMMARY_INTERVAL:
+            flush_availability_summary()
+        return
+    
+    add_log("info", f"可用性检查 {planCode}: {len(fqns)} 个配置, 有货数据中心: {', '.join(event['inStock']) or '无'} ({duration_ms}ms)")
+    for fqn, dcs in fqns.items():
+        add_log("debug", f"  - {fqn}: " + ", ".join(f"{dc_name}={dc_avail}" for dc_name, dc_avail in dcs.items()))
+
+# ---- 补货历史 ----
+# 只记录可用性的变化：availability_transitions 为原始变化记录（保留 RESTOCK_RAW_RETENTION_DAYS 天），
+# restock_episodes 为降采样后的有货时段（从无货变为有货到重新无货），保留 RESTOCK_HISTORY_RETENTION_DAYS 天。
+# 事件循环只把检查结果放入队列，比较和写入都在后台线程中完成。
+RESTOCK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS availability_state (
+    plan_code TEXT NOT NULL, fqn TEXT NOT NULL, datacenter TEXT NOT NULL,
+    availability TEXT, since INTEGER NOT NULL,
+    PRIMARY KEY (plan_code, fqn, datacenter)
+);
+CREATE TABLE IF NOT EXISTS availability_transitions (
+    ts INTEGER NOT NULL, plan_code TEXT NOT NULL, fqn TEXT NOT NULL, datacenter TEXT NOT NULL,
+    availability TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transitions_plan_ts ON availability_transitions (plan_code, ts);
+CREATE TABLE IF NOT EXISTS restock_episodes (
+    plan_code TEXT NOT NULL, fqn TEXT NOT NULL, datacenter TEXT NOT NULL,
+    start_ts INTEGER NOT NULL, end_ts INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_episodes_plan_start ON restock_episodes (plan_code, start_ts);
+CREATE INDEX IF NOT EXISTS idx_episodes_open ON restock_episodes (end_ts) WHERE end_ts IS NULL;
+"""
+
+def is_in_stock(availability: Optional[str]) -> bool:
+    return availability not in ["unavailable", "unknown", None]
+
+def percentile_value(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+# ---- 可用性请求对冲 ----
+# 记录最近的可用性请求耗时，首个请求超过其分位数仍未返回时再发一个相同的请求，先成功返回的结果生效。
+# 对冲请求数按最近60秒的可用性请求数限制比例，避免在OVH变慢时成倍消耗请求配额。
+class AvailabilityHedger:
+    def __init__(self, percentile: float, max_ratio: float, min_samples: int = 20, window: int = 200):
+        self.fraction = min(max(percentile, 0.0), 100.0) / 100
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.recent_requests = deque()
+        self.recent_hedges = deque()
+        self.stats = {"requests": 0, "hedged": 0, "hedgeWins": 0, "budgetSkipped": 0}
+    
+    def delay(self) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        return percentile_value(list(self.latencies), self.fraction)
+    
+    def allow_hedge(self) -> bool:
+        cutoff = time.monotonic() - 60
+        for window in (self.recent_requests, self.recent_hedges):
+            while window and window[0] < cutoff:
+                window.popleft()
+        return len(self.recent_hedges) + 1 <= self.max_ratio * len(self.recent_requests)
+    
+    def launch(self, request) -> asyncio.Task:
+        started = time.monotonic()
+        task = asyncio.create_task(request())
+        def record(done_task: asyncio.Task):
+            # 完成的请求（含未被采用的）记录耗时并取走异常；被取消的请求不记录
+            if not done_task.cancelled() and done_task.exception() is None:
+                self.latencies.append(time.monotonic() - started)
+        task.add_done_callback(record)
+        return task
+    
+    async def call(self, request):
+        """request 为返回协程的函数，可能被调用两次"""
+        self.stats["requests"] += 1
+        self.recent_requests.append(time.monotonic())
+        started = time.monotonic()
+        primary = self.launch(request)
+        hedge = None
+        try:
+            delay = self.delay()
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if not self.allow_hedge():
+                self.stats["budgetSkipped"] += 1
+                METRIC_AVAILABILITY_HEDGES.inc(result="skipped")
+                return await primary
+            self.stats["hedged"] += 1
+            self.recent_hedges.append(time.monotonic())
+            hedge = self.launch(request)
+            pending = {primary, hedge}
+            winner = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+            if winner is hedge:
+                self.stats["hedgeWins"] += 1
+            METRIC_AVAILABILITY_HEDGES.inc(result="won" if winner is hedge else "lost")
+            # 两个请求都失败时抛出原请求的异常
+            return (winner or primary).result()
+        finally:
+            # 一方返回（或调用方被取消）后取消仍在等待的请求
+            if not primary.done():
+                primary.cancel()
+                if hedge:
+                    # 被对冲请求抢先的原请求按已等待的时间记录，保证分位数不偏低
+                    self.latencies.append(time.monotonic() - started)
+            if hedge and not hedge.done():
+                hedge.cancel()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        delay = self.delay()
+        return {
+            **self.stats,
+            "hedgeWinRate": round(self.stats["hedgeWins"] / self.stats["hedged"], 3) if self.stats["hedged"] else None,
+            "hedgeDelayMs": round(delay * 1000, 1) if delay is not None else None,
+            "percentile": self.fraction * 100,
+            "maxRatio": self.max_ratio,
+            "samples": len(self.latencies),
+        }
+
+availability_hedger = AvailabilityHedger(settings.AVAILABILITY_HEDGE_PERCENTILE, settings.AVAILABILITY_HEDGE_MAX_RATIO) if settings.AVAILABILITY_HEDGING else None
+
+# ---- 可用性轨迹 ----
+# 按时间把可用性检查结果追加到 AVAILABILITY_TRACE_FILE (JSON Lines)，供 simulator.py 离线回放。
+# 每行只包含与上一次相比发生变化的 fqn/数据中心: {"t": 时间戳, "p": planCode, "c": {fqn: {datacenter: availability}}}
+class AvailabilityTraceRecorder:
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.thread = None
+        self.lock = threading.Lock()
+    
+    def submit(self, planCode: str, fqns: Dict[str, Dict[str, Optional[str]]], timestamp: Optional[float] = None):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="availability-trace-writer", daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait((round(timestamp or time.time(), 3), planCode, fqns))
+        except queue.Full:
+            self.dropped += 1
+    
+    def flush(self, timeout: float = 5.0):
+        if self.thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+    
+    def _run(self):
+        state: Dict[tuple, Optional[str]] = {}
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < 500:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    for ts, plan_code, fqns in batch:
+                        changes = {}
+                        for fqn, dcs in fqns.items():
+                            for datacenter, availability in dcs.items():
+                                key = (plan_code, fqn, datacenter)
+                                if key in state and state[key] == availability:
+                                    continue
+                                state[key] = availability
+                                changes.setdefault(fqn, {})[datacenter] = availability
+                        if changes:
+                            f.write(json.dumps({"t": ts, "p": plan_code, "c": changes}, separators=(",", ":")) + "\n")
+                            self.written += 1
+                    f.flush()
+                except Exception as e:
+                    logger.error(f"写入可用性轨迹失败: {e}")
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+
+availability_trace = AvailabilityTraceRecorder(settings.AVAILABILITY_TRACE_FILE) if settings.AVAILABILITY_TRACE_FILE else None
+
+class RestockHistoryStore:
+    def __init__(self, path: str, raw_retention_days: int, retention_days: int, max_queue: int = 10000):
+        self.path = path
+        self.raw_retention = raw_retention_days * 86400
+        self.retention = retention_days * 86400
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.last_prune = 0.0
+    
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def submit(self, planCode: str, fqns: Dict[str, Dict[str, Optional[str]]], timestamp: Optional[float] = None):
+        """提交一次检查结果 fqn -> {datacenter: availability}，只做入队操作"""
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="restock-history-writer", daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait((int(timestamp or time.time()), planCode, fqns))
+        except queue.Full:
+            self.dropped += 1
+    
+    def flush(self, timeout: float = 5.0):
+        """等待队列中的记录写入完成（用于关闭时）"""
+        if self.thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+    
+    def _run(self):
+        conn = self.connect()
+        conn.executescript(RESTOCK_SCHEMA)
+        state = {(row[0], row[1], row[2]): row[3] for row in conn.execute(
+            "SELECT plan_code, fqn, datacenter, availability FROM availability_state")}
+        while True:
+            batch = [self.queue.get()]
+            # 合并队列中已有的记录，一个事务写入
+            while len(batch) < 500:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for ts, plan_code, fqns in batch:
+                        self._apply(conn, state, ts, plan_code, fqns)
+                    if time.time() - self.last_prune > 3600:
+                        self._prune(conn)
+            except Exception as e:
+                logger.error(f"写入补货历史失败: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+    
+    def _apply(self, conn: sqlite3.Connection, state: Dict[tuple, Optional[str]], ts: int, plan_code: str, fqns):
+        for fqn, dcs in fqns.items():
+            if not fqn:
+                continue
+            for datacenter, availability in dcs.items():
+                key = (plan_code, fqn, datacenter)
+                previous = state.get(key)
+                if key in state and previous == availability:
+                    continue
+                state[key] = availability
+                self.written += 1
+                conn.execute("INSERT INTO availability_transitions VALUES (?, ?, ?, ?, ?)", (ts, plan_code, fqn, datacenter, availability))
+                conn.execute("INSERT OR REPLACE INTO availability_state VALUES (?, ?, ?, ?, ?)", (plan_code, fqn, datacenter, availability, ts))
+                if is_in_stock(availability) and not is_in_stock(previous):
+                    conn.execute("INSERT INTO restock_episodes VALUES (?, ?, ?, ?, NULL)", (plan_code, fqn, datacenter, ts))
+                elif not is_in_stock(availability) and is_in_stock(previous):
+                    conn.execute("UPDATE restock_episodes SET end_ts = ? WHERE plan_code = ? AND fqn = ? AND datacenter = ? AND end_ts IS NULL",
+                                 (ts, plan_code, fqn, datacenter))
+    
+    def _prune(self, conn: sqlite3.Connection):
+        now = time.time()
+        self.last_prune = now
+        conn.execute("DELETE FROM availability_transitions WHERE ts < ?", (int(now - self.raw_retention),))
+        conn.execute("DELETE FROM restock_episodes WHERE end_ts IS NOT NULL AND end_ts < ?", (int(now - self.retention),))
+    
+    def analytics(self, planCode: Optional[str] = None, datacenter: Optional[str] = None, fqn: Optional[str] = None,
+                  days: float = 30) -> Dict[str, Any]:
+        """统计补货频率、有货时长和按小时分布（本地时间）"""
+        now = time.time()
+        since = int(now - days * 86400)
+        query = "SELECT plan_code, fqn, datacenter, start_ts, end_ts FROM restock_episodes WHERE (start_ts >= ? OR end_ts IS NULL OR end_ts >= ?)"
+        params: List[Any] = [since, since]
+        for column, value in (("plan_code", planCode), ("fqn", fqn), ("datacenter", datacenter)):
+            if value:
+                query += f" AND {column} = ?"
+                params.append(value)
+        if not os.path.exists(self.path):
+            rows = []
+        else:
+            conn = self.connect()
+            try:
+                rows = conn.execute(query + " ORDER BY start_ts", params).fetchall()
+            except sqlite3.OperationalError:
+                rows = []  # 数据库尚未初始化
+            finally:
+                conn.close()
+        
+        groups: Dict[tuple, List[tuple]] = {}
+        for plan_code, row_fqn, row_dc, start_ts, end_ts in rows:
+            groups.setdefault((plan_code, row_fqn, row_dc), []).append((start_ts, end_ts))
+        overall_heatmap = [0] * 24
+        series = []
+        for (plan_code, row_fqn, row_dc), episodes in groups.items():
+            restocks = [start for start, _ in episodes if start >= since]
+            durations = [end - start for start, end in episodes if end is not None and start >= since]
+            heatmap = [0] * 24
+            for start in restocks:
+                hour = time.localtime(start).tm_hour
+                heatmap[hour] += 1
+                overall_heatmap[hour] += 1
+            gaps = [b - a for a, b in zip(restocks, restocks[1:])]
+            open_since = next((start for start, end in reversed(episodes) if end is None), None)
+            p10 = percentile_value(durations, 0.1)
+            series.append({
+                "planCode": plan_code,
+                "fqn": row_fqn,
+                "datacenter": row_dc,
+                "restocks": len(restocks),
+                "restocksPerDay": round(len(restocks) / days, 3) if days else None,
+                "medianInStockSeconds": percentile_value(durations, 0.5),
+                "p10InStockSeconds": p10,
+                "p90InStockSeconds": percentile_value(durations, 0.9),
+                "medianSecondsBetweenRestocks": percentile_value(gaps, 0.5),
+                "lastRestock": datetime.fromtimestamp(restocks[-1]).isoformat() if restocks else None,
+                "inStockSince": datetime.fromtimestamp(open_since).isoformat() if open_since else None,
+                # 轮询间隔应明显短于较短的有货时长，否则容易错过补货
+                "suggestedPollSeconds": max(1, int(p10 / 2)) if p10 else None,
+                "hourlyRestocks": heatmap,
+            })
+        series.sort(key=lambda item: item["restocks"], reverse=True)
+        return {
+            "days": days,
+            "series": series,
+            "hourlyRestocks": overall_heatmap,
+            "queryMs": round((time.time() - now) * 1000, 2),
+        }
+    
+    def transitions(self, planCode: str, datacenter: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        query = "SELECT ts, fqn, datacenter, availability FROM availability_transitions WHERE plan_code = ?"
+        params: List[Any] = [planCode]
+        if datacenter:
+            query += " AND datacenter = ?"
+            params.append(datacenter)
+        conn = self.connect()
+        try:
+            rows = conn.execute(query + " ORDER BY ts DESC LIMIT ?", params + [limit]).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            conn.close()
+        return [{"timestamp": datetime.fromtimestamp(ts).isoformat(), "fqn": row_fqn, "datacenter": row_dc, "availability": availability}
+                for ts, row_fqn, row_dc, availability in rows]
+
+restock_history = RestockHistoryStore(settings.RESTOCK_HISTORY_DB, settings.RESTOCK_RAW_RETENTION_DAYS,
+                                      settings.RESTOCK_HISTORY_RETENTION_DAYS) if settings.RESTOCK_HISTORY_DB else None
+
+# 向OVH请求服务器可用性
+async def fetch_availability(planCode: str, options=None, task_id=None):
     client = get_ovh_client(task_id)
     
     try:
-        # 添加详细日志记录
-        add_log("info", f"正在请求服务器 {planCode} 的可用性信息，配置选项: {options}")
-        
         # 基本查询参数
         query_params = {"planCode": planCode}
         
         # 如果提供了选项，将其添加到OVH API请求中
         if options and len(options) > 0:
-            # 将options添加到查询参数
-            add_log("info", f"使用配置选项检查可用性: {options}")
             for option in options:
                 family = option.label  # 直接访问属性而不是使用get方法
                 value = option.value   # 直接访问属性而不是使用get方法
@@ -693,44 +2881,18 @@ async def check_availability(planCode: str, options=None, task_id=None):
                     query_params[f"option.{family}"] = value
         
         # 使用构建好的查询参数调用API - 确保使用关键字参数
-        response = client.get('/dedicated/server/datacenter/availabilities', **query_params)
-        
-        # 记录完整响应的关键信息
-        response_summary = f"响应类型: {type(response)}, 是否为列表: {isinstance(response, list)}, "
-        if isinstance(response, list):
-            response_summary += f"列表长度: {len(response)}"
-            if len(response) > 0:
-                first_item = response[0]
-                response_summary += f", 第一项类型: {type(first_item)}"
-                if isinstance(first_item, dict):
-                    response_summary += f", 第一项键: {', '.join(first_item.keys())}"
+        async def request():
+            METRIC_AVAILABILITY_CHECKS.inc()
+            return await ovh_call(client, "get", '/dedicated/server/datacenter/availabilities', **query_params)
         
-        add_log("info", f"服务器 {planCode} 可用性API响应: {response_summary}")
-        
-        # 如果有数据中心信息，记录每个数据中心的状态
-        if response and isinstance(response, list):
-            if not response:
-                add_log("warning", f"服务器 {planCode} 返回了空列表，没有可用性信息")
-            else:
-                add_log("info", f"获取到 {len(response)} 个可用性记录")
-                
-                for i, item in enumerate(response):
-                    if isinstance(item, dict):
-                        fqn = item.get("fqn", "未知")
-                        datacenters = item.get("datacenters", [])
-                        add_log("info", f"记录 #{i+1}: 服务器型号={fqn}, 包含 {len(datacenters)} 个数据中心")
-                        
-                        # 列出所有数据中心状态
-                        if datacenters:
-                            for j, dc in enumerate(datacenters):
-                                dc_name = dc.get("datacenter", "未知")
-                                dc_avail = dc.get("availability", "未知")
-                                add_log("info", f"  - 数据中心 #{j+1}: {dc_name}, 可用性: {dc_avail}")
-                        else:
-                            add_log("warning", f"记录 #{i+1} 没有数据中心信息")
-                    else:
-                        add_log("warning", f"记录 #{i+1} 不是字典格式: {type(item)}")
+        request_start = time.monotonic()
+        if availability_hedger:
+            response = await availability_hedger.call(request)
+        else:
+            response = await request()
+        record_availability_check(planCode, options, response, round((time.monotonic() - request_start) * 1000))
         
+        store_availability(availability_cache_key(planCode, options), response)
         return response
     except Exception as e:
         add_log("error", f"检查服务器 {planCode} 可用性失败: {str(e)}")
@@ -741,11 +2903,12 @@ async def check_availability(planCode: str, options=None, task_id=None):
 @app.get("/api/debug/availability/{plan_code}")
 async def debug_availability(plan_code: str):
     try:
-        result = await check_availability(plan_code)
+        result, age = await get_availability(plan_code)
         # 返回详细信息，包括数据结构和类型
         return {
             "status": "success",
             "plan_code": plan_code,
+            "cache_age": round(age, 3),
             "result_type": str(type(result)),
             "is_list": isinstance(result, list),
             "length": len(result) if isinstance(result, list) else 0,
@@ -764,17 +2927,450 @@ async def broadcast_order_failed(order: OrderHistory):
     try:
         await broadcast_message({
             "type": "order_failed",
-            "data": order.dict()
+            "data": order.to_dict()
         })
         add_log("info", f"订单失败消息已广播: {order.id}")
     except Exception as e:
         add_log("error", f"广播订单失败消息失败: {str(e)}")
 
+# 判断数据中心是否符合任务要求，"any"/"*"/空值表示任意数据中心
+def datacenter_matches(target: Optional[str], datacenter_name: Optional[str]) -> bool:
+    if not datacenter_name:
+        return False
+    if not target or target.strip().lower() in ("any", "*"):
+        return True
+    return datacenter_name.upper() == target.strip().upper()
+
+# 从可用性数据中找出有货的数据中心（按API返回顺序去重）
+def find_available_datacenters(availabilities, target_dc: Optional[str]) -> List[Dict[str, str]]:
+    found = []
+    seen = set()
+    for item in availabilities or []:
+        current_fqn = item.get("fqn")
+        for dc_info in item.get("datacenters", []):
+            availability = dc_info.get("availability")
+            datacenter_name = dc_info.get("datacenter")
+            if not datacenter_matches(target_dc, datacenter_name):
+                continue
+            if availability in ["unavailable", "unknown", None]:
+                continue
+            if datacenter_name.upper() in seen:
+                continue
+            seen.add(datacenter_name.upper())
+            found.append({"datacenter": datacenter_name, "fqn": current_fqn, "availability": availability})
+    return found
+
+# 选项在 FQN (planCode.memory.storage) 中对应的部分；带宽等不在 FQN 中的选项不参与可用性匹配
+FQN_OPTION_LABELS = {"memory": "memory", "ram": "memory", "storage": "storage", "disk": "storage"}
+FQN_OPTION_PREFIXES = {"ram-": "memory", "softraid-": "storage", "hybridsoftraid-": "storage", "noraid-": "storage",
+                       "raid-": "storage", "hardraid-": "storage"}
+
+def option_fqn_part(option, planCode: str) -> Optional[tuple]:
+    """返回 (FQN部分, 去掉planCode后缀的选项值)，无法对应到FQN时返回None"""
+    value = (option.value or "").strip()
+    if not value:
+        return None
+    part = FQN_OPTION_LABELS.get((option.label or "").strip().lower())
+    if not part:
+        part = next((name for prefix, name in FQN_OPTION_PREFIXES.items() if value.startswith(prefix)), None)
+    if not part:
+        return None
+    # 选项 planCode 通常带有服务器 planCode 后缀，如 ram-64g-ecc-2133-24ska01，FQN 中为 ram-64g-ecc-2133
+    if value.endswith(f"-{planCode}"):
+        value = value[:-len(planCode) - 1]
+    return part, value
+
+def fqn_matches_options(item: Dict[str, Any], wanted_parts: List[tuple]) -> bool:
+    parsed = parse_fqn(item.get("fqn") or "")
+    for part, value in wanted_parts:
+        component = item.get(part) or parsed.get(part)
+        if not component:
+            return False
+        # 用户选项可能是完整值或前缀（如 ram-64g）
+        if not (component.startswith(value) or value.startswith(component)):
+            return False
+    return True
+
+def select_option_availabilities(availabilities, config: ServerConfig) -> tuple:
+    """
+    按任务的硬件选项筛选可用性记录，只保留对应FQN的记录
+    :return: (筛选后的记录, 是否按FQN筛选)；没有选项能对应到FQN部分时返回原记录，按基础planCode判断；
+             有对应的FQN部分但没有FQN匹配时返回空列表，视为所选配置无货
+    """
+    wanted_parts = [part for part in (option_fqn_part(option, config.planCode) for option in config.options or []) if part]
+    if not wanted_parts or not availabilities:
+        return availabilities, False
+    matched = [item for item in availabilities if isinstance(item, dict) and fqn_matches_options(item, wanted_parts)]
+    return matched, True
+
+# 从结账信息中提取含税总价
+def extract_checkout_price(checkout_info) -> Optional[float]:
+    try:
+        return float(checkout_info["prices"]["withTax"]["value"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# ---- 结账槽位 ----
+# 限制同时进行的建单/结账数量，避免补货时所有任务同时占用API配额和账户余额。
+# 空出的槽位按任务优先级分配（同级先到先得）；高优先级任务一直等待，其他任务等待超时后本轮跳过。
+TASK_PRIORITY_RANKS = {"high": 0, "normal": 1, "low": 2}
+
+def task_priority_rank(priority: Optional[str]) -> int:
+    return TASK_PRIORITY_RANKS.get(priority or "normal", 1)
+
+class CheckoutSlots:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []  # 堆: [优先级, 序号, future, taskId]
+        self.sequence = itertools.count()
+    
+    async def acquire(self, task_id: str, priority: str, timeout: Optional[float] = None) -> bool:
+        """获取一个槽位，超时返回 False；获取成功后必须调用 release()"""
+        if self.limit <= 0 or (self.active < self.limit and not self.pending()):
+            self.active += 1
+            return True
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, [task_priority_rank(priority), next(self.sequence), future, task_id])
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 被取消的同时刚好分到槽位，交给下一个等待者
+                self.release()
+            else:
+                future.cancel()
+            raise
+    
+    def release(self):
+        # 槽位直接转交给优先级最高的等待者，active 不变
+        while self.waiters:
+            _, _, future, _ = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active = max(0, self.active - 1)
+    
+    def pending(self) -> int:
+        return sum(1 for entry in self.waiters if not entry[2].done())
+    
+    def snapshot(self) -> Dict[str, Any]:
+        waiting = sorted(entry for entry in self.waiters if not entry[2].done())
+        rank_names = {rank: name for name, rank in TASK_PRIORITY_RANKS.items()}
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": [{"taskId": task_id, "priority": rank_names[rank]} for rank, _, _, task_id in waiting],
+        }
+
+checkout_slots = CheckoutSlots(settings.CHECKOUT_SLOTS)
+
+async def acquire_checkout_slot(task_id: str, config: ServerConfig) -> bool:
+    timeout = None if config.priority == "high" else settings.CHECKOUT_SLOT_WAIT_SECONDS
+    with trace_span("checkout.slot_wait", priority=config.priority):
+        return await checkout_slots.acquire(task_id, config.priority, timeout)
+
+# 批量任务超出花费上限时抛出，用于中止单个结账
+class SpendLimitExceeded(Exception):
+    pass
+
+# 创建购物车、添加商品和硬件选项并结账 (采用 /eco/options 端点添加硬件)
+# 下单配方缓存：记录每种配置上次成功建单时实际设置的配置项和选项 planCode，
+# 下次直接重放，省去 requiredConfiguration 和 eco/options 的查询；被拒绝时删除配方并回退到逐步发现
+cart_recipes: Dict[str, Dict[str, Any]] = {}
+cart_recipe_stats = {"hits": 0, "misses": 0, "fallbacks": 0}
+
+def cart_recipe_key(config: ServerConfig, available_dc: str) -> str:
+    wanted = sorted(opt.value for opt in config.options if opt.value)
+    zone = api_config.zone if api_config else ""
+    return "|".join([config.planCode, zone, available_dc or "", ",".join(wanted), config.os or "", config.duration or ""])
+
+def save_cart_recipes():
+    try:
+        with measure_persistence("cart_recipes"), open(CART_RECIPES_FILE, "w") as f:
+            json.dump(cart_recipes, f)
+    except Exception as e:
+        add_log("error", f"保存下单配方失败: {str(e)}")
+
+def load_cart_recipes():
+    global cart_recipes
+    if os.path.exists(CART_RECIPES_FILE):
+        try:
+            with open(CART_RECIPES_FILE, "r") as f:
+                cart_recipes = json.load(f)
+            add_log("info", f"已从文件 {CART_RECIPES_FILE} 加载 {len(cart_recipes)} 个下单配方")
+        except Exception as e:
+            add_log("error", f"从文件加载下单配方失败: {str(e)}")
+
+def remember_cart_recipe(key: str, config: ServerConfig, configured: Dict[str, str], added_options: List[Dict[str, Any]]):
+    # 只有所有请求的选项都已添加时才记录，避免重放出缺少选项的订单
+    wanted = {opt.value for opt in config.options if opt.value}
+    if any(not any(option["planCode"].startswith(value) for option in added_options) for value in wanted):
+        return
+    cart_recipes[key] = {
+        "planCode": config.planCode,
+        "configurations": dict(configured),
+        "options": list(added_options),
+        "learnedAt": datetime.now().isoformat(),
+    }
+    save_cart_recipes()
+
+def forget_cart_recipe(key: str):
+    if cart_recipes.pop(key, None) is not None:
+        save_cart_recipes()
+
+# 发现并设置必需配置 (DC, OS, Region)，成功设置的配置项记录到 configured
+async def configure_cart_item(task_id: str, client, cart_id: str, item_id, config: ServerConfig, available_dc: str, configured: Dict[str, str]):
+    task_logger = get_task_logger(task_id)
+    update_task_status(task_id, "running", f"设置项目 {item_id} 的必需配置...")
+    task_logger.info(f"检查并设置项目 {item_id} 的必需配置...")
+    required_configs = []
+    try:
+        with trace_span("cart.required_configuration", cartId=cart_id):
+            required_configs = await ovh_call(client, "get", f'/order/cart/{cart_id}/item/{item_id}/requiredConfiguration')
+        task_logger.info(f"获取到必需配置项: {json.dumps(required_configs, indent=2)}")
+    except Exception as req_conf_error:
+         task_logger.warning(f"获取必需配置项失败或无必需配置: {req_conf_error}")
+         # Continue even if fetching required fails, core ones are set below
+
+    configurations_to_set = {}
+    # 推断 region...
+    # ... (region inference logic remains the same)
+    region_by_dc = None
+    dc = available_dc.lower() if available_dc else None
+    EU_DATACENTERS = ['gra', 'rbx', 'sbg', 'eri', 'lim', 'waw', 'par', 'fra', 'lon'] 
+    CANADA_DATACENTERS = ['bhs', 'beauharnois']
+    US_DATACENTERS = ['vin', 'hil', 'vint', 'hill']
+    APAC_DATACENTERS = ['syd', 'sgp', 'mum']
+    determined_region = None
+    if dc:
+        if any(dc.startswith(prefix) for prefix in EU_DATACENTERS): determined_region = "europe"
+        elif any(dc.startswith(prefix) for prefix in CANADA_DATACENTERS): determined_region = "canada"
+        elif any(dc.startswith(prefix) for prefix in US_DATACENTERS): determined_region = "usa"
+        elif any(dc.startswith(prefix) for prefix in APAC_DATACENTERS): determined_region = "apac"
+        if determined_region: task_logger.info(f"根据数据中心 {available_dc} 推断区域为 {determined_region}")
+        else: task_logger.warning(f"无法根据数据中心 {available_dc} 推断区域")
+    
+    region_required = False
+    region_label = "region"
+    for conf in required_configs:
+        label = conf.get("label")
+        if label == "region":
+            region_label = label
+            region_required = conf.get("required", False)
+            break
+    
+    # Set core mandatory configurations
+    configurations_to_set["dedicated_datacenter"] = available_dc
+    configurations_to_set["dedicated_os"] = config.os
+    if determined_region:
+        configurations_to_set[region_label] = determined_region
+    elif region_required:
+         task_logger.error(f"必需配置项 '{region_label}' 无法确定值，中止任务")
+         raise Exception(f"无法确定必需的 {region_label} 配置")
+
+    task_logger.info(f"准备使用 /configuration 设置必需配置: {json.dumps(configurations_to_set)}")
+    for label, value in configurations_to_set.items():
+        if value is None: continue
+        if configured.get(label) == str(value): continue  # 重放配方时已设置
+        try:
+            task_logger.info(f"配置项目 {item_id}: 设置必需项 {label} = {value}")
+            with trace_span("cart.configure", cartId=cart_id, label=label, value=str(value)):
+                await ovh_call(client, "post", f'/order/cart/{cart_id}/item/{item_id}/configuration', label=label, value=str(value))
+            configured[label] = str(value)
+            task_logger.info(f"成功设置必需项: {label} = {value}")
+        except ovh.exceptions.APIError as config_error:
+            task_logger.error(f"设置必需项 {label} = {value} 失败: {config_error}")
+            if label in ["dedicated_datacenter", region_label, "dedicated_os"]:
+                 raise Exception(f"关键必需配置项 {label} 设置失败，中止购买。") from config_error
+    
+
+# 发现并添加用户请求的硬件选项，成功添加的选项（不含 itemId）记录到 added_options
+async def add_cart_options(task_id: str, client, cart_id: str, item_id, config: ServerConfig, added_options: List[Dict[str, Any]]):
+    task_logger = get_task_logger(task_id)
+    wanted_options_values = {opt.value for opt in config.options if opt.value} # Set of wanted option values
+    update_task_status(task_id, "running", f"获取并添加硬件选项 (Eco)...")
+    if wanted_options_values: # Only proceed if user requested options
+        try:
+            task_logger.info(f"获取购物车 {cart_id} 的可用 Eco 硬件选项 (针对 planCode={config.planCode})...")
+            with trace_span("cart.options_fetch", cartId=cart_id):
+                available_options = await ovh_call(client, "get", f'/order/cart/{cart_id}/eco/options', planCode=config.planCode)
+            task_logger.info(f"找到 {len(available_options)} 个与基础商品 {config.planCode} 兼容的 Eco 硬件选项。")
+            
+            # task_logger.debug(f"可用 Eco 选项详情: {json.dumps(available_options)}") # Verbose
+
+            options_added_plan_codes = {option["planCode"] for option in added_options}
+            # Ensure item_id is available before proceeding
+            if not item_id:
+                raise Exception("无法添加选项，因为基础商品的 item_id 未知。")
+                
+            task_logger.info(f"将使用基础项目 ID {item_id} 来添加选项。")
+
+            for avail_opt in available_options:
+                avail_opt_plan_code = avail_opt.get("planCode")
+                if not avail_opt_plan_code:
+                    continue
+                
+                # Check if this available option matches any wanted option
+                match_found = False
+                wanted_value_matched = None
+                for wanted_val in wanted_options_values:
+                    if avail_opt_plan_code.startswith(wanted_val):
+                        match_found = True
+                        wanted_value_matched = wanted_val 
+                        break
+                
+                if match_found and avail_opt_plan_code not in options_added_plan_codes:
+                    task_logger.info(f"找到匹配的 Eco 选项: {avail_opt_plan_code} (匹配用户请求: {wanted_value_matched})，准备添加到购物车...")
+                    try:
+                        # ** Crucial: Add itemId to the payload for POST /eco/options **
+                        option_payload = {
+                            "itemId": item_id, # Link option to the base item
+                            "planCode": avail_opt_plan_code, # Use the exact plan code from the API
+                            "duration": avail_opt.get("duration", config.duration), # Use option's duration or fallback
+                            "pricingMode": avail_opt.get("pricingMode", "default"),
+                            "quantity": 1
+                        }
+                        task_logger.info(f"添加 Eco 选项 payload: {option_payload}")
+                        # Use the POST /eco/options endpoint
+                        with trace_span("cart.option_add", cartId=cart_id, option=avail_opt_plan_code):
+                            await ovh_call(client, "post", f'/order/cart/{cart_id}/eco/options', **option_payload)
+                        task_logger.info(f"成功添加 Eco 选项: {avail_opt_plan_code}")
+                        options_added_plan_codes.add(avail_opt_plan_code)
+                        added_options.append({key: value for key, value in option_payload.items() if key != "itemId"})
+                    except ovh.exceptions.APIError as add_opt_error:
+                         error_detail = str(add_opt_error)
+                         task_logger.warning(f"添加 Eco 选项 {avail_opt_plan_code} 失败: {error_detail}")
+                         if "Invalid parameters" in error_detail or "incompatible" in error_detail.lower():
+                             task_logger.warning(f"选项 {avail_opt_plan_code} 可能与基础商品 {item_id} 不兼容或参数无效。")
+                    except Exception as general_add_opt_error:
+                        task_logger.warning(f"添加 Eco 选项 {avail_opt_plan_code} 时发生未知错误: {general_add_opt_error}")
+            
+            # Check if all wanted options were added
+            satisfied_options = {val for added_pc in options_added_plan_codes for val in wanted_options_values if added_pc.startswith(val)}
+            missing_options = wanted_options_values - satisfied_options
+            if missing_options:
+                 task_logger.warning(f"未能找到或添加以下用户请求的 Eco 选项: {missing_options}")
+
+        except ovh.exceptions.APIError as get_opts_error:
+            task_logger.error(f"获取 Eco 硬件选项列表失败 (针对 planCode={config.planCode}): {get_opts_error}")
+            task_logger.warning("无法获取 Eco 硬件选项列表，将继续尝试下单（可能只有基础配置）。")
+        except Exception as e:
+             task_logger.error(f"处理 Eco 硬件选项时发生未知错误: {e}")
+             task_logger.warning("处理 Eco 硬件选项出错，将继续尝试下单（可能只有基础配置）。")
+    else:
+        task_logger.info("用户未请求硬件选项，跳过添加步骤。")
+
+async def build_and_checkout_cart(task_id: str, config: ServerConfig, available_dc: str, cart_state: Dict[str, Any], before_checkout=None):
+    """
+    在指定数据中心完成一次完整的下单流程
+    :param cart_state: 记录 cart_id/item_id，出错时供调用方记录
+    :param before_checkout: 可选的异步回调，在提交结账前以结账信息调用，抛出异常即中止结账
+    :return: 包含 orderId, url, addedOptions, price 的字典
+    """
+    client = get_ovh_client(task_id)
+    task_logger = get_task_logger(task_id)
+    wanted_options_values = {opt.value for opt in config.options if opt.value} # Set of wanted option values
+
+    # 1. 创建购物车
+    update_task_status(task_id, "running", "创建购物车...")
+    task_logger.info(f"为区域 {api_config.zone} 创建购物车...")
+    with trace_span("cart.create", datacenter=available_dc):
+        cart_result = await ovh_call(client, "post", '/order/cart', ovhSubsidiary=api_config.zone)
+    cart_id = cart_state["cart_id"] = cart_result["cartId"]
+    await journal_cart_event("cart_created", cart_id, datacenter=available_dc)
+    task_logger.info(f"购物车创建成功，ID: {cart_id}")
+    
+    # 2. 添加基础商品 (使用 /eco)
+    update_task_status(task_id, "running", f"添加基础商品 {config.planCode}...")
+    task_logger.info(f"将基础商品 {config.planCode} 添加到购物车 {cart_id} (使用 /eco)...")
+    item_payload = {
+        "planCode": config.planCode,
+        "pricingMode": "default",
+        "duration": config.duration,
+        "quantity": config.quantity
+    }
+    with trace_span("cart.item_add", cartId=cart_id, planCode=config.planCode):
+        item_result = await ovh_call(client, "post", f'/order/cart/{cart_id}/eco', **item_payload)
+    item_id = cart_state["item_id"] = item_result["itemId"]
+    await journal_cart_event("item_added", cart_id, itemId=item_id)
+    task_logger.info(f"基础商品添加成功，项目 ID: {item_id}")
+    
+    # 3/4. 设置必需配置并添加硬件选项：优先重放该配置上次成功的下单配方，被拒绝时回退到逐步发现
+    configured: Dict[str, str] = {}
+    added_options: List[Dict[str, Any]] = []
+    recipe_key = cart_recipe_key(config, available_dc)
+    recipe = cart_recipes.get(recipe_key)
+    replayed = False
+    if recipe:
+        update_task_status(task_id, "running", "按已知配方配置购物车...")
+        try:
+            with trace_span("cart.recipe_replay", cartId=cart_id):
+                for label, value in recipe["configurations"].items():
+                    with trace_span("cart.configure", cartId=cart_id, label=label, value=value):
+                        await ovh_call(client, "post", f'/order/cart/{cart_id}/item/{item_id}/configuration', label=label, value=value)
+                    configured[label] = value
+                for option in recipe["options"]:
+                    with trace_span("cart.option_add", cartId=cart_id, option=option["planCode"]):
+                        await ovh_call(client, "post", f'/order/cart/{cart_id}/eco/options', itemId=item_id, **option)
+                    added_options.append(option)
+            replayed = True
+            cart_recipe_stats["hits"] += 1
+            task_logger.info(f"已按配方设置 {len(configured)} 个配置项和 {len(added_options)} 个硬件选项")
+        except ovh.exceptions.APIError as recipe_error:
+            cart_recipe_stats["fallbacks"] += 1
+            task_logger.warning(f"下单配方被拒绝，回退到逐步发现: {recipe_error}")
+            forget_cart_recipe(recipe_key)
+    else:
+        cart_recipe_stats["misses"] += 1
+    if not replayed:
+        await configure_cart_item(task_id, client, cart_id, item_id, config, available_dc, configured)
+        await add_cart_options(task_id, client, cart_id, item_id, config, added_options)
+    added_options_count = len(added_options)
+    
+
+    # **** 5. 绑定购物车 (Assign Cart) - 移到所有项目和配置添加之后 ****
+    update_task_status(task_id, "running", "绑定购物车...")
+    task_logger.info(f"在添加完所有项目和选项后，绑定购物车 {cart_id}...")
+    with trace_span("cart.assign", cartId=cart_id):
+        await ovh_call(client, "post", f'/order/cart/{cart_id}/assign')
+    task_logger.info("购物车绑定成功")
+
+    # 6. 获取结账信息
+    update_task_status(task_id, "running", "准备结账...")
+    task_logger.info(f"获取购物车 {cart_id} 的结账信息...")
+    with trace_span("checkout.fetch", cartId=cart_id):
+        checkout_info = await ovh_call(client, "get", f'/order/cart/{cart_id}/checkout')
+    task_logger.info(f"结账信息获取成功: {checkout_info}") # Log checkout info
+    price = extract_checkout_price(checkout_info)
+    if before_checkout:
+        await before_checkout(checkout_info, price)
+
+    # 7. 执行结账
+    task_logger.info(f"对购物车 {cart_id} 执行结账...")
+    checkout_payload = {"autoPayWithPreferredPaymentMethod": False, "waiveRetractationPeriod": True}
+    await journal_cart_event("checkout_submitting", cart_id, price=price)
+    with trace_span("checkout.submit", cartId=cart_id) as span:
+        checkout_result = await ovh_call(client, "post", f'/order/cart/{cart_id}/checkout', **checkout_payload)
+        if span is not None: span["orderId"] = checkout_result.get("orderId")
+    await journal_cart_event("checkout_done", cart_id, orderId=checkout_result.get("orderId"), url=checkout_result.get("url"))
+    task_logger.info("结账请求已提交！")
+    if not replayed:
+        remember_cart_recipe(recipe_key, config, configured, added_options)
+
+    return {
+        "orderId": checkout_result.get("orderId"),
+        "url": checkout_result.get("url", "N/A"),
+        "addedOptions": added_options_count,
+        "price": price,
+    }
+
 # 订购服务器 (采用 options 端点添加硬件)
 async def order_server(task_id: str, config: ServerConfig):
-    client = get_ovh_client(task_id)
-    cart_id = None
-    item_id = None # Store the base item ID
+    cart_state = {"cart_id": None, "item_id": None} # Store the cart and base item IDs
     task_logger = get_task_logger(task_id)
     
     task_logger.info(f"开始处理任务 {task_id} (使用 /eco/options 添加硬件)")
@@ -784,12 +3380,12 @@ async def order_server(task_id: str, config: ServerConfig):
 
     update_task_status(task_id, "running", "检查服务器可用性...")
     
-    # --- 可用性检查 (保持不变，只检查 planCode) ---
+    # --- 可用性检查 (按 planCode 查询并与其他任务共用缓存，再按选项筛选FQN) ---
     available_dc = None
-    found_available = False
     try:
         task_logger.info(f"正在检查计划代码 {config.planCode} 的可用性...")
-        availabilities = await check_availability(config.planCode, None, task_id)
+        with trace_span("availability.check", planCode=config.planCode):
+            availabilities = await check_availability(config.planCode, None, task_id)
         if not availabilities:
             # ... (handle no availability) ...
             message = f"未找到计划代码 {config.planCode} 的可用性信息。"
@@ -797,208 +3393,51 @@ async def order_server(task_id: str, config: ServerConfig):
             update_task_status(task_id, "pending", message)
             return
         
-        target_dc_upper = config.datacenter.upper() if config.datacenter else None
-        task_logger.info(f"将在 {len(availabilities)} 个配置中查找 {target_dc_upper} 的可用性...")
-        for item in availabilities:
-            current_fqn = item.get("fqn") # Still useful for logging/notification
-            datacenters = item.get("datacenters", [])
-            for dc_info in datacenters:
-                availability = dc_info.get("availability")
-                datacenter_name = dc_info.get("datacenter")
-                if datacenter_name and target_dc_upper and datacenter_name.upper() == target_dc_upper:
-                    if availability not in ["unavailable", "unknown", None]:
-                        found_available = True
-                        available_dc = datacenter_name
-                        task_logger.info(f"在数据中心 {available_dc} 找到基础 planCode {config.planCode} 可用 (FQN 可能不同: {current_fqn})!")
-                        break
-            if found_available: break
+        # 只看与所选硬件选项对应的FQN，避免其他配置有货时白白建购物车
+        availabilities, fqn_matched = select_option_availabilities(availabilities, config)
+        if wanted_options_values and not fqn_matched:
+            task_logger.warning(f"无法把选项 {wanted_options_values} 对应到可用性中的FQN，按基础 planCode 判断可用性")
+        task_logger.info(f"将在 {len(availabilities)} 个配置中查找 {config.datacenter} 的可用性...")
+        available_dcs = find_available_datacenters(availabilities, config.datacenter)
         
-        if not found_available:
+        if not available_dcs:
             # ... (handle not found in target DC) ...
-            message = f"计划代码 {config.planCode} 在数据中心 {config.datacenter} 当前无可用服务器。"
+            if fqn_matched:
+                message = f"所选配置 {', '.join(item.get('fqn') or '' for item in availabilities) or '(没有与所选选项对应的FQN)'} 在数据中心 {config.datacenter} 当前无货。"
+            else:
+                message = f"计划代码 {config.planCode} 在数据中心 {config.datacenter} 当前无可用服务器。"
             task_logger.info(message)
             update_task_status(task_id, "pending", message)
             return
+        available_dc = available_dcs[0]["datacenter"]
+        seen_available_at = time.monotonic()
+        if fqn_matched:
+            task_logger.info(f"在数据中心 {available_dc} 找到所选配置 {available_dcs[0]['fqn']} 可用!")
+        else:
+            task_logger.info(f"在数据中心 {available_dc} 找到基础 planCode {config.planCode} 可用 (FQN 可能不同: {available_dcs[0]['fqn']})!")
             
         # --- 开始购买流程 --- 
-        msg = f"{api_config.iam}: 在 {available_dc} 找到基础 {config.planCode} 可用，准备下单包含选项的订单..."
+        msg = f"{api_config.iam}: 在 {available_dc} 找到 {config.planCode} 可用，准备下单包含选项的订单..."
         # 注释掉这行，不在找到服务器可用时发送Telegram通知
         # send_telegram_msg(msg)
         # 仅记录日志
         task_logger.info(msg)
         
-        # 1. 创建购物车
-        update_task_status(task_id, "running", "创建购物车...")
-        task_logger.info(f"为区域 {api_config.zone} 创建购物车...")
-        cart_result = client.post('/order/cart', ovhSubsidiary=api_config.zone)
-        cart_id = cart_result["cartId"]
-        task_logger.info(f"购物车创建成功，ID: {cart_id}")
-        
-        # 2. 添加基础商品 (使用 /eco)
-        update_task_status(task_id, "running", f"添加基础商品 {config.planCode}...")
-        task_logger.info(f"将基础商品 {config.planCode} 添加到购物车 {cart_id} (使用 /eco)...")
-        item_payload = {
-            "planCode": config.planCode,
-            "pricingMode": "default",
-            "duration": config.duration,
-            "quantity": config.quantity
-        }
-        item_result = client.post(f'/order/cart/{cart_id}/eco', **item_payload)
-        item_id = item_result["itemId"]
-        task_logger.info(f"基础商品添加成功，项目 ID: {item_id}")
-        
-        # 3. 设置必需配置 (DC, OS, Region 使用 /configuration)
-        update_task_status(task_id, "running", f"设置项目 {item_id} 的必需配置...")
-        task_logger.info(f"检查并设置项目 {item_id} 的必需配置...")
-        required_configs = []
+        if not await acquire_checkout_slot(task_id, config):
+            message = f"结账槽位已被更高优先级的任务占用 ({config.priority})，本轮跳过"
+            task_logger.info(message)
+            update_task_status(task_id, "pending", message)
+            return
         try:
-            required_configs = client.get(f'/order/cart/{cart_id}/item/{item_id}/requiredConfiguration')
-            task_logger.info(f"获取到必需配置项: {json.dumps(required_configs, indent=2)}")
-        except Exception as req_conf_error:
-             task_logger.warning(f"获取必需配置项失败或无必需配置: {req_conf_error}")
-             # Continue even if fetching required fails, core ones are set below
-
-        configurations_to_set = {}
-        # 推断 region...
-        # ... (region inference logic remains the same)
-        region_by_dc = None
-        dc = available_dc.lower() if available_dc else None
-        EU_DATACENTERS = ['gra', 'rbx', 'sbg', 'eri', 'lim', 'waw', 'par', 'fra', 'lon'] 
-        CANADA_DATACENTERS = ['bhs', 'beauharnois']
-        US_DATACENTERS = ['vin', 'hil', 'vint', 'hill']
-        APAC_DATACENTERS = ['syd', 'sgp', 'mum']
-        determined_region = None
-        if dc:
-            if any(dc.startswith(prefix) for prefix in EU_DATACENTERS): determined_region = "europe"
-            elif any(dc.startswith(prefix) for prefix in CANADA_DATACENTERS): determined_region = "canada"
-            elif any(dc.startswith(prefix) for prefix in US_DATACENTERS): determined_region = "usa"
-            elif any(dc.startswith(prefix) for prefix in APAC_DATACENTERS): determined_region = "apac"
-            if determined_region: task_logger.info(f"根据数据中心 {available_dc} 推断区域为 {determined_region}")
-            else: task_logger.warning(f"无法根据数据中心 {available_dc} 推断区域")
-        
-        region_required = False
-        region_label = "region"
-        for conf in required_configs:
-            label = conf.get("label")
-            if label == "region":
-                region_label = label
-                region_required = conf.get("required", False)
-                break
-        
-        # Set core mandatory configurations
-        configurations_to_set["dedicated_datacenter"] = available_dc
-        configurations_to_set["dedicated_os"] = config.os
-        if determined_region:
-            configurations_to_set[region_label] = determined_region
-        elif region_required:
-             task_logger.error(f"必需配置项 '{region_label}' 无法确定值，中止任务")
-             raise Exception(f"无法确定必需的 {region_label} 配置")
-
-        task_logger.info(f"准备使用 /configuration 设置必需配置: {json.dumps(configurations_to_set)}")
-        for label, value in configurations_to_set.items():
-            if value is None: continue
-            try:
-                task_logger.info(f"配置项目 {item_id}: 设置必需项 {label} = {value}")
-                client.post(f'/order/cart/{cart_id}/item/{item_id}/configuration', label=label, value=str(value))
-                task_logger.info(f"成功设置必需项: {label} = {value}")
-            except ovh.exceptions.APIError as config_error:
-                task_logger.error(f"设置必需项 {label} = {value} 失败: {config_error}")
-                if label in ["dedicated_datacenter", region_label, "dedicated_os"]:
-                     raise Exception(f"关键必需配置项 {label} 设置失败，中止购买。") from config_error
-        
-        # **** 4. 获取并添加硬件选项 (使用 /eco/options) ****
-        update_task_status(task_id, "running", f"获取并添加硬件选项 (Eco)...")
-        added_options_count = 0
-        if wanted_options_values: # Only proceed if user requested options
-            try:
-                task_logger.info(f"获取购物车 {cart_id} 的可用 Eco 硬件选项 (针对 planCode={config.planCode})...")
-                available_options = client.get(f'/order/cart/{cart_id}/eco/options', planCode=config.planCode)
-                task_logger.info(f"找到 {len(available_options)} 个与基础商品 {config.planCode} 兼容的 Eco 硬件选项。")
-                
-                # task_logger.debug(f"可用 Eco 选项详情: {json.dumps(available_options)}") # Verbose
-
-                options_added_plan_codes = set()
-                # Ensure item_id is available before proceeding
-                if not item_id:
-                    raise Exception("无法添加选项，因为基础商品的 item_id 未知。")
-                    
-                task_logger.info(f"将使用基础项目 ID {item_id} 来添加选项。")
-
-                for avail_opt in available_options:
-                    avail_opt_plan_code = avail_opt.get("planCode")
-                    if not avail_opt_plan_code:
-                        continue
-                    
-                    # Check if this available option matches any wanted option
-                    match_found = False
-                    wanted_value_matched = None
-                    for wanted_val in wanted_options_values:
-                        if avail_opt_plan_code.startswith(wanted_val):
-                            match_found = True
-                            wanted_value_matched = wanted_val 
-                            break
-                    
-                    if match_found and avail_opt_plan_code not in options_added_plan_codes:
-                        task_logger.info(f"找到匹配的 Eco 选项: {avail_opt_plan_code} (匹配用户请求: {wanted_value_matched})，准备添加到购物车...")
-                        try:
-                            # ** Crucial: Add itemId to the payload for POST /eco/options **
-                            option_payload = {
-                                "itemId": item_id, # Link option to the base item
-                                "planCode": avail_opt_plan_code, # Use the exact plan code from the API
-                                "duration": avail_opt.get("duration", config.duration), # Use option's duration or fallback
-                                "pricingMode": avail_opt.get("pricingMode", "default"),
-                                "quantity": 1
-                            }
-                            task_logger.info(f"添加 Eco 选项 payload: {option_payload}")
-                            # Use the POST /eco/options endpoint
-                            client.post(f'/order/cart/{cart_id}/eco/options', **option_payload)
-                            task_logger.info(f"成功添加 Eco 选项: {avail_opt_plan_code}")
-                            options_added_plan_codes.add(avail_opt_plan_code)
-                            added_options_count += 1
-                        except ovh.exceptions.APIError as add_opt_error:
-                             error_detail = str(add_opt_error)
-                             task_logger.warning(f"添加 Eco 选项 {avail_opt_plan_code} 失败: {error_detail}")
-                             if "Invalid parameters" in error_detail or "incompatible" in error_detail.lower():
-                                 task_logger.warning(f"选项 {avail_opt_plan_code} 可能与基础商品 {item_id} 不兼容或参数无效。")
-                        except Exception as general_add_opt_error:
-                            task_logger.warning(f"添加 Eco 选项 {avail_opt_plan_code} 时发生未知错误: {general_add_opt_error}")
-                
-                # Check if all wanted options were added
-                satisfied_options = {val for added_pc in options_added_plan_codes for val in wanted_options_values if added_pc.startswith(val)}
-                missing_options = wanted_options_values - satisfied_options
-                if missing_options:
-                     task_logger.warning(f"未能找到或添加以下用户请求的 Eco 选项: {missing_options}")
-
-            except ovh.exceptions.APIError as get_opts_error:
-                task_logger.error(f"获取 Eco 硬件选项列表失败 (针对 planCode={config.planCode}): {get_opts_error}")
-                task_logger.warning("无法获取 Eco 硬件选项列表，将继续尝试下单（可能只有基础配置）。")
-            except Exception as e:
-                 task_logger.error(f"处理 Eco 硬件选项时发生未知错误: {e}")
-                 task_logger.warning("处理 Eco 硬件选项出错，将继续尝试下单（可能只有基础配置）。")
-        else:
-            task_logger.info("用户未请求硬件选项，跳过添加步骤。")
-        
-        # **** 5. 绑定购物车 (Assign Cart) - 移到所有项目和配置添加之后 ****
-        update_task_status(task_id, "running", "绑定购物车...")
-        task_logger.info(f"在添加完所有项目和选项后，绑定购物车 {cart_id}...")
-        client.post(f'/order/cart/{cart_id}/assign')
-        task_logger.info("购物车绑定成功")
-
-        # 6. 获取结账信息
-        update_task_status(task_id, "running", "准备结账...")
-        task_logger.info(f"获取购物车 {cart_id} 的结账信息...")
-        checkout_info = client.get(f'/order/cart/{cart_id}/checkout')
-        task_logger.info(f"结账信息获取成功: {checkout_info}") # Log checkout info
-
-        # 7. 执行结账
-        task_logger.info(f"对购物车 {cart_id} 执行结账...")
-        checkout_payload = {"autoPayWithPreferredPaymentMethod": False, "waiveRetractationPeriod": True}
-        checkout_result = client.post(f'/order/cart/{cart_id}/checkout', **checkout_payload)
-        task_logger.info("结账请求已提交！")
+            result = await build_and_checkout_cart(task_id, config, available_dc, cart_state)
+        finally:
+            checkout_slots.release()
+        METRIC_TIME_TO_CHECKOUT.observe(time.monotonic() - seen_available_at)
         
         # 8. 处理成功结果
-        order_url = checkout_result.get("url", "N/A")
-        order_id = checkout_result.get("orderId")
+        order_url = result["url"]
+        order_id = result["orderId"]
+        added_options_count = result["addedOptions"]
         task_logger.info(f"订单创建成功! 订单ID: {order_id}, 订单URL: {order_url}")
         
         now = datetime.now().isoformat()
@@ -1007,7 +3446,8 @@ async def order_server(task_id: str, config: ServerConfig):
             datacenter=available_dc, # 使用 API 返回的 DC
             orderTime=now, status="success",
             orderId=safe_str(order_id, "N/A"), orderUrl=safe_str(order_url, "N/A"),
-            error=f"Options added: {added_options_count}" # Indicate options were processed
+            error=f"Options added: {added_options_count}", # Indicate options were processed
+            taskId=task_id, price=result["price"]
         )
         add_order(history_entry)
         update_task_status(task_id, "completed", f"订单 {order_id} (选项数: {added_options_count}) 已成功创建")
@@ -1016,12 +3456,13 @@ async def order_server(task_id: str, config: ServerConfig):
         # Build display string with actual options added if possible (or just FQN if easier)
         # For simplicity, just use planCode and note options were added.
         success_msg = f"{api_config.iam}: 订单 {order_id} 已成功创建并支付！\n服务器 Plan: {config.planCode}\n数据中心: {available_dc}\n(处理了 {added_options_count} 个硬件选项)\n订单链接: {order_url}"
-        send_telegram_msg(success_msg)
+        await send_telegram_msg(success_msg)
         
         return history_entry
     
     # --- 错误处理 (保持不变) ---
     except ovh.exceptions.APIError as e:
+        cart_id = cart_state["cart_id"]
         # 检查是否是"不可用"错误
         error_str = str(e)
         is_unavailable_error = "is not available in" in error_str
@@ -1062,7 +3503,7 @@ async def order_server(task_id: str, config: ServerConfig):
             await broadcast_order_failed(history_entry)
             error_tg_msg = f"{api_config.iam}: OVH 操作失败 - {error_str}"
             if cart_id: error_tg_msg += f"\nCart ID: {cart_id}"
-            send_telegram_msg(error_tg_msg)
+            await send_telegram_msg(error_tg_msg)
         else:
             # 对于不可用错误，只广播消息到前端，不发送Telegram通知
             await broadcast_order_failed(history_entry)
@@ -1072,6 +3513,7 @@ async def order_server(task_id: str, config: ServerConfig):
 
     except Exception as e:
         # 其他一般错误处理
+        cart_id = cart_state["cart_id"]
         error_msg = f"订购服务器时发生未知错误: {str(e)}"
         add_log("error", error_msg)
         task_logger.error(error_msg)
@@ -1088,13 +3530,157 @@ async def order_server(task_id: str, config: ServerConfig):
         await broadcast_order_failed(history_entry)
         error_tg_msg = f"{api_config.iam}: 发生意外错误 - {str(e)}"
         if cart_id: error_tg_msg += f"\nCart ID: {cart_id}"
-        send_telegram_msg(error_tg_msg)
+        await send_telegram_msg(error_tg_msg)
+        return history_entry
+
+# 批量(fleet)订购：在有货的数据中心并发结账，每次结账下单1台，直到达到目标台数或花费上限
+async def order_fleet(task_id: str, config: ServerConfig):
+    task = tasks.get(task_id)
+    if not task:
+        return
+    task_logger = get_task_logger(task_id)
+    client = get_ovh_client(task_id)
+    
+    remaining = task.quantity - task.fulfilledCount
+    if remaining <= 0:
+        update_task_status(task_id, "completed", f"批量任务已完成 {task.fulfilledCount}/{task.quantity} 台")
+        return
+    if config.maxSpend is not None and task.spentAmount >= config.maxSpend:
+        update_task_status(task_id, "budget_reached", f"已达到花费上限 {config.maxSpend} (已花费 {task.spentAmount:.2f})，完成 {task.fulfilledCount}/{task.quantity} 台")
+        return
+    
+    progress = f"已完成 {task.fulfilledCount}/{task.quantity}"
+    update_task_status(task_id, "running", f"检查服务器可用性 ({progress})...")
+    try:
+        with trace_span("availability.check", planCode=config.planCode):
+            availabilities = await check_availability(config.planCode, None, task_id)
+    except Exception as e:
+        update_task_status(task_id, "error", f"检查服务器 {config.planCode} 可用性失败: {str(e)}")
+        return
+    
+    availabilities, fqn_matched = select_option_availabilities(availabilities, config)
+    available_dcs = find_available_datacenters(availabilities, config.datacenter)
+    seen_available_at = time.monotonic()
+    if not available_dcs:
+        if fqn_matched:
+            message = f"所选配置 {', '.join(item.get('fqn') or '' for item in availabilities) or '(没有与所选选项对应的FQN)'} 在数据中心 {config.datacenter} 当前无货 ({progress})"
+        else:
+            message = f"计划代码 {config.planCode} 在数据中心 {config.datacenter} 当前无可用服务器 ({progress})"
+        task_logger.info(message)
+        update_task_status(task_id, "pending", message)
+        return
+    
+    # 按并发上限分配结账槽位，轮流分布到各个有货的数据中心
+    slots = min(remaining, max(1, config.maxConcurrent))
+    targets = [available_dcs[i % len(available_dcs)]["datacenter"] for i in range(slots)]
+    task_logger.info(f"批量任务 {task_id} 在 {[d['datacenter'] for d in available_dcs]} 找到可用，本轮并发结账 {slots} 个: {targets}")
+    
+    spend_lock = asyncio.Lock()
+    reserved = {"amount": 0.0}
+    
+    async def checkout_one(datacenter: str):
+        cart_state = {"cart_id": None, "item_id": None, "reserved": None}
+        checkout_config = config.model_copy(update={"quantity": 1, "fleet": False, "datacenter": datacenter})
+        
+        async def reserve_budget(checkout_info, price):
+            # 提交结账前预留花费，保证并发结账的总花费不超过上限
+            if config.maxSpend is None:
+                return
+            if price is None:
+                raise SpendLimitExceeded("无法从结账信息中获取价格，已设置花费上限，放弃结账")
+            async with spend_lock:
+                if task.spentAmount + reserved["amount"] + price > config.maxSpend:
+                    raise SpendLimitExceeded(f"结账价格 {price:.2f} 将超出花费上限 {config.maxSpend} (已花费 {task.spentAmount:.2f})")
+                reserved["amount"] += price
+                cart_state["reserved"] = price
+        
+        if not await acquire_checkout_slot(task_id, config):
+            task_logger.info(f"数据中心 {datacenter}: 结账槽位已被更高优先级的任务占用，本轮跳过")
+            return None
+        try:
+            # 等待槽位期间其他结账可能已达到目标台数或花费上限
+            if task.fulfilledCount >= task.quantity:
+                return None
+            if config.maxSpend is not None and task.spentAmount >= config.maxSpend:
+                raise SpendLimitExceeded(f"已达到花费上限 {config.maxSpend}")
+            result = await build_and_checkout_cart(task_id, checkout_config, datacenter, cart_state, reserve_budget)
+            METRIC_TIME_TO_CHECKOUT.observe(time.monotonic() - seen_available_at)
+        except SpendLimitExceeded:
+            if cart_state["cart_id"]:
+                try:
+                    await delete_cart(task_id, cart_state["cart_id"])
+                except Exception as delete_error:
+                    task_logger.warning(f"删除购物车 {cart_state['cart_id']} 失败: {delete_error}")
+            raise
+        except Exception:
+            if cart_state["cart_id"]: task_logger.error(f"购物车ID: {cart_state['cart_id']}")
+            raise
+        finally:
+            checkout_slots.release()
+            if cart_state["reserved"] is not None:
+                reserved["amount"] -= cart_state["reserved"]
+        
+        price = result["price"] or 0.0
+        task.fulfilledCount += 1
+        task.spentAmount = round(task.spentAmount + price, 2)
+        task.orderIds = task.orderIds + [safe_str(result["orderId"], "N/A")]
+        history_entry = OrderHistory(
+            id=str(uuid.uuid4()), planCode=config.planCode, name=config.name,
+            datacenter=datacenter, orderTime=datetime.now().isoformat(), status="success",
+            orderId=safe_str(result["orderId"], "N/A"), orderUrl=safe_str(result["url"], "N/A"),
+            error=f"Options added: {result['addedOptions']}",
+            taskId=task_id, price=result["price"]
+        )
+        add_order(history_entry, dedupe=False)
+        update_task_status(task_id, "running", f"订单 {result['orderId']} 已创建 (已完成 {task.fulfilledCount}/{task.quantity})")
+        await broadcast_order_completed(history_entry)
+        await send_telegram_msg(f"{api_config.iam}: 批量任务 {config.name} 订单 {result['orderId']} 已创建 ({task.fulfilledCount}/{task.quantity})\n服务器 Plan: {config.planCode}\n数据中心: {datacenter}\n订单链接: {result['url']}")
         return history_entry
+    
+    results = await asyncio.gather(*[checkout_one(dc) for dc in targets], return_exceptions=True)
+    
+    budget_hit = False
+    errors = []
+    for datacenter, result in zip(targets, results):
+        if not isinstance(result, Exception):
+            continue
+        if isinstance(result, SpendLimitExceeded):
+            budget_hit = True
+            task_logger.warning(f"数据中心 {datacenter} 的结账已中止: {result}")
+            continue
+        error_str = str(result)
+        if "is not available in" in error_str:
+            task_logger.info(f"数据中心 {datacenter} 服务器配置暂时不可用: {error_str}")
+            continue
+        errors.append(f"{datacenter}: {error_str}")
+        add_log("error", f"批量任务 {task_id} 在 {datacenter} 下单失败: {error_str}")
+        history_entry = OrderHistory(
+            id=str(uuid.uuid4()), planCode=config.planCode, name=config.name,
+            datacenter=datacenter, orderTime=datetime.now().isoformat(), status="failed",
+            error=error_str, taskId=task_id
+        )
+        add_order(history_entry)
+        await broadcast_order_failed(history_entry)
+    
+    progress = f"已完成 {task.fulfilledCount}/{task.quantity}"
+    if task.fulfilledCount >= task.quantity:
+        update_task_status(task_id, "completed", f"批量任务已完成 {task.fulfilledCount}/{task.quantity} 台，共花费 {task.spentAmount:.2f}")
+        add_log("info", f"批量任务 {task_id} ({config.name}) 已达到目标台数 {task.quantity}")
+    elif budget_hit or (config.maxSpend is not None and task.spentAmount >= config.maxSpend):
+        update_task_status(task_id, "budget_reached", f"已达到花费上限 {config.maxSpend} (已花费 {task.spentAmount:.2f})，{progress}")
+        add_log("warning", f"批量任务 {task_id} ({config.name}) 已达到花费上限，停止下单")
+    elif errors:
+        update_task_status(task_id, "error", f"{progress}，部分结账失败: {'; '.join(errors)}")
+    else:
+        update_task_status(task_id, "pending", f"{progress}，等待下一次库存")
 
 def update_task_status(task_id: str, status: str, message: Optional[str] = None):
     # 实现更新任务状态的逻辑
     if task_id in tasks:
         task = tasks[task_id]
+        if task.status == "paused" and status in ["pending", "error", "running", "cancelled"]:
+            # 暂停期间结束的尝试只更新消息，不恢复调度
+            status = "paused"
         task.status = status
         task.message = message if message else task.message # Keep old message if none provided
         task.lastChecked = datetime.now().isoformat()
@@ -1113,7 +3699,7 @@ def update_task_status(task_id: str, status: str, message: Optional[str] = None)
             # Run broadcast in background to avoid blocking
             asyncio.create_task(broadcast_message({
             "type": "task_updated",
-            "data": task.dict()
+            "data": task.to_dict()
         }))
         except Exception as broadcast_error:
             add_log("error", f"广播任务更新失败: {broadcast_error}")
@@ -1128,6 +3714,9 @@ async def clear_tasks():
     global tasks
     tasks_count = len(tasks)
     tasks = {}
+    for task_id in list(inflight_attempts):
+        cancel_attempt(task_id)
+    attempt_traces.clear()
     save_tasks_to_file()
     add_log("info", f"已清除 {tasks_count} 个任务")
     
@@ -1140,8 +3729,8 @@ async def clear_tasks():
     return {"message": f"已清除 {tasks_count} 个任务"}
 
 @app.get("/api/orders")
-async def get_orders():
-    return orders
+async def get_orders(request: Request, since: Optional[str] = None, format: Optional[str] = None):
+    return records_response(request, OrderHistory, list(orders), since, format)
 
 @app.delete("/api/orders/{order_id}")
 async def delete_order(order_id: str):
@@ -1168,8 +3757,28 @@ async def clear_orders():
     return {"message": f"已清除 {orders_count} 条订单历史记录"}
 
 @app.get("/api/logs")
-async def get_logs(limit: int = 100):
-    return logs[-limit:] if limit < len(logs) else logs
+async def get_logs(request: Request, limit: int = 100, since: Optional[str] = None):
+    version = f"{STATE_BOOT_ID}.{logs_appended}"
+    recent = logs[-limit:] if limit < len(logs) else logs
+    if since is None:
+        return versioned_response(request, version, len(recent), lambda: json_dumps(recent))
+    since_version = parse_since(since)
+    new_count = None if since_version is None else logs_appended - since_version
+    full = new_count is None or not 0 <= new_count <= len(recent)
+    entries = recent if full else recent[len(recent) - new_count:]
+    return versioned_response(request, version, len(recent), lambda: json_dumps({"version": version, "full": full, "entries": entries}))
+
+def serialize_initial_data(task_list: List["TaskStatus"], order_list: List["OrderHistory"], recent_logs, safe_config, connection_status) -> str:
+    return json_dumps({
+        "type": "initial_data",
+        "data": {
+            "tasks": [task.to_dict() for task in task_list],
+            "orders": [order.to_dict() for order in order_list],  # 确保包含所有订单
+            "logs": recent_logs,
+            "api_config": safe_config,  # 发送安全版本的API配置
+            "connection_status": connection_status
+        }
+    })
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -1194,21 +3803,16 @@ async def websocket_endpoint(websocket: WebSocket):
                 safe_config["tgToken"] = "******"
         
         # 发送初始数据，包含API配置状态和所有订单
-        await websocket.send_json({
-            "type": "initial_data",
-            "data": {
-                "tasks": [task.dict() for task in tasks.values()],
-                "orders": [order.dict() for order in orders],  # 确保包含所有订单
-                "logs": logs[-100:],
-                "api_config": safe_config,  # 发送安全版本的API配置
-                "connection_status": {
-                    "is_connected": True,
-                    "connection_id": connection_id,
-                    "total_connections": len(connections),
-                    "server_time": datetime.now().isoformat()
-                }
-            }
-        })
+        # 任务和订单较多时转换和序列化较慢，在线程池中进行，事件循环只复制列表
+        connection_status = {
+            "is_connected": True,
+            "connection_id": connection_id,
+            "total_connections": len(connections),
+            "server_time": datetime.now().isoformat()
+        }
+        initial_payload = await run_in_thread_pool(
+            serialize_initial_data, list(tasks.values()), list(orders), logs[-100:], safe_config, connection_status)
+        await websocket.send_text(initial_payload)
         add_log("info", f"已向客户端 {connection_id} 发送初始数据: {len(tasks)} 个任务, {len(orders)} 个订单, {min(len(logs), 100)} 条日志")
         
         # 立即广播连接状态通知所有客户端
@@ -1223,7 +3827,7 @@ async def websocket_endpoint(websocket: WebSocket):
         
         while True:
             # 检测连接健康状态
-            if websocket.client_state != 1:  # 如果不是CONNECTED状态
+            if websocket.client_state != WebSocketState.CONNECTED:  # 如果不是CONNECTED状态
                 add_log("warning", f"客户端 {connection_id} 连接状态异常，关闭WebSocket")
                 break
                 
@@ -1304,12 +3908,153 @@ async def broadcast_order_completed(order: OrderHistory):
     try:
         await broadcast_message({
             "type": "order_completed",
-            "data": order.dict()
+            "data": order.to_dict()
         })
         add_log("info", f"订单完成消息已广播: {order.orderId}")
     except Exception as e:
         add_log("error", f"广播订单完成消息失败: {str(e)}")
 
+# ---- 订单状态跟踪 ----
+# 一个后台循环跟踪所有已成功下单、尚未交付或取消的订单：每轮只查询到期的订单，
+# 查询之间按 ORDER_TRACKER_CALLS_PER_MINUTE 均匀间隔，订单越久查询间隔越长。
+# 状态变化时更新订单历史，合并保存一次并广播 orders_updated，同时发送Telegram通知。
+ORDER_FINAL_STATUSES = {"delivered", "cancelled"}
+ORDER_STATUS_LABELS = {
+    "notPaid": "未支付", "checking": "核验中", "documentsRequested": "需要提交资料",
+    "delivering": "交付中", "delivered": "已交付", "cancelling": "取消中", "cancelled": "已取消", "unknown": "未知",
+}
+
+def order_age_seconds(order: OrderHistory) -> float:
+    try:
+        return time.time() - datetime.fromisoformat(order.orderTime).timestamp()
+    except ValueError:
+        return 0.0
+
+class OrderStatusTracker:
+    def __init__(self, interval: int, calls_per_minute: int, max_age_days: int):
+        self.interval = interval
+        self.spacing = 60 / max(calls_per_minute, 1)
+        # 每轮最多查询的订单数，保证一轮在下一轮开始前完成
+        self.batch_size = max(1, int(interval / self.spacing))
+        self.max_age = max_age_days * 86400
+        self.next_check: Dict[str, float] = {}  # OrderHistory.id -> 下次查询时间
+        # 最近查询时间只保存在内存中：写入订单会改变其版本 (ETag / ?since=)，只在状态变化时修改订单
+        self.last_checked: Dict[str, str] = {}
+        self.stats = {"polls": 0, "errors": 0, "changes": 0, "lastRunAt": None}
+    
+    def poll_interval(self, order: OrderHistory) -> float:
+        age = order_age_seconds(order)
+        if age < 3600:
+            return 60
+        if age < 86400:
+            return 600
+        if age < 7 * 86400:
+            return 3600
+        return 6 * 3600
+    
+    def tracked(self, order: OrderHistory) -> bool:
+        return (order.status == "success" and bool(order.orderId) and order.orderId.isdigit()
+                and order.orderStatus not in ORDER_FINAL_STATUSES and order_age_seconds(order) < self.max_age)
+    
+    def due_orders(self) -> List[OrderHistory]:
+        now = time.time()
+        due = [order for order in orders if self.tracked(order) and self.next_check.get(order.id, 0) <= now]
+        due.sort(key=lambda order: self.next_check.get(order.id, 0))
+        return due[:self.batch_size]
+    
+    async def poll(self, client, order: OrderHistory) -> bool:
+        """查询一个订单，状态变化时更新订单并返回 True"""
+        status = await ovh_call(client, "get", f"/me/order/{order.orderId}/status")
+        self.stats["polls"] += 1
+        now = datetime.now().isoformat()
+        self.last_checked[order.id] = now
+        if status == order.orderStatus:
+            return False
+        if not order.paidAt and status not in ("notPaid", "cancelling", "cancelled", "unknown"):
+            try:
+                payment = await ovh_call(client, "get", f"/me/order/{order.orderId}/payment")
+                order.paidAt = (payment or {}).get("paymentDate") or now
+            except Exception:
+                order.paidAt = now
+        if status == "delivered":
+            order.deliveredAt = now
+        order.orderStatus = status
+        return True
+    
+    async def run_once(self) -> List[OrderHistory]:
+        due = self.due_orders()
+        if not due:
+            return []
+        self.stats["lastRunAt"] = datetime.now().isoformat()
+        client = get_ovh_client()
+        changed = []
+        for i, order in enumerate(due):
+            if i:
+                await asyncio.sleep(self.spacing)
+            previous = order.orderStatus
+            try:
+                if await self.poll(client, order):
+                    changed.append((order, previous))
+            except Exception as e:
+                self.stats["errors"] += 1
+                add_log("warning", f"查询订单 {order.orderId} 状态失败: {str(e)}")
+            self.next_check[order.id] = time.time() + self.poll_interval(order)
+        # 本轮未变化的订单也更新了检查时间，只在有变化时保存
+        if not changed:
+            return []
+        self.stats["changes"] += len(changed)
+        save_orders_to_file()
+        await broadcast_message({"type": "orders_updated", "data": {"orders": [order.to_dict() for order, _ in changed]}})
+        for order, previous in changed:
+            label = ORDER_STATUS_LABELS.get(order.orderStatus, order.orderStatus)
+            add_log("info", f"订单 {order.orderId} 状态变化: {previous or '-'} -> {order.orderStatus}")
+            # 第一次查询到的状态只在已交付或取消时通知
+            if previous is not None or order.orderStatus in ORDER_FINAL_STATUSES:
+                await send_telegram_msg(f"{api_config.iam if api_config else 'OVH'}: 订单 {order.orderId} ({order.planCode} @ {order.datacenter}) {label}")
+        return [order for order, _ in changed]
+    
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # 多进程模式下只由一个进程查询
+            if cluster and cluster.workers and cluster.preferred_owner("order-tracker") != cluster.worker_id:
+                continue
+            if not api_config:
+                continue
+            try:
+                await self.run_once()
+            except Exception as e:
+                add_log("error", f"订单状态跟踪出错: {str(e)}")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        tracked = [order for order in orders if self.tracked(order)]
+        return {
+            **self.stats,
+            "tracked": len(tracked),
+            "orders": [{
+                "id": order.id, "orderId": order.orderId, "orderStatus": order.orderStatus,
+                "statusCheckedAt": self.last_checked.get(order.id),
+                "nextCheckAt": datetime.fromtimestamp(self.next_check.get(order.id, time.time())).isoformat(),
+            } for order in tracked],
+        }
+
+order_tracker = OrderStatusTracker(settings.ORDER_TRACKER_INTERVAL, settings.ORDER_TRACKER_CALLS_PER_MINUTE, settings.ORDER_TRACKER_MAX_AGE_DAYS)
+
+@app.get("/api/orders/tracking")
+async def get_order_tracking():
+    return order_tracker.snapshot()
+
+@app.post("/api/orders/{order_id}/refresh")
+async def refresh_order_status(order_id: str):
+    """让订单在下一轮跟踪时立即查询"""
+    order = next((order for order in orders if order.id == order_id), None)
+    if order is None:
+        raise HTTPException(status_code=404, detail=f"未找到订单: {order_id}")
+    if not order_tracker.tracked(order):
+        raise HTTPException(status_code=400, detail=f"订单 {order_id} 不在跟踪范围内")
+    order_tracker.next_check[order.id] = 0
+    return {"message": f"订单 {order_id} 将在下一轮跟踪时查询"}
+
 # 添加连接状态检查API端点
 @app.get("/api/connection/status")
 async def get_connection_status():
@@ -1330,10 +4075,54 @@ async def get_application_status():
         "tasks_count": len(tasks),
         "orders_count": len(orders),
         "logs_count": len(logs),
+        "worker_id": cluster.worker_id if cluster else None,
+        "availability_cache": {**availability_cache_stats, "entries": len(availability_cache), "ttl": settings.AVAILABILITY_CACHE_TTL},
+        "availability_hedging": availability_hedger.snapshot() if availability_hedger else None,
         "server_time": datetime.now().isoformat(),
         "uptime": get_uptime()
     }
 
+# 存活检查：能响应即说明事件循环在运行
+@app.get("/healthz")
+async def liveness():
+    return {"status": "alive", "uptime": get_uptime()}
+
+# 就绪检查：任务和订单加载完成且未在关闭时返回200
+@app.get("/readyz")
+async def readiness():
+    ready = startup_state["ready"] and not shutting_down
+    body = {
+        "ready": ready,
+        "stateLoaded": startup_state["ready"],
+        "shuttingDown": shutting_down,
+        "loadMs": startup_state["loadMs"],
+        "tasks": len(tasks),
+        "orders": len(orders),
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+# 查看多进程协调状态（存活进程和本进程持有的任务）
+@app.get("/api/cluster")
+async def get_cluster_status():
+    if not cluster:
+        return {"enabled": False}
+    return {"enabled": True, **cluster.describe()}
+
+# 查看事件循环阻塞记录和调试模式下检测到的同步调用
+@app.get("/api/debug/event-loop")
+async def get_event_loop_report():
+    return {
+        "thresholdMs": settings.LOOP_LAG_THRESHOLD_MS,
+        "blockingDebug": settings.LOOP_BLOCKING_DEBUG,
+        "stalls": list(reversed(loop_watchdog.stalls)),
+        "blockingCalls": sorted(blocking_calls.values(), key=lambda entry: entry["count"], reverse=True),
+    }
+
+# Prometheus 指标端点
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # 添加获取应用运行时间的函数
 start_time = datetime.now()
 def get_uptime():
@@ -1364,6 +4153,7 @@ async def set_ovh_api_config(config: dict):
     
     # 保存配置到文件
     save_config_to_file()
+    publish_cluster_event("config_updated", {})
     
     add_log("info", "OVH API配置已更新")
     return {"message": "OVH API配置已更新"}
@@ -1389,10 +4179,11 @@ async def set_telegram_config(config: dict):
     
     # 保存配置到文件
     save_config_to_file()
+    publish_cluster_event("config_updated", {})
     
     # 尝试发送测试消息到Telegram
     if api_config.tgToken and api_config.tgChatId:
-        test_result = send_telegram_msg("OVH Titan Sniper: Telegram通知已成功配置")
+        test_result = await send_telegram_msg("OVH Titan Sniper: Telegram通知已成功配置")
         if test_result:
             add_log("info", "Telegram测试消息发送成功")
         else:
@@ -1403,14 +4194,186 @@ async def set_telegram_config(config: dict):
 
 # **** 恢复 GET /api/servers 路由 ****
 @app.get("/api/servers")
-async def get_servers(subsidiary: str = 'IE'):
-    catalog = await fetch_product_catalog(subsidiary)
-    return catalog
+async def get_servers(request: Request, subsidiary: str = 'IE'):
+    # 直接返回上游的原始JSON，不在事件循环中解析和重新序列化；客户端支持时返回预先压缩的副本
+    raw = await fetch_product_catalog(subsidiary)
+    encoding = choose_encoding(request.headers.get("accept-encoding", "")) if settings.COMPRESSION_MIN_SIZE > 0 else None
+    compressed = catalog_cache[subsidiary].get("compressed", {}).get(encoding)
+    if compressed is None:
+        return Response(content=raw, media_type="application/json")
+    return Response(content=compressed, media_type="application/json", headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+
+# 从产品目录索引中获取单个服务器的概要（附加选项和价格）
+@app.get("/api/servers/{plan_code}")
+async def get_server_details(plan_code: str, subsidiary: str = 'IE'):
+    if subsidiary not in catalog_cache:
+        await fetch_product_catalog(subsidiary)
+    entry = catalog_cache[subsidiary]["index"].get(plan_code)
+    if not entry:
+        raise HTTPException(status_code=404, detail=f"产品目录中不存在服务器 {plan_code}")
+    return entry
+
+# 产品目录变化记录
+@app.get("/api/catalog/changes")
+async def get_catalog_changes(limit: int = 100, planCode: Optional[str] = None):
+    events = [event for event in catalog_events if not planCode or event["planCode"] == planCode]
+    return events[-limit:]
+
+@app.get("/api/catalog/rules")
+async def get_catalog_rules():
+    return [rule.dict() for rule in catalog_rules]
+
+@app.post("/api/catalog/rules")
+async def create_catalog_rule(rule: CatalogRule):
+    if not (rule.planCodePrefix or rule.nameContains):
+        raise HTTPException(status_code=400, detail="规则至少需要设置 planCodePrefix 或 nameContains")
+    rule.id = str(uuid.uuid4())
+    catalog_rules.append(rule)
+    save_catalog_rules()
+    publish_cluster_event("catalog_rules_updated", {})
+    add_log("info", f"添加了产品目录规则: {rule.name}")
+    return rule.dict()
+
+@app.delete("/api/catalog/rules/{rule_id}")
+async def delete_catalog_rule(rule_id: str):
+    global catalog_rules
+    if not any(rule.id == rule_id for rule in catalog_rules):
+        raise HTTPException(status_code=404, detail=f"规则 {rule_id} 不存在")
+    catalog_rules = [rule for rule in catalog_rules if rule.id != rule_id]
+    save_catalog_rules()
+    publish_cluster_event("catalog_rules_updated", {})
+    return {"message": f"规则 {rule_id} 已删除"}
 
 # **** 恢复 GET /api/tasks 路由 ****
 @app.get("/api/tasks")
-async def get_tasks():
-    return list(tasks.values())
+async def get_tasks(request: Request, since: Optional[str] = None, format: Optional[str] = None):
+    return records_response(request, TaskStatus, list(tasks.values()), since, format)
+
+# ---- 条件请求 ----
+# 任务、订单和日志的GET接口返回基于修改计数的 ETag（进程启动标识.版本号.条数），
+# 请求带 If-None-Match 且未变化时返回304，不再构建响应体；Cache-Control: no-cache 让浏览器每次都带上 ETag 重新验证。
+# ?since=<X-State-Version> 只返回该版本之后变化的部分，版本来自其他进程或重启前时返回全量 (full=true)。
+STATE_BOOT_ID = uuid.uuid4().hex[:8]
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    return bool(header) and (header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(",")))
+
+def versioned_response(request: Request, version: str, size: int, build_body, media_type: str = "application/json") -> Response:
+    """build_body 返回字符串，或返回异步迭代器时以流式响应发送"""
+    etag = f'"{version}.{size}"' if media_type == "application/json" else f'"{version}.{size}.nd"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-State-Version": version}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = build_body()
+    if isinstance(body, str):
+        return Response(content=body, media_type=media_type, headers=headers)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+# 流式输出每批的记录数，每批之间让出事件循环，内存中不拼接完整响应体
+STREAM_BATCH_SIZE = 500
+
+async def stream_records(records: List[CachedRecord], ndjson: bool = False):
+    for start in range(0, max(len(records), 1), STREAM_BATCH_SIZE):
+        batch = records[start:start + STREAM_BATCH_SIZE]
+        if ndjson:
+            chunk = "".join(record.to_json() + "\n" for record in batch)
+        else:
+            chunk = ("[" if start == 0 else ",") + ",".join(record.to_json() for record in batch)
+            if start + STREAM_BATCH_SIZE >= len(records):
+                chunk += "]"
+        yield chunk.encode()
+        await asyncio.sleep(0)
+
+def parse_since(since: Optional[str]) -> Optional[int]:
+    """返回 since 中本进程的版本号，无法用于增量时返回 None"""
+    if not since:
+        return None
+    boot_id, _, version = since.partition(".")
+    if boot_id != STATE_BOOT_ID or not version.isdigit():
+        return None
+    return int(version)
+
+def records_response(request: Request, record_type: type, records: List[CachedRecord], since: Optional[str], format: Optional[str] = None) -> Response:
+    version = f"{STATE_BOOT_ID}.{latest_record_versions.get(record_type, 0)}"
+    if format == "ndjson":
+        # 每行一条记录，适合导出
+        return versioned_response(request, version, len(records), lambda: stream_records(records, ndjson=True), "application/x-ndjson")
+    if since is None:
+        # 使用每条记录缓存的JSON分批输出，未修改的记录不再重新序列化
+        if len(records) <= STREAM_BATCH_SIZE:
+            return versioned_response(request, version, len(records), lambda: "[" + ",".join(record.to_json() for record in records) + "]")
+        return versioned_response(request, version, len(records), lambda: stream_records(records))
+    since_version = parse_since(since)
+    def build_delta() -> str:
+        changed = records if since_version is None else [record for record in records if record._version > since_version]
+        return ('{"version":' + json_dumps(version) + ',"full":' + ("true" if since_version is None else "false")
+                + ',"changed":[' + ",".join(record.to_json() for record in changed) + '],"ids":' + json_dumps([record.id for record in records]) + "}")
+    return versioned_response(request, version, len(records), build_delta)
+
+# 可用性响应通过响应头说明数据的新鲜程度，响应体保持原有格式
+def availability_response(result, age: float) -> JSONResponse:
+    return JSONResponse(content=result, headers={
+        "Age": str(int(age)),
+        "X-Availability-Age": f"{age:.3f}",
+    })
+
+# 按需查看最近一次检查的每个数据中心可用性
+@app.get("/api/availability/table")
+async def get_availability_table(planCode: Optional[str] = None):
+    if planCode:
+        if planCode not in availability_table:
+            raise HTTPException(status_code=404, detail=f"尚未检查过 {planCode} 的可用性")
+        return {planCode: availability_table[planCode]}
+    return availability_table
+
+@app.get("/api/availability/events")
+async def get_availability_events(limit: int = 100, planCode: Optional[str] = None):
+    events = [event for event in availability_events if not planCode or event["planCode"] == planCode]
+    return events[-limit:]
+
+@app.get("/api/availability/history")
+async def get_availability_history(planCode: Optional[str] = None, datacenter: Optional[str] = None,
+                                   fqn: Optional[str] = None, days: float = 30):
+    if not restock_history:
+        raise HTTPException(status_code=400, detail="未启用补货历史记录 (RESTOCK_HISTORY_DB)")
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="days 必须大于0")
+    return await asyncio.to_thread(restock_history.analytics, planCode, datacenter, fqn, days)
+
+@app.get("/api/availability/history/{plan_code}/transitions")
+async def get_availability_transitions(plan_code: str, datacenter: Optional[str] = None, limit: int = 200):
+    if not restock_history:
+        raise HTTPException(status_code=400, detail="未启用补货历史记录 (RESTOCK_HISTORY_DB)")
+    return await asyncio.to_thread(restock_history.transitions, plan_code, datacenter, limit)
+
+@app.get("/api/cart-recipes")
+async def get_cart_recipes():
+    return {"stats": cart_recipe_stats, "recipes": cart_recipes}
+
+@app.delete("/api/cart-recipes")
+async def clear_cart_recipes():
+    cart_recipes.clear()
+    save_cart_recipes()
+    add_log("info", "已清空下单配方缓存")
+    return {"status": "success"}
+
+# 运行时调整可用性日志级别
+@app.get("/api/availability/log-level")
+async def get_availability_log_level():
+    return {"level": availability_log_level, "levels": AVAILABILITY_LOG_LEVELS}
+
+@app.post("/api/availability/log-level")
+async def set_availability_log_level(data: dict):
+    global availability_log_level
+    level = data.get("level")
+    if level not in AVAILABILITY_LOG_LEVELS:
+        raise HTTPException(status_code=400, detail=f"无效的日志级别: {level}，可选: {AVAILABILITY_LOG_LEVELS}")
+    # 切换级别前输出已累计的汇总
+    flush_availability_summary()
+    availability_log_level = level
+    add_log("info", f"可用性日志级别已设置为 {level}")
+    return {"level": availability_log_level}
 
 # **** 恢复 GET /api/servers/{plan_code}/availability (如果需要) ****
 # 这个端点似乎在日志中没有报错，但为了完整性可以检查
@@ -1428,8 +4391,8 @@ async def get_server_availability(plan_code: str, request: Request):
         except Exception as parse_error:
             add_log("info", f"GET请求没有提供选项或无法解析请求体 ({parse_error})，使用默认配置")
         
-        result = await check_availability(plan_code, options)
-        return result
+        result, age = await get_availability(plan_code, options)
+        return availability_response(result, age)
     except Exception as e:
         add_log("error", f"获取服务器 {plan_code} 可用性数据时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1444,8 +4407,8 @@ async def post_server_availability(plan_code: str, data: dict):
         options = [AddonOption(**opt) for opt in options_data]
         add_log("info", f"从请求体中解析出选项: {options}")
         
-        result = await check_availability(plan_code, options)
-        return result
+        result, age = await get_availability(plan_code, options)
+        return availability_response(result, age)
     except Exception as e:
         add_log("error", f"POST获取服务器 {plan_code} 可用性数据时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1455,8 +4418,6 @@ async def post_server_availability(plan_code: str, data: dict):
 async def create_task(config: ServerConfig):
     # ... (函数内容保持不变)
     task_id = str(uuid.uuid4())
-    now = datetime.now().isoformat()
-    next_check = datetime.fromtimestamp(datetime.now().timestamp() + 5).isoformat()
     
     options_log = []
     for opt in config.options:
@@ -1464,37 +4425,164 @@ async def create_task(config: ServerConfig):
     
     add_log("info", f"创建任务请求: planCode={config.planCode}, 数据中心={config.datacenter}, 原始选项=[{', '.join(options_log)}]")
     
-    datacenter = config.datacenter.strip()
+    new_task = build_task(config, task_id)
+    tasks[task_id] = new_task
+    add_log("info", f"创建了新任务: {config.name} ({task_id}), 数据中心: {new_task.datacenter}, 重试间隔: {new_task.taskInterval}秒, 最大重试次数: {new_task.maxRetries}, 配置选项: {len(new_task.options)}个")
+    if new_task.is_fleet:
+        add_log("info", f"任务 {task_id} 为批量任务: 目标 {new_task.quantity} 台, 并发上限 {new_task.maxConcurrent}, 花费上限 {new_task.maxSpend if new_task.maxSpend is not None else '不限'}")
+    
+    save_tasks_to_file()
     
-    new_task = TaskStatus(
-        id=task_id,
+    try:
+        await broadcast_message({
+            "type": "task_created",
+            "data": new_task.to_dict()
+        })
+    except Exception as e:
+        add_log("error", f"广播任务创建消息失败: {str(e)}")
+        
+    return new_task.to_dict()
+
+# 根据配置构造新任务（不保存、不广播）
+def build_task(config: ServerConfig, task_id: Optional[str] = None, status: str = "pending") -> TaskStatus:
+    now = datetime.now().isoformat()
+    next_check = datetime.fromtimestamp(datetime.now().timestamp() + 5).isoformat()
+    datacenter = config.datacenter.strip()
+    return TaskStatus(
+        id=task_id or str(uuid.uuid4()),
         name=config.name,
         planCode=config.planCode,
         datacenter=datacenter,
-        status="pending",
+        status=status,
         createdAt=now,
         lastChecked=now,
         maxRetries=config.maxRetries,
-        nextRetryAt=next_check,
-        message="任务已创建，等待执行",
+        nextRetryAt=next_check if status == "pending" else None,
+        message="任务已创建，等待执行" if status == "pending" else "任务已导入，处于暂停状态",
         taskInterval=config.taskInterval if config.taskInterval else 60,
-        options=config.options
+        options=config.options,
+        quantity=max(1, config.quantity),
+        fleet=config.fleet,
+        maxConcurrent=max(1, config.maxConcurrent),
+        maxSpend=config.maxSpend,
+        priority=config.priority
     )
-    
-    tasks[task_id] = new_task
-    add_log("info", f"创建了新任务: {config.name} ({task_id}), 数据中心: {datacenter}, 重试间隔: {new_task.taskInterval}秒, 最大重试次数: {new_task.maxRetries}, 配置选项: {len(new_task.options)}个")
-    
+
+# ---- 批量任务操作 ----
+# 每个批量操作在事件循环中一次性完成（中间没有 await），只写一次 tasks.json，只广播一条 tasks_bulk_updated 消息
+RETRYABLE_TASK_STATUSES = ["error", "max_retries_reached", "cancelled", "needs_review"]
+# 可以批量暂停的任务状态，即任务循环会调度的状态
+PAUSABLE_TASK_STATUSES = ["pending", "error"]
+
+def select_tasks(selection: TaskSelection) -> List[TaskStatus]:
+    if not selection.all and not selection.ids and not (selection.status or selection.planCode or selection.datacenter):
+        raise HTTPException(status_code=400, detail="请指定 ids、过滤条件 (status/planCode/datacenter) 或 all=true")
+    candidates = tasks.values()
+    if selection.ids:
+        candidates = [tasks[task_id] for task_id in dict.fromkeys(selection.ids) if task_id in tasks]
+    selected = []
+    for task in candidates:
+        if selection.status and task.status not in selection.status:
+            continue
+        if selection.planCode and task.planCode != selection.planCode:
+            continue
+        if selection.datacenter and task.datacenter.lower() != selection.datacenter.lower():
+            continue
+        selected.append(task)
+    return selected
+
+async def commit_bulk_change(action: str, changed: List[TaskStatus], deleted: Optional[List[str]] = None):
+    deleted = deleted or []
+    if not changed and not deleted:
+        return
     save_tasks_to_file()
-    
     try:
         await broadcast_message({
-            "type": "task_created",
-            "data": new_task.dict()
+            "type": "tasks_bulk_updated",
+            "data": {"action": action, "tasks": [task.to_dict() for task in changed], "deleted": deleted}
         })
     except Exception as e:
-        add_log("error", f"广播任务创建消息失败: {str(e)}")
-        
-    return new_task
+        add_log("error", f"广播批量任务更新失败: {str(e)}")
+
+def set_tasks_status(changed: List[TaskStatus], status: str, message: str, next_retry_at: Optional[str] = None):
+    now = datetime.now().isoformat()
+    for task in changed:
+        task.status = status
+        task.message = message
+        task.lastChecked = now
+        task.nextRetryAt = next_retry_at
+
+@app.post("/api/tasks/bulk")
+async def create_tasks_bulk(data: BulkTaskCreate):
+    created = [build_task(config) for config in data.tasks]
+    for task in created:
+        tasks[task.id] = task
+    add_log("info", f"批量创建了 {len(created)} 个任务")
+    await commit_bulk_change("create", created)
+    return {"created": len(created), "ids": [task.id for task in created]}
+
+@app.post("/api/tasks/import")
+async def import_tasks(data: TaskImport):
+    """导入 GET /api/tasks 导出的任务：保留未被占用的ID，暂停状态保持暂停，其余重置为等待状态"""
+    config_fields = set(ServerConfig.model_fields)
+    imported = []
+    # 先全部校验，任何一条无效时都不做修改
+    for index, item in enumerate(data.tasks):
+        try:
+            config = ServerConfig(**{key: value for key, value in item.items() if key in config_fields})
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"第 {index + 1} 个任务无效: {e}")
+        task_id = item.get("id")
+        if not task_id or task_id in tasks or any(task.id == task_id for task in imported):
+            task_id = None
+        imported.append(build_task(config, task_id, "paused" if item.get("status") == "paused" else "pending"))
+    for task in imported:
+        tasks[task.id] = task
+    add_log("info", f"导入了 {len(imported)} 个任务")
+    await commit_bulk_change("import", imported)
+    return {"imported": len(imported), "ids": [task.id for task in imported]}
+
+@app.post("/api/tasks/bulk/pause")
+async def pause_tasks(selection: TaskSelection):
+    # 只暂停参与调度的任务：恢复时统一改为等待状态，其他状态（如需人工确认）暂停后恢复会丢失原状态；
+    # 有进行中的尝试的任务不暂停（可能已提交结账），等尝试结束后再暂停
+    changed = [task for task in select_tasks(selection)
+               if task.status in PAUSABLE_TASK_STATUSES and task.id not in inflight_attempts]
+    set_tasks_status(changed, "paused", "任务已暂停")
+    add_log("info", f"已暂停 {len(changed)} 个任务")
+    await commit_bulk_change("pause", changed)
+    return {"paused": len(changed), "ids": [task.id for task in changed]}
+
+@app.post("/api/tasks/bulk/resume")
+async def resume_tasks(selection: TaskSelection):
+    changed = [task for task in select_tasks(selection) if task.status == "paused"]
+    # 恢复后立即参与下一轮调度
+    set_tasks_status(changed, "pending", "任务已恢复，将重新尝试", datetime.now().isoformat())
+    add_log("info", f"已恢复 {len(changed)} 个任务")
+    await commit_bulk_change("resume", changed)
+    return {"resumed": len(changed), "ids": [task.id for task in changed]}
+
+@app.post("/api/tasks/bulk/retry")
+async def retry_tasks(selection: TaskSelection):
+    changed = [task for task in select_tasks(selection)
+               if task.status in RETRYABLE_TASK_STATUSES and task.id not in inflight_attempts]
+    for task in changed:
+        task.retryCount = 0
+    set_tasks_status(changed, "pending", "任务已手动重置，将重新尝试", datetime.now().isoformat())
+    add_log("info", f"已重置 {len(changed)} 个任务")
+    await commit_bulk_change("retry", changed)
+    return {"retried": len(changed), "ids": [task.id for task in changed]}
+
+@app.post("/api/tasks/bulk/delete")
+async def delete_tasks_bulk(selection: TaskSelection):
+    deleted = [task.id for task in select_tasks(selection)]
+    for task_id in deleted:
+        del tasks[task_id]
+        cancel_attempt(task_id)
+        attempt_traces.pop(task_id, None)
+    add_log("info", f"批量删除了 {len(deleted)} 个任务")
+    await commit_bulk_change("delete", [], deleted)
+    return {"deleted": len(deleted), "ids": deleted}
 
 # **** 保留 DELETE /api/tasks/{task_id} ****
 @app.delete("/api/tasks/{task_id}")
@@ -1505,6 +4593,8 @@ async def delete_task(task_id: str):
     
     task_name = tasks[task_id].name
     del tasks[task_id]
+    cancel_attempt(task_id)
+    attempt_traces.pop(task_id, None)
     add_log("info", f"删除了任务: {task_name} ({task_id})")
     
     save_tasks_to_file()
@@ -1525,7 +4615,10 @@ async def retry_task(task_id: str):
     
     task = tasks[task_id]
     
-    if task.status == "error" or task.status == "max_retries_reached": # 允许重置达到最大次数的任务
+    if task_id in inflight_attempts:
+        return {"message": f"任务 {task_id} 已有进行中的尝试，无需重置"}
+    
+    if task.status in RETRYABLE_TASK_STATUSES: # 允许重置达到最大次数、已取消或需人工确认的任务
         task.retryCount = 0 # 重置计数
         update_task_status(task_id, "pending", "任务已手动重置，将重新尝试")
         add_log("info", f"任务 {task_id} ({task.name}) 已被手动重置为等待状态")
@@ -1533,6 +4626,38 @@ async def retry_task(task_id: str):
     else:
         return {"message": f"任务 {task_id} 当前状态为 {task.status}，无需重置"}
 
+# 查看任务最近的尝试时间线
+@app.get("/api/tasks/{task_id}/attempts")
+async def get_task_attempts(task_id: str, limit: int = 20):
+    if task_id not in tasks and task_id not in attempt_traces:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    return get_attempt_traces(task_id)[:limit]
+
+# 取消任务当前进行中的尝试
+@app.post("/api/tasks/{task_id}/cancel")
+async def cancel_task_attempt(task_id: str):
+    if task_id not in tasks:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    attempt = get_inflight_attempt(task_id)
+    if not cancel_attempt(task_id):
+        if cluster and not cluster.owns(task_id):
+            # 任务由其他进程执行，转发取消请求
+            publish_cluster_event("attempt_cancel", {"id": task_id})
+            return {"message": f"任务 {task_id} 由其他进程执行，已转发取消请求"}
+        return {"message": f"任务 {task_id} 当前没有进行中的尝试"}
+    add_log("info", f"已请求取消任务 {task_id} 的尝试 {attempt['attemptId']}")
+    return {"message": f"已取消任务 {task_id} 的尝试 {attempt['attemptId']}", "attempt": attempt}
+
+# 查看结账槽位占用和排队情况
+@app.get("/api/checkout-slots")
+async def get_checkout_slots():
+    return checkout_slots.snapshot()
+
+# 查看所有进行中的下单尝试
+@app.get("/api/inflight")
+async def get_inflight_attempts():
+    return [get_inflight_attempt(task_id) for task_id in list(inflight_attempts)]
+
 # 添加一个新的端点，用于直接使用默认配置下单
 @app.post("/api/queue/new")
 async def create_default_task(data: dict):
@@ -1542,7 +4667,12 @@ async def create_default_task(data: dict):
     {
         "name": "KS-A | Intel i7-6700k",  # 服务器名称
         "planCode": "24ska01",            # 服务器型号代码
-        "datacenter": "gra"               # 数据中心
+        "datacenter": "gra",              # 数据中心，"any" 表示任意数据中心
+        "quantity": 1,                    # 可选，台数，默认在一个购物车中下单
+        "fleet": false,                   # 可选，为 true 且 quantity 大于1时为批量任务，每次结账1台直到达到目标台数
+        "maxConcurrent": 1,               # 可选，批量任务同时结账数上限
+        "maxSpend": null,                 # 可选，批量任务花费上限
+        "priority": "normal"              # 可选，high / normal / low
     }
     """
     try:
@@ -1562,7 +4692,12 @@ async def create_default_task(data: dict):
             name=name,
             maxRetries=-1,  # 无限重试
             taskInterval=60,  # 默认60秒
-            options=[]  # 空列表，不传递任何配置选项
+            options=[],  # 空列表，不传递任何配置选项
+            quantity=int(data.get("quantity") or 1),
+            fleet=bool(data.get("fleet")),
+            maxConcurrent=int(data.get("maxConcurrent") or 1),
+            maxSpend=data.get("maxSpend"),
+            priority=data.get("priority") or "normal"
         )
         
         # 记录日志
@@ -1574,7 +4709,7 @@ async def create_default_task(data: dict):
         return {
             "status": "success",
             "message": f"已使用默认配置创建任务: {name}",
-            "task_id": new_task.id
+            "task_id": new_task["id"]
         }
         
     except Exception as e:
@@ -1583,4 +4718,5 @@ async def create_default_task(data: dict):
 
 # 运行服务器
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
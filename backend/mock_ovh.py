@@ -0,0 +1,215 @@
+"""
+本地模拟的OVH API，用于离线压测(benchmark.py)，不会访问真实的OVH接口。
+
+模拟的端点: /auth/time, /dedicated/server/datacenter/availabilities, 购物车(/order/cart 及
+eco、requiredConfiguration、configuration、eco/options、assign、checkout)。
+可配置延迟、随机错误和429限流，并按路径模板统计调用次数。
+
+单独运行:
+    python mock_ovh.py --port 9000 --latency 30 --error-rate 0.01 --rate-limit 0.02
+在代码中使用:
+    state = MockOVHState(latency_ms=20)
+    server, base_url = start_mock_server(state)
+    register_mock_endpoint(base_url)  # 之后 ovh.Client(endpoint="mock", ...) 会访问本地模拟服务
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+DEFAULT_DATACENTERS = ["gra", "rbx", "sbg", "bhs", "waw", "lon", "fra", "syd", "sgp"]
+
+
+class MockOVHState:
+    def __init__(self, latency_ms: float = 20, jitter_ms: float = 5, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, stock_ratio: float = 1.0, price: float = 12.99,
+                 datacenters: Optional[List[str]] = None, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate  # 返回500的比例
+        self.rate_limit_rate = rate_limit_rate  # 返回429的比例
+        self.stock_ratio = stock_ratio  # 数据中心有货的比例
+        self.price = price
+        self.datacenters = datacenters or list(DEFAULT_DATACENTERS)
+        self.random = random.Random(seed)
+        # 可选：固定的库存表 planCode -> {datacenter: availability}，未设置的 planCode 按 stock_ratio 随机生成
+        self.stock: Dict[str, Dict[str, str]] = {}
+        self.calls: Dict[str, int] = {}
+        self.status_codes: Dict[int, int] = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def count(self, template: str, status: int):
+        with self.lock:
+            self.calls[template] = self.calls.get(template, 0) + 1
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+    def total_calls(self) -> int:
+        with self.lock:
+            return sum(self.calls.values())
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.status_codes.clear()
+
+    def availability_for(self, plan_code: str) -> List[Dict[str, Any]]:
+        dcs = self.stock.get(plan_code)
+        if dcs is None:
+            dcs = {dc: ("1H-high" if self.random.random() < self.stock_ratio else "unavailable") for dc in self.datacenters}
+        return [{
+            # 与 eco/options 返回的内存和硬盘选项一致
+            "fqn": f"{plan_code}.ram-64g-ecc-2133.softraid-2x2000sa",
+            "planCode": plan_code,
+            "memory": "ram-64g-ecc-2133",
+            "storage": "softraid-2x2000sa",
+            "server": plan_code,
+            "datacenters": [{"datacenter": dc, "availability": availability} for dc, availability in dcs.items()],
+        }]
+
+
+def path_template(path: str) -> str:
+    segments = path.strip("/").split("/")
+    return "/" + "/".join("{id}" if segment.isdigit() or (i > 0 and segments[i - 1] in ("cart", "item")) else segment
+                          for i, segment in enumerate(segments))
+
+
+def create_app(state: MockOVHState) -> FastAPI:
+    app = FastAPI(title="Mock OVH API")
+
+    @app.middleware("http")
+    async def inject_latency_and_errors(request: Request, call_next):
+        path = request.url.path
+        if path.startswith("/1.0"):
+            path = path[len("/1.0"):]
+        template = path_template(path)
+        if template.startswith("/_mock"):
+            return await call_next(request)
+        delay = max(0.0, state.latency_ms + state.random.uniform(-state.jitter_ms, state.jitter_ms)) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+        roll = state.random.random()
+        if roll < state.rate_limit_rate:
+            state.count(template, 429)
+            return JSONResponse(status_code=429, content={"message": "Too many requests"})
+        if roll < state.rate_limit_rate + state.error_rate:
+            state.count(template, 500)
+            return JSONResponse(status_code=500, content={"message": "Internal server error (mock)"})
+        response = await call_next(request)
+        state.count(template, response.status_code)
+        return response
+
+    @app.get("/1.0/auth/time")
+    async def auth_time():
+        return int(time.time())
+
+    @app.get("/1.0/dedicated/server/datacenter/availabilities")
+    async def availabilities(planCode: str):
+        return state.availability_for(planCode)
+
+    @app.post("/1.0/order/cart")
+    async def create_cart():
+        return {"cartId": uuid.uuid4().hex[:12], "expire": None, "readOnly": False, "items": []}
+
+    @app.post("/1.0/order/cart/{cart_id}/eco")
+    async def add_item(cart_id: str):
+        return {"itemId": next(state.ids), "cartId": cart_id}
+
+    @app.get("/1.0/order/cart/{cart_id}/item/{item_id}/requiredConfiguration")
+    async def required_configuration(cart_id: str, item_id: int):
+        return [
+            {"label": "dedicated_datacenter", "required": True, "type": "String"},
+            {"label": "dedicated_os", "required": True, "type": "String"},
+            {"label": "region", "required": True, "type": "String"},
+        ]
+
+    @app.post("/1.0/order/cart/{cart_id}/item/{item_id}/configuration")
+    async def configure(cart_id: str, item_id: int, request: Request):
+        body = await request.json()
+        return {"id": next(state.ids), "label": body.get("label"), "value": body.get("value")}
+
+    @app.get("/1.0/order/cart/{cart_id}/eco/options")
+    async def eco_options(cart_id: str, planCode: str):
+        return [
+            {"planCode": f"ram-64g-ecc-2133-{planCode}", "family": "memory", "duration": "P1M", "pricingMode": "default"},
+            {"planCode": f"softraid-2x2000sa-{planCode}", "family": "storage", "duration": "P1M", "pricingMode": "default"},
+            {"planCode": f"bandwidth-300-{planCode}", "family": "bandwidth", "duration": "P1M", "pricingMode": "default"},
+        ]
+
+    @app.post("/1.0/order/cart/{cart_id}/eco/options")
+    async def add_option(cart_id: str):
+        return {"itemId": next(state.ids), "cartId": cart_id}
+
+    @app.post("/1.0/order/cart/{cart_id}/assign")
+    async def assign(cart_id: str):
+        return None
+
+    @app.get("/1.0/order/cart/{cart_id}/checkout")
+    async def checkout_info(cart_id: str):
+        return {"orderId": None, "prices": {"withTax": {"value": state.price, "currencyCode": "EUR"},
+                                            "withoutTax": {"value": round(state.price / 1.2, 2), "currencyCode": "EUR"}}}
+
+    @app.post("/1.0/order/cart/{cart_id}/checkout")
+    async def checkout(cart_id: str):
+        order_id = next(state.ids)
+        return {"orderId": order_id, "url": f"https://mock.invalid/order/{order_id}",
+                "prices": {"withTax": {"value": state.price, "currencyCode": "EUR"}}}
+
+    @app.delete("/1.0/order/cart/{cart_id}")
+    async def delete_cart(cart_id: str):
+        return None
+
+    @app.get("/_mock/stats")
+    async def stats():
+        return {"calls": state.calls, "statusCodes": state.status_codes, "total": state.total_calls()}
+
+    @app.post("/_mock/stock")
+    async def set_stock(data: dict):
+        # 请求体: {"planCode": {"gra": "1H-high", "rbx": "unavailable"}}
+        state.stock.update(data)
+        return {"stock": state.stock}
+
+    return app
+
+
+def start_mock_server(state: MockOVHState, host: str = "127.0.0.1", port: int = 0):
+    """在后台线程中启动模拟服务，返回 (uvicorn.Server, 基础URL)"""
+    config = uvicorn.Config(create_app(state), host=host, port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, name="mock-ovh", daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("模拟OVH服务启动超时")
+        time.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://{host}:{bound_port}/1.0"
+
+
+def register_mock_endpoint(base_url: str, name: str = "mock"):
+    """把模拟服务注册为 ovh 库的一个 endpoint"""
+    import ovh.client
+    ovh.client.ENDPOINTS[name] = base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟OVH API")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=20, help="平均延迟(毫秒)")
+    parser.add_argument("--jitter", type=float, default=5, help="延迟抖动(毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--stock-ratio", type=float, default=1.0, help="数据中心有货的比例")
+    args = parser.parse_args()
+    mock_state = MockOVHState(latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+                              rate_limit_rate=args.rate_limit, stock_ratio=args.stock_ratio)
+    uvicorn.run(create_app(mock_state), host="127.0.0.1", port=args.port)
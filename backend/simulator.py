@@ -0,0 +1,446 @@
+"""
+可用性轨迹回放：在模拟时间中用真实的任务循环和下单逻辑 (main.task_execution_loop / order_server) 回放
+记录下来的可用性轨迹，评估不同轮询策略能抓到多少次补货、发现延迟和消耗的API调用数，不会访问真实的OVH接口。
+
+轨迹来源:
+    --trace       设置 AVAILABILITY_TRACE_FILE 后记录的 JSON Lines 文件
+    --history-db  补货历史数据库 (RESTOCK_HISTORY_DB) 中的原始变化记录，只包含最近 RESTOCK_RAW_RETENTION_DAYS 天
+
+模拟的购物车API在结账时按轨迹判断所选配置在该数据中心是否仍然有货，无货时返回 "is not available in" 错误；
+--rate-limit 按每分钟请求数限制，超出时返回429错误。下单成功后任务会继续等待下一次补货。
+
+用法 (在 backend 目录下):
+    python simulator.py --trace availability.trace
+    python simulator.py --trace availability.trace --plan 24ska01 --datacenter gra --option memory=ram-64g
+    python simulator.py --history-db ovh_sniper.db --interval 10,30,60 --loop-interval 1,5 --rate-limit 0,60
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import os
+import selectors
+import sqlite3
+import sys
+import tempfile
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))]
+
+
+class AvailabilityTrace:
+    """按 planCode 保存每个变化时刻之后的完整状态 {fqn: {datacenter: availability}}"""
+    def __init__(self, events: List[tuple]):
+        self.times: Dict[str, List[float]] = {}
+        self.states: Dict[str, List[Dict[str, Dict[str, Optional[str]]]]] = {}
+        for ts, plan_code, changes in sorted(events, key=lambda event: event[0]):
+            times = self.times.setdefault(plan_code, [])
+            states = self.states.setdefault(plan_code, [])
+            state = {fqn: dict(dcs) for fqn, dcs in states[-1].items()} if states else {}
+            for fqn, dcs in changes.items():
+                state.setdefault(fqn, {}).update(dcs)
+            if times and times[-1] == ts:
+                states[-1] = state
+            else:
+                times.append(ts)
+                states.append(state)
+        all_times = [ts for times in self.times.values() for ts in times]
+        self.start = min(all_times) if all_times else 0.0
+        self.end = max(all_times) if all_times else 0.0
+
+    @classmethod
+    def load_file(cls, path: str) -> "AvailabilityTrace":
+        events = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    events.append((record["t"], record["p"], record["c"]))
+        return cls(events)
+
+    @classmethod
+    def load_history_db(cls, path: str) -> "AvailabilityTrace":
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT ts, plan_code, fqn, datacenter, availability FROM availability_transitions ORDER BY ts").fetchall()
+        finally:
+            conn.close()
+        return cls([(ts, plan_code, {fqn: {datacenter: availability}}) for ts, plan_code, fqn, datacenter, availability in rows])
+
+    def plan_codes(self) -> List[str]:
+        return sorted(self.times)
+
+    def response(self, plan_code: str, ts: float) -> List[Dict[str, Any]]:
+        """返回与 /dedicated/server/datacenter/availabilities 相同格式的数据"""
+        times = self.times.get(plan_code)
+        index = bisect.bisect_right(times, ts) - 1 if times else -1
+        if index < 0:
+            return []
+        return [{
+            "fqn": fqn,
+            "planCode": plan_code,
+            "datacenters": [{"datacenter": datacenter, "availability": availability} for datacenter, availability in dcs.items()],
+        } for fqn, dcs in self.states[plan_code][index].items()]
+
+
+# ---- 模拟时间 ----
+# 事件循环的 time() 返回模拟时钟；没有就绪事件时不真正等待，而是把时钟直接拨到下一个定时器。
+# 事件循环使用从0开始的时间，避免时间戳数值过大导致浮点误差使定时器永远差一点才到期。
+class VirtualClock:
+    def __init__(self, start: float):
+        self.start = start
+        self.elapsed = 0.0
+
+    @property
+    def now(self) -> float:
+        return self.start + self.elapsed
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout > 0:
+            self.clock.elapsed += timeout
+        return super().select(0)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        super().__init__(VirtualTimeSelector(clock))
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return self.clock.elapsed
+
+
+class VirtualTimeModule:
+    """替换 main 中的 time 模块，time()/monotonic() 返回模拟时钟"""
+    def __init__(self, clock: VirtualClock):
+        import time as real_time
+        self._real = real_time
+        self._clock = clock
+
+    def time(self):
+        return self._clock.now
+
+    def monotonic(self):
+        return self._clock.now
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+
+def virtual_datetime_class(clock: VirtualClock):
+    class VirtualDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.fromtimestamp(clock.now, tz)
+    return VirtualDatetime
+
+
+class SimulatedOVH:
+    """按轨迹应答的模拟OVH客户端（同步接口，与 ovh.Client 相同的调用方式）"""
+    def __init__(self, main, trace: AvailabilityTrace, clock: VirtualClock, rate_limit: int, price: float = 10.0):
+        import ovh
+        self.main = main
+        self.api_error = ovh.exceptions.APIError
+        self.trace = trace
+        self.clock = clock
+        self.rate_limit = rate_limit
+        self.price = price
+        self.ids = itertools.count(1)
+        self.window = deque()
+        self.carts: Dict[str, Dict[str, Any]] = {}
+        self.calls = {"availability": 0, "cart": 0}
+        self.rate_limited = 0
+        self.availability_requests: Dict[str, List[float]] = {}
+        self.checkouts: List[Dict[str, Any]] = []
+        self.rejected_checkouts = 0
+
+    def _admit(self, kind: str):
+        now = self.clock.now
+        if self.rate_limit > 0:
+            while self.window and self.window[0] <= now - 60:
+                self.window.popleft()
+            if len(self.window) >= self.rate_limit:
+                self.rate_limited += 1
+                raise self.api_error("Too many requests (simulated 429)")
+            self.window.append(now)
+        self.calls[kind] += 1
+
+    def _cart(self, path: str) -> Dict[str, Any]:
+        return self.carts.setdefault(path.split("/")[3], {"planCode": None, "datacenter": None, "options": []})
+
+    def get(self, path: str, **kwargs):
+        if path.startswith("/dedicated/server/datacenter/availabilities"):
+            self._admit("availability")
+            plan_code = kwargs.get("planCode")
+            self.availability_requests.setdefault(plan_code, []).append(self.clock.now)
+            return self.trace.response(plan_code, self.clock.now)
+        self._admit("cart")
+        if path.endswith("/requiredConfiguration"):
+            return [{"label": "dedicated_datacenter", "required": True}, {"label": "dedicated_os", "required": True},
+                    {"label": "region", "required": True}]
+        if path.endswith("/eco/options"):
+            # 由轨迹中该型号的FQN生成可选的内存/硬盘选项
+            plan_code = kwargs.get("planCode")
+            option_codes = set()
+            for item in self.trace.response(plan_code, self.clock.now):
+                parsed = self.main.parse_fqn(item["fqn"])
+                for family in ("memory", "storage"):
+                    if parsed[family]:
+                        option_codes.add((family, f"{parsed[family]}-{plan_code}"))
+            return [{"planCode": code, "family": family, "duration": "P1M", "pricingMode": "default"}
+                    for family, code in sorted(option_codes)]
+        if path.endswith("/checkout"):
+            return {"prices": {"withTax": {"value": self.price}}}
+        return {}
+
+    def post(self, path: str, **kwargs):
+        self._admit("cart")
+        if path == "/order/cart":
+            return {"cartId": f"sim{next(self.ids)}"}
+        if path.endswith("/eco"):
+            self._cart(path)["planCode"] = kwargs.get("planCode")
+            return {"itemId": next(self.ids)}
+        if path.endswith("/configuration"):
+            if kwargs.get("label") == "dedicated_datacenter":
+                self._cart(path)["datacenter"] = kwargs.get("value")
+            return {}
+        if path.endswith("/eco/options"):
+            self._cart(path)["options"].append(kwargs.get("planCode"))
+            return {}
+        if path.endswith("/checkout"):
+            cart = self._cart(path)
+            config = self.main.ServerConfig.model_construct(
+                planCode=cart["planCode"], datacenter=cart["datacenter"],
+                options=[self.main.AddonOption(label="", value=value) for value in cart["options"]])
+            availabilities, _ = self.main.select_option_availabilities(self.trace.response(cart["planCode"], self.clock.now), config)
+            if not self.main.find_available_datacenters(availabilities, cart["datacenter"]):
+                self.rejected_checkouts += 1
+                raise self.api_error(f"Server {cart['planCode']} is not available in {cart['datacenter']} (simulated)")
+            order_id = next(self.ids)
+            self.checkouts.append({"time": self.clock.now, "planCode": cart["planCode"], "datacenter": cart["datacenter"]})
+            return {"orderId": order_id, "url": f"https://simulated.invalid/order/{order_id}"}
+        return {}
+
+    def delete(self, path: str, **kwargs):
+        self._admit("cart")
+        return None
+
+
+def restock_episodes(main, trace: AvailabilityTrace, config, end: float) -> List[tuple]:
+    """任务所选配置在目标数据中心有货的时段 [(开始, 结束)]"""
+    episodes = []
+    started = None
+    for ts in trace.times.get(config.planCode, []):
+        availabilities, _ = main.select_option_availabilities(trace.response(config.planCode, ts), config)
+        in_stock = bool(main.find_available_datacenters(availabilities, config.datacenter))
+        if in_stock and started is None:
+            started = ts
+        elif not in_stock and started is not None:
+            episodes.append((started, ts))
+            started = None
+    if started is not None:
+        episodes.append((started, end))
+    return episodes
+
+
+# 多次模拟时只包装一次原始函数
+ORIGINALS: Dict[str, Any] = {}
+
+
+def install_simulation(main, client: SimulatedOVH, clock: VirtualClock, latency: float):
+    """把 main 切换到模拟时间和模拟客户端，并关闭持久化、通知和后台记录"""
+    async def simulated_ovh_call(ovh_client, method: str, path: str, **kwargs):
+        await asyncio.sleep(latency)
+        return getattr(ovh_client, method)(path, **kwargs)
+
+    original_update_task_status = ORIGINALS.setdefault("update_task_status", main.update_task_status)
+
+    def update_task_status(task_id: str, status: str, message: Optional[str] = None):
+        # 下单成功后继续等待下一次补货，以便统计整段轨迹中抓到的补货次数
+        if status == "completed":
+            status = "pending"
+        original_update_task_status(task_id, status, message)
+
+    main.ovh_call = simulated_ovh_call
+    main.get_ovh_client = lambda task_id=None: client
+    main.update_task_status = update_task_status
+    main.time = VirtualTimeModule(clock)
+    main.datetime = virtual_datetime_class(clock)
+    main.save_tasks_to_file = lambda: None
+    main.save_orders_to_file = lambda: None
+    main.save_cart_recipes = lambda: None
+    async def send_telegram_msg(message):
+        return True
+    main.send_telegram_msg = send_telegram_msg
+    main.attempt_journal = None
+    main.restock_history = None
+    main.availability_trace = None
+    main.cluster = None
+    main.api_config = main.ApiConfig(appKey="sim", appSecret="sim", consumerKey="sim")
+    main.tasks = {}
+    main.orders = []
+    main.logs.clear()
+    main.inflight_attempts.clear()
+    main.attempt_traces.clear()
+    main.availability_cache.clear()
+    main.availability_inflight.clear()
+    main.cart_recipes.clear()
+    main.checkout_slots = main.CheckoutSlots(main.settings.CHECKOUT_SLOTS)
+
+
+async def run_strategy(main, trace: AvailabilityTrace, configs: List[Any], end: float, interval: int, client: SimulatedOVH):
+    for config in configs:
+        task = main.build_task(config.model_copy(update={"taskInterval": interval}))
+        task.nextRetryAt = main.datetime.now().isoformat()
+        main.tasks[task.id] = task
+    runner = asyncio.create_task(main.task_execution_loop())
+    await asyncio.sleep(end - trace.start)
+    runner.cancel()
+    for task_id in list(main.inflight_attempts):
+        main.cancel_attempt(task_id)
+    await asyncio.sleep(0)
+
+
+def simulate(main, trace: AvailabilityTrace, configs: List[Any], end: float, interval: int, loop_interval: float,
+             rate_limit: int, latency: float) -> Dict[str, Any]:
+    clock = VirtualClock(trace.start)
+    client = SimulatedOVH(main, trace, clock, rate_limit)
+    install_simulation(main, client, clock, latency)
+    main.settings.TASK_LOOP_INTERVAL = loop_interval
+    loop = VirtualTimeLoop(clock)
+    try:
+        loop.run_until_complete(run_strategy(main, trace, configs, end, interval, client))
+    finally:
+        loop.close()
+
+    episodes_total = 0
+    caught = 0
+    detection_delays = []
+    order_delays = []
+    for config in configs:
+        requests = client.availability_requests.get(config.planCode, [])
+        checkouts = [checkout["time"] for checkout in client.checkouts
+                     if checkout["planCode"] == config.planCode and main.datacenter_matches(config.datacenter, checkout["datacenter"])]
+        for start, stop in restock_episodes(main, trace, config, end):
+            episodes_total += 1
+            index = bisect.bisect_left(requests, start)
+            if index < len(requests) and requests[index] < stop:
+                detection_delays.append(requests[index] - start)
+            first_order = next((ts for ts in checkouts if start <= ts <= stop), None)
+            if first_order is not None:
+                caught += 1
+                order_delays.append(first_order - start)
+    hours = max(end - trace.start, 1) / 3600
+    total_calls = client.calls["availability"] + client.calls["cart"]
+    return {
+        "interval": interval,
+        "loopInterval": loop_interval,
+        "rateLimit": rate_limit,
+        "restocks": episodes_total,
+        "caught": caught,
+        "catchRate": round(caught / episodes_total, 3) if episodes_total else None,
+        "detected": len(detection_delays),
+        "detectionDelayP50": percentile(detection_delays, 50),
+        "detectionDelayP90": percentile(detection_delays, 90),
+        "orderDelayP50": percentile(order_delays, 50),
+        "orderDelayP90": percentile(order_delays, 90),
+        "orders": len(client.checkouts),
+        "rejectedCheckouts": client.rejected_checkouts,
+        "apiCalls": total_calls,
+        "availabilityCalls": client.calls["availability"],
+        "cartCalls": client.calls["cart"],
+        "rateLimited": client.rate_limited,
+        "apiCallsPerHour": round(total_calls / hours, 1),
+    }
+
+
+def round_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def parse_list(value: str, cast) -> list:
+    return [cast(part) for part in value.split(",") if part.strip()]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="OVH Titan Sniper 可用性轨迹回放")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--trace", help="AVAILABILITY_TRACE_FILE 记录的轨迹文件")
+    source.add_argument("--history-db", help="补货历史数据库 (RESTOCK_HISTORY_DB)")
+    parser.add_argument("--plan", action="append", help="要模拟的 planCode，可重复，默认为轨迹中的全部型号")
+    parser.add_argument("--datacenter", default="any", help="任务的目标数据中心")
+    parser.add_argument("--option", action="append", default=[], help="任务的硬件选项 label=value，可重复")
+    parser.add_argument("--interval", type=lambda v: parse_list(v, int), default=[60], help="任务重试间隔(秒)，逗号分隔")
+    parser.add_argument("--loop-interval", type=lambda v: parse_list(v, float), default=[5.0], help="任务循环间隔(秒)，逗号分隔")
+    parser.add_argument("--rate-limit", type=lambda v: parse_list(v, int), default=[0], help="每分钟API请求数上限，0表示不限制，逗号分隔")
+    parser.add_argument("--latency", type=float, default=150, help="模拟API延迟(毫秒)")
+    parser.add_argument("--padding", type=float, default=3600, help="最后一次变化之后继续模拟的时间(秒)")
+    parser.add_argument("--output", help="把结果写入该JSON文件")
+    args = parser.parse_args()
+    trace_path = os.path.abspath(args.trace or args.history_db)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    # main 会在当前目录写日志，切换到临时目录
+    os.chdir(tempfile.mkdtemp(prefix="ovh-sim-"))
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    logging.disable(logging.CRITICAL)
+
+    trace = AvailabilityTrace.load_file(trace_path) if args.trace else AvailabilityTrace.load_history_db(trace_path)
+    plan_codes = args.plan or trace.plan_codes()
+    if not plan_codes:
+        print("轨迹中没有可用性记录")
+        sys.exit(2)
+    options = []
+    for option in args.option:
+        label, _, value = option.partition("=")
+        options.append(main.AddonOption(label=label, value=value))
+    configs = [main.ServerConfig(name=f"sim {plan_code}", planCode=plan_code, datacenter=args.datacenter, options=options)
+               for plan_code in plan_codes]
+    end = trace.end + args.padding
+
+    results = []
+    for interval, loop_interval, rate_limit in itertools.product(args.interval, args.loop_interval, args.rate_limit):
+        print(f"模拟 interval={interval}s loop={loop_interval}s rate-limit={rate_limit}/min ...", file=sys.stderr)
+        results.append(round_result(simulate(main, trace, configs, end, interval, loop_interval, rate_limit, args.latency / 1000)))
+
+    report = {
+        "meta": {
+            "trace": trace_path,
+            "start": datetime.fromtimestamp(trace.start).isoformat(),
+            "end": datetime.fromtimestamp(end).isoformat(),
+            "plans": plan_codes,
+            "datacenter": args.datacenter,
+            "options": args.option,
+            "latency_ms": args.latency,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试直接导入后端模块 main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# main 在当前目录读写状态文件和日志，导入前切换到临时目录，测试不会改动工作区
+os.chdir(tempfile.mkdtemp(prefix="ovh-sniper-tests-"))
+
+
+async def no_telegram(message):
+    return True
+
+
+@pytest.fixture
+def ovh_env(monkeypatch):
+    """清空任务、订单和可用性缓存，不发送Telegram、不写下单日志；返回安装OVH客户端替身的函数"""
+    import main
+    monkeypatch.setattr(main, "api_config", main.ApiConfig(appKey="a", appSecret="b", consumerKey="c"))
+    monkeypatch.setattr(main, "send_telegram_msg", no_telegram)
+    monkeypatch.setattr(main, "tasks", {})
+    monkeypatch.setattr(main, "orders", [])
+    monkeypatch.setattr(main, "attempt_journal", None)
+    monkeypatch.setitem(main.startup_state, "ready", True)
+    main.availability_cache.clear()
+    main.availability_inflight.clear()
+
+    def install(client):
+        monkeypatch.setattr(main, "get_ovh_client", lambda task_id=None: client)
+        return client
+    return install
@@ -0,0 +1,53 @@
+import itertools
+import threading
+
+import ovh
+
+
+class FakeOVHClient:
+    """同步的OVH客户端替身：所有数据中心有货，按路径应答购物车流程并记录调用；fail 中的 (方法, 路径后缀) 抛出 APIError"""
+    def __init__(self, datacenters=("gra", "rbx"), price=10.0, fail=()):
+        self.datacenters = datacenters
+        self.price = price
+        self.fail = set(fail)
+        self.calls = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _record(self, method, path, kwargs):
+        with self.lock:
+            self.calls.append((method, path, kwargs))
+        for failing_method, suffix in self.fail:
+            if method == failing_method and path.endswith(suffix):
+                raise ovh.exceptions.APIError(f"{method} {path} failed")
+
+    def paths(self, method):
+        return [path for called, path, _ in self.calls if called == method]
+
+    def get(self, path, **kwargs):
+        self._record("GET", path, kwargs)
+        if path == "/dedicated/server/datacenter/availabilities":
+            plan_code = kwargs.get("planCode", "24ska01")
+            return [{"fqn": f"{plan_code}.ram-64g-ecc-2133.softraid-2x2000sa", "planCode": plan_code,
+                     "memory": "ram-64g-ecc-2133", "storage": "softraid-2x2000sa",
+                     "datacenters": [{"datacenter": dc, "availability": "1H-high"} for dc in self.datacenters]}]
+        if path.endswith("/requiredConfiguration"):
+            return []
+        if path.endswith("/eco/options"):
+            return []
+        if path.endswith("/checkout"):
+            return {"prices": {"withTax": {"value": self.price}}}
+        return {}
+
+    def post(self, path, **kwargs):
+        self._record("POST", path, kwargs)
+        if path == "/order/cart":
+            return {"cartId": f"cart{next(self.ids)}"}
+        if path.endswith("/eco"):
+            return {"itemId": next(self.ids)}
+        if path.endswith("/checkout"):
+            return {"orderId": next(self.ids), "url": "https://example.invalid/order"}
+        return {}
+
+    def delete(self, path, **kwargs):
+        self._record("DELETE", path, kwargs)
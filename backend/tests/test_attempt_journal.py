@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+
+import main
+from fake_ovh import FakeOVHClient
+
+
+def write_orphan_attempt(path, attempt_id="a1", cart_id="c1"):
+    journal = main.AttemptJournal(path)
+
+    async def write():
+        await journal.append("attempt_start", "t1", attempt_id)
+        await journal.append("cart_created", "t1", attempt_id, cartId=cart_id, datacenter="gra")
+    asyncio.run(write())
+    journal.file.close()
+
+
+def test_failed_cleanup_survives_compaction(tmp_path, monkeypatch):
+    path = str(tmp_path / "attempts.journal")
+    write_orphan_attempt(path)
+    journal = main.AttemptJournal(path)
+    journal.attempts = journal.replay()
+    monkeypatch.setattr(main, "attempt_journal", journal)
+
+    async def failing_delete(task_id, cart_id, attempt_id=None):
+        raise RuntimeError("503")
+    monkeypatch.setattr(main, "delete_cart", failing_delete)
+    asyncio.run(main.cleanup_attempt_carts("t1", "a1", dict(journal.attempts["a1"]["carts"])))
+    asyncio.run(journal.compact())
+    assert "c1" in journal.replay()["a1"]["carts"]
+
+    async def deleting(task_id, cart_id, attempt_id=None):
+        await journal.append("cart_deleted", task_id, attempt_id, cartId=cart_id)
+    monkeypatch.setattr(main, "delete_cart", deleting)
+    asyncio.run(main.cleanup_attempt_carts("t1", "a1", dict(journal.attempts["a1"]["carts"])))
+    asyncio.run(journal.compact())
+    assert journal.replay() == {}
+
+
+def test_only_dead_worker_journals_are_recovered(tmp_path, monkeypatch):
+    base = str(tmp_path / "attempts.journal")
+    cluster = main.ClusterCoordinator(str(tmp_path / "cluster.db"), 15)
+    conn = cluster.connect()
+    conn.executescript(main.COORDINATION_SCHEMA)
+    conn.execute("INSERT INTO workers VALUES (?, ?, ?)", ("host-2-bbbbbb", time.time(), time.time()))
+    conn.close()
+    stale = time.time() - 60
+    for owner, attempt_id in (("host-2-bbbbbb", "live"), ("host-3-cccccc", "dead")):
+        path = f"{base}.{owner}"
+        write_orphan_attempt(path, attempt_id)
+        os.utime(path, (stale, stale))
+    monkeypatch.setattr(main.settings, "ATTEMPT_JOURNAL_FILE", base)
+    monkeypatch.setattr(main, "cluster", cluster)
+    monkeypatch.setattr(main, "api_config", None)
+    journal = main.AttemptJournal(main.attempt_journal_path())
+    monkeypatch.setattr(main, "attempt_journal", journal)
+
+    asyncio.run(main.recover_interrupted_attempts())
+
+    # 存活进程的日志保持不动，已停止进程的日志并入本进程的日志后删除
+    assert os.path.exists(f"{base}.host-2-bbbbbb")
+    assert not os.path.exists(f"{base}.host-3-cccccc")
+    assert not [name for name in os.listdir(tmp_path) if "#" in name]
+    assert set(journal.replay()) == {"dead"}
+
+
+def test_cart_of_failed_attempt_is_deleted(tmp_path, monkeypatch, ovh_env):
+    client = ovh_env(FakeOVHClient(fail={("POST", "/assign")}))
+    journal = main.AttemptJournal(str(tmp_path / "attempts.journal"))
+    monkeypatch.setattr(main, "attempt_journal", journal)
+    config = main.ServerConfig(name="test", planCode="24ska01", datacenter="gra")
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+
+    async def attempt():
+        await main.run_attempt(task.id, "a1", main.order_server(task.id, config))
+        # 删除购物车在后台进行
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(attempt())
+    # order_server 自行处理了 APIError，尝试正常结束，遗留的购物车仍被删除并结束该尝试
+    assert task.status == "error"
+    assert client.paths("DELETE") == ["/order/cart/cart1"]
+    assert journal.attempts == {}
+    assert journal.replay() == {}
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from fake_ovh import FakeOVHClient
+
+AVAILABILITY_PATH = "/dedicated/server/datacenter/availabilities"
+
+
+class SlowOVHClient(FakeOVHClient):
+    """可用性查询耗时 delay 秒，用于观察并发请求的合并"""
+    def __init__(self, delay=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+
+    def get(self, path, **kwargs):
+        if path == AVAILABILITY_PATH:
+            time.sleep(self.delay)
+        return super().get(path, **kwargs)
+
+
+def availability_calls(client):
+    return client.paths("GET").count(AVAILABILITY_PATH)
+
+
+def test_cached_result_is_reused_until_ttl_expires(monkeypatch, ovh_env):
+    client = ovh_env(FakeOVHClient())
+    monkeypatch.setattr(main.settings, "AVAILABILITY_CACHE_TTL", 3.0)
+
+    async def run():
+        first, first_age = await main.get_availability("24ska01")
+        second, second_age = await main.get_availability("24ska01")
+        assert second is first and second_age >= first_age
+        assert availability_calls(client) == 1
+        # 超过缓存时间后重新查询
+        main.availability_cache[main.availability_cache_key("24ska01")]["fetchedAt"] -= 3.0
+        third, third_age = await main.get_availability("24ska01")
+        assert third is not first and third_age < 3.0
+        assert availability_calls(client) == 2
+
+    asyncio.run(run())
+
+
+def test_options_are_part_of_the_cache_key(ovh_env):
+    client = ovh_env(FakeOVHClient())
+    options = [main.AddonOption(label="memory", value="ram-64g")]
+
+    async def run():
+        await main.get_availability("24ska01")
+        await main.get_availability("24ska01", options)
+        await main.get_availability("24ska01", list(reversed(options)))
+
+    asyncio.run(run())
+    assert availability_calls(client) == 2
+
+
+def test_concurrent_requests_share_one_upstream_call(monkeypatch, ovh_env):
+    client = ovh_env(SlowOVHClient())
+    monkeypatch.setattr(main.settings, "AVAILABILITY_CACHE_TTL", 0)
+    coalesced = main.availability_cache_stats["coalesced"]
+
+    async def run():
+        return await asyncio.gather(*[main.get_availability("24ska01") for _ in range(5)])
+
+    results = asyncio.run(run())
+    # 不缓存时仍合并并发请求
+    assert availability_calls(client) == 1
+    assert all(data is results[0][0] for data, _ in results)
+    assert main.availability_cache_stats["coalesced"] - coalesced == 4
+    assert main.availability_inflight == {}
+
+
+def test_cancelled_caller_does_not_cancel_shared_fetch(ovh_env):
+    client = ovh_env(SlowOVHClient())
+
+    async def run():
+        first = asyncio.create_task(main.get_availability("24ska01"))
+        second = asyncio.create_task(main.get_availability("24ska01"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        data, _ = await second
+        return data
+
+    assert asyncio.run(run())[0]["planCode"] == "24ska01"
+    assert availability_calls(client) == 1
+
+
+def test_endpoint_reports_age_header(monkeypatch, ovh_env):
+    client = ovh_env(FakeOVHClient())
+    main.store_availability(main.availability_cache_key("24ska01"), [{"fqn": "cached", "datacenters": []}])
+    main.availability_cache[main.availability_cache_key("24ska01")]["fetchedAt"] -= 1.5
+    http = TestClient(main.app)
+
+    response = http.post("/api/servers/24ska01/availability", json={"options": []})
+    assert response.json() == [{"fqn": "cached", "datacenters": []}]
+    assert 1.5 <= float(response.headers["x-availability-age"]) < 3.0
+    assert response.headers["age"] == "1"
+    assert availability_calls(client) == 0
+
+    response = http.post("/api/servers/24ska02/availability", json={"options": []})
+    assert float(response.headers["x-availability-age"]) < 1.0
+    assert availability_calls(client) == 1
+
+
+def test_task_engine_uses_the_shared_cache(ovh_env):
+    client = ovh_env(FakeOVHClient())
+    http = TestClient(main.app)
+    assert http.post("/api/servers/24ska01/availability", json={"options": []}).status_code == 200
+
+    config = main.ServerConfig(name="test", planCode="24ska01", datacenter="gra")
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+    asyncio.run(main.order_server(task.id, config))
+
+    assert task.status == "completed"
+    assert availability_calls(client) == 1
@@ -0,0 +1,93 @@
+import asyncio
+
+import main
+
+
+def make_hedger(samples=20, latency=0.01, max_ratio=1.0, min_samples=20):
+    hedger = main.AvailabilityHedger(90, max_ratio, min_samples=min_samples)
+    hedger.latencies.extend([latency] * samples)
+    return hedger
+
+
+def requests_with_latencies(*latencies):
+    """依次返回耗时为 latencies 的请求，记录被取消的请求"""
+    calls, cancelled = [], []
+
+    def request():
+        index = len(calls)
+        calls.append(index)
+
+        async def run():
+            try:
+                await asyncio.sleep(latencies[index])
+            except asyncio.CancelledError:
+                cancelled.append(index)
+                raise
+            return index
+        return run()
+    return request, calls, cancelled
+
+
+def test_slow_request_is_hedged_and_loser_cancelled():
+    hedger = make_hedger()
+    request, calls, cancelled = requests_with_latencies(1.0, 0.01)
+
+    async def call():
+        result = await hedger.call(request)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(call()) == 1
+    assert calls == [0, 1] and cancelled == [0]
+    assert (hedger.stats["hedged"], hedger.stats["hedgeWins"]) == (1, 1)
+
+
+def test_primary_winning_cancels_hedge():
+    hedger = make_hedger()
+    request, calls, cancelled = requests_with_latencies(0.03, 1.0)
+
+    async def call():
+        result = await hedger.call(request)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(call()) == 0
+    assert calls == [0, 1] and cancelled == [1]
+    assert (hedger.stats["hedged"], hedger.stats["hedgeWins"]) == (1, 0)
+
+
+def test_fast_request_is_not_hedged():
+    hedger = make_hedger(latency=0.5)
+    request, calls, cancelled = requests_with_latencies(0.01)
+
+    assert asyncio.run(hedger.call(request)) == 0
+    assert calls == [0] and hedger.stats["hedged"] == 0
+
+
+def test_no_hedge_before_minimum_samples():
+    hedger = make_hedger(samples=19)
+    assert hedger.delay() is None
+    request, calls, cancelled = requests_with_latencies(0.05)
+
+    assert asyncio.run(hedger.call(request)) == 0
+    assert calls == [0] and hedger.stats["hedged"] == 0
+    assert len(hedger.latencies) == 20
+    assert hedger.delay() is not None
+
+
+def test_hedge_ratio_budget_limits_hedges():
+    # 每10个请求最多对冲1个
+    hedger = make_hedger(max_ratio=0.1)
+
+    async def calls():
+        for _ in range(10):
+            # 保持对冲延迟不变
+            hedger.latencies.clear()
+            hedger.latencies.extend([0.01] * 20)
+            request, _, _ = requests_with_latencies(0.03, 0.03)
+            await hedger.call(request)
+
+    asyncio.run(calls())
+    assert hedger.stats["requests"] == 10
+    assert hedger.stats["hedged"] == 1
+    assert hedger.stats["budgetSkipped"] == 9
@@ -0,0 +1,54 @@
+import asyncio
+
+import main
+
+RESPONSE = [{"fqn": "24ska01.ram-64g", "datacenters": [{"datacenter": "gra", "availability": "1H-high"},
+                                                       {"datacenter": "rbx", "availability": "unavailable"}]}]
+
+
+def record_checks(monkeypatch, level, count=3):
+    logs = []
+    monkeypatch.setattr(main, "add_log", lambda level, message, *args, **kwargs: logs.append((level, message)))
+    monkeypatch.setattr(main, "availability_log_level", level)
+    monkeypatch.setattr(main, "restock_history", None)
+    monkeypatch.setattr(main, "availability_trace", None)
+    main.flush_availability_summary()
+    logs.clear()
+    for _ in range(count):
+        main.record_availability_check("24ska01", [], RESPONSE, 12)
+    return logs
+
+
+def test_summary_level_aggregates_checks(monkeypatch):
+    logs = record_checks(monkeypatch, "summary")
+    assert logs == []
+    assert main.availability_summary["checks"] == 3
+
+    main.flush_availability_summary()
+    assert len(logs) == 1
+    assert "3 次检查" in logs[0][1] and "gra" in logs[0][1] and "rbx" not in logs[0][1]
+    assert main.availability_summary["checks"] == 0
+
+
+def test_summary_is_flushed_after_interval(monkeypatch):
+    monkeypatch.setattr(main.settings, "AVAILABILITY_SUMMARY_INTERVAL", 0)
+    logs = record_checks(monkeypatch, "summary", count=2)
+    assert len(logs) == 2 and all("1 次检查" in message for _, message in logs)
+
+
+def test_detail_level_logs_every_check(monkeypatch):
+    logs = record_checks(monkeypatch, "detail", count=2)
+    assert [level for level, _ in logs] == ["info", "debug", "info", "debug"]
+
+
+def test_off_level_only_updates_table(monkeypatch):
+    logs = record_checks(monkeypatch, "off")
+    assert logs == [] and main.availability_summary["checks"] == 0
+    assert main.availability_table["24ska01"]["fqns"]["24ska01.ram-64g"]["gra"] == "1H-high"
+
+
+def test_changing_level_flushes_summary(monkeypatch):
+    logs = record_checks(monkeypatch, "summary", count=2)
+    asyncio.run(main.set_availability_log_level({"level": "detail"}))
+    assert "2 次检查" in logs[0][1]
+    assert main.availability_log_level == "detail"
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import main
+
+
+class TelegramResponse:
+    status_code = 200
+
+    def json(self):
+        return {"ok": True}
+
+
+def test_telegram_request_runs_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(main, "api_config", main.ApiConfig(appKey="a", appSecret="b", consumerKey="c", tgToken="t", tgChatId="1"))
+    threads = []
+
+    def post(url, **kwargs):
+        threads.append(threading.current_thread())
+        return TelegramResponse()
+    monkeypatch.setattr(main.requests, "post", post)
+
+    assert asyncio.run(main.send_telegram_msg("hello")) is True
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_journal_writes_run_in_writer_thread(tmp_path, monkeypatch):
+    journal = main.AttemptJournal(str(tmp_path / "attempts.journal"), max_bytes=0)
+    threads = []
+    write = journal._write
+
+    def recording_write(record, snapshot):
+        threads.append(threading.current_thread().name)
+        write(record, snapshot)
+    monkeypatch.setattr(journal, "_write", recording_write)
+
+    async def attempt():
+        await journal.append("attempt_start", "t1", "a1")
+        await journal.append("cart_created", "t1", "a1", cartId="c1")
+        # 内存中的状态立即更新
+        assert "c1" in journal.attempts["a1"]["carts"]
+        await journal.append("attempt_end", "t1", "a1")
+
+    asyncio.run(attempt())
+    assert len(threads) == 3 and all(name.startswith("attempt-journal") for name in threads)
+    # 尝试结束后超过大小上限，按快照压缩为空日志
+    assert journal.replay() == {}
+    assert (tmp_path / "attempts.journal").read_text() == ""
@@ -0,0 +1,107 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client(monkeypatch, ovh_env):
+    monkeypatch.setattr(main, "inflight_attempts", {})
+    broadcasts, saves = [], []
+
+    async def broadcast_message(message):
+        if message["type"] != "log":
+            broadcasts.append(message)
+    monkeypatch.setattr(main, "broadcast_message", broadcast_message)
+    monkeypatch.setattr(main, "save_tasks_to_file", lambda: saves.append(len(main.tasks)))
+    http = TestClient(main.app, headers={"Accept-Encoding": "identity"})
+    http.broadcasts, http.saves = broadcasts, saves
+    return http
+
+
+def add_task(task_id, status="pending", planCode="24ska01"):
+    main.tasks[task_id] = main.TaskStatus(id=task_id, name=task_id, planCode=planCode, datacenter="gra",
+                                          status=status, createdAt="2026-01-01T00:00:00")
+    return main.tasks[task_id]
+
+
+def config(name, **fields):
+    return {"name": name, "planCode": "24ska01", "datacenter": "gra", **fields}
+
+
+def test_bulk_create_saves_and_broadcasts_once(client):
+    response = client.post("/api/tasks/bulk", json={"tasks": [config("a"), config("b", priority="high")]})
+    assert response.json()["created"] == 2
+    assert {task.name for task in main.tasks.values()} == {"a", "b"}
+    assert all(task.status == "pending" for task in main.tasks.values())
+    assert client.saves == [2]
+    assert [(message["type"], message["data"]["action"], len(message["data"]["tasks"])) for message in client.broadcasts] == [("tasks_bulk_updated", "create", 2)]
+
+    assert client.post("/api/tasks/bulk", json={"tasks": [config("c", priority="urgent")]}).status_code == 422
+    assert len(main.tasks) == 2
+
+
+def test_import_keeps_free_ids_and_paused_status(client):
+    add_task("taken")
+    exported = [{**config("a"), "id": "free", "status": "paused", "retryCount": 7},
+                {**config("b"), "id": "taken", "status": "completed"},
+                {**config("c"), "id": "free", "status": "error"}]
+    response = client.post("/api/tasks/import", json={"tasks": exported})
+    assert response.json()["imported"] == 3
+    ids = response.json()["ids"]
+    assert ids[0] == "free" and ids[1] != "taken" and ids[2] != "free"
+    assert [main.tasks[task_id].status for task_id in ids] == ["paused", "pending", "pending"]
+    assert main.tasks["free"].retryCount == 0
+    assert client.saves == [4]
+
+
+def test_import_is_all_or_nothing(client):
+    response = client.post("/api/tasks/import", json={"tasks": [config("a"), {"name": "missing plan"}]})
+    assert response.status_code == 400 and "第 2 个任务无效" in response.json()["detail"]
+    assert main.tasks == {} and client.saves == []
+
+
+def test_pause_and_resume_only_touch_schedulable_tasks(client, monkeypatch):
+    for task_id, status in (("pending", "pending"), ("error", "error"), ("running", "running"), ("review", "needs_review"),
+                            ("completed", "completed"), ("inflight", "pending")):
+        add_task(task_id, status)
+    main.inflight_attempts["inflight"] = {"taskId": "inflight", "attemptId": "a1"}
+
+    response = client.post("/api/tasks/bulk/pause", json={"all": True})
+    assert sorted(response.json()["ids"]) == ["error", "pending"]
+    assert {task_id: task.status for task_id, task in main.tasks.items()} == {
+        "pending": "paused", "error": "paused", "running": "running", "review": "needs_review",
+        "completed": "completed", "inflight": "pending"}
+
+    response = client.post("/api/tasks/bulk/resume", json={"all": True})
+    assert sorted(response.json()["ids"]) == ["error", "pending"]
+    assert main.tasks["pending"].status == main.tasks["error"].status == "pending"
+    assert main.tasks["review"].status == "needs_review"
+    assert [message["data"]["action"] for message in client.broadcasts] == ["pause", "resume"]
+
+
+def test_retry_resets_retryable_tasks_without_inflight_attempts(client):
+    for task_id, status in (("error", "error"), ("max", "max_retries_reached"), ("review", "needs_review"),
+                            ("pending", "pending"), ("busy", "error")):
+        add_task(task_id, status).retryCount = 5
+    main.inflight_attempts["busy"] = {"taskId": "busy", "attemptId": "a1"}
+
+    response = client.post("/api/tasks/bulk/retry", json={"status": ["error", "max_retries_reached", "needs_review", "pending"]})
+    assert sorted(response.json()["ids"]) == ["error", "max", "review"]
+    assert all(main.tasks[task_id].status == "pending" and main.tasks[task_id].retryCount == 0 for task_id in ("error", "max", "review"))
+    assert main.tasks["busy"].retryCount == 5 and main.tasks["pending"].retryCount == 5
+
+
+def test_bulk_delete_by_filter(client):
+    add_task("a", planCode="24ska01")
+    add_task("b", planCode="24ska02")
+    add_task("c", planCode="24ska01")
+
+    response = client.post("/api/tasks/bulk/delete", json={"planCode": "24ska01"})
+    assert sorted(response.json()["ids"]) == ["a", "c"]
+    assert set(main.tasks) == {"b"}
+    assert client.broadcasts[-1]["data"] == {"action": "delete", "tasks": [], "deleted": response.json()["ids"]}
+    assert client.saves == [1]
+
+    assert client.post("/api/tasks/bulk/delete", json={}).status_code == 400
+    assert set(main.tasks) == {"b"}
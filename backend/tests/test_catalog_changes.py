@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def plan(plan_code, invoice_name, price=10.0, addons=("ram-32g",)):
+    return {"planCode": plan_code, "invoiceName": invoice_name, "product": plan_code,
+            "pricings": [{"price": price, "capacities": ["renew"]}, {"price": 99, "capacities": ["installation"]}],
+            "addonFamilies": [{"name": "memory", "mandatory": True, "default": addons[0], "addons": list(addons)}]}
+
+
+def build_index(*plans):
+    return main.build_catalog_index(main.json_dumps({"plans": list(plans)}).encode())
+
+
+@pytest.fixture
+def catalog(monkeypatch, ovh_env):
+    monkeypatch.setattr(main, "catalog_fingerprints", {})
+    monkeypatch.setattr(main, "catalog_events", main.deque(maxlen=500))
+    monkeypatch.setattr(main, "catalog_rules", [])
+    monkeypatch.setattr(main, "cluster", None)
+    broadcasts = []
+
+    async def broadcast_message(message):
+        if message["type"] != "log":
+            broadcasts.append(message)
+    monkeypatch.setattr(main, "broadcast_message", broadcast_message)
+    return broadcasts
+
+
+def detect(index):
+    asyncio.run(main.detect_catalog_changes("IE", index))
+
+
+def test_fingerprint_ignores_installation_price_and_changes_with_addons():
+    first = build_index(plan("24ska01", "KS-A"))["24ska01"]
+    assert first["price"] == 10.0
+    assert build_index(plan("24ska01", "KS-A"))["24ska01"]["fingerprint"] == first["fingerprint"]
+    assert build_index(plan("24ska01", "KS-A", addons=("ram-32g", "ram-64g")))["24ska01"]["fingerprint"] != first["fingerprint"]
+
+
+def test_diff_reports_each_kind_of_change():
+    previous = {code: main.catalog_plan_summary(entry) for code, entry in build_index(
+        plan("24ska01", "KS-A"), plan("24ska02", "KS-B"), plan("24ska03", "KS-C")).items()}
+    index = build_index(plan("24ska01", "KS-A", price=12.0, addons=("ram-64g",)), plan("24ska02", "KS-B"), plan("25sk10", "KS-10"))
+
+    events = {(event["type"], event["planCode"]) for event in main.diff_catalog(previous, index)}
+    assert events == {("addons_added", "24ska01"), ("addons_removed", "24ska01"), ("price_changed", "24ska01"),
+                      ("plan_added", "25sk10"), ("plan_removed", "24ska03")}
+
+
+def test_first_fetch_only_records_baseline(catalog):
+    detect(build_index(plan("24ska01", "KS-A")))
+    assert set(main.catalog_fingerprints["IE"]) == {"24ska01"}
+    assert not main.catalog_events and not catalog
+
+    # 内容未变化时不产生事件
+    detect(build_index(plan("24ska01", "KS-A")))
+    assert not main.catalog_events and not catalog
+
+
+def test_rules_create_tasks_for_matching_new_plans(catalog):
+    main.catalog_rules.extend([
+        main.CatalogRule(name="disabled", planCodePrefix="25sk", enabled=False),
+        main.CatalogRule(name="prefix", planCodePrefix="25sk", datacenter="gra", priority="high"),
+        main.CatalogRule(name="name", nameContains="ks-le"),
+    ])
+    detect(build_index(plan("24ska01", "KS-A")))
+    detect(build_index(plan("24ska01", "KS-A"), plan("25sk10", "KS-10"), plan("26rise01", "Rise KS-LE"), plan("26adv01", "Advance-1")))
+
+    created = {task.planCode: task for task in main.tasks.values()}
+    assert set(created) == {"25sk10", "26rise01"}
+    assert created["25sk10"].name == "prefix: KS-10"
+    assert (created["25sk10"].datacenter, created["25sk10"].priority) == ("gra", "high")
+    assert created["26rise01"].name == "name: Rise KS-LE"
+    types = [message["type"] for message in catalog]
+    assert types == ["catalog_changed", "tasks_bulk_updated"]
+    assert {event["planCode"] for event in catalog[0]["data"]["events"]} == {"25sk10", "26rise01", "26adv01"}
+
+
+def test_rule_matching():
+    event = {"planCode": "25sk10", "invoiceName": "KS-10 | Intel"}
+    assert main.catalog_rule_matches(main.CatalogRule(name="r", planCodePrefix="25sk"), event)
+    assert main.catalog_rule_matches(main.CatalogRule(name="r", nameContains="ks-10"), event)
+    assert main.catalog_rule_matches(main.CatalogRule(name="r", planCodePrefix="25sk", nameContains="intel"), event)
+    assert not main.catalog_rule_matches(main.CatalogRule(name="r", planCodePrefix="25sk", nameContains="amd"), event)
+    assert not main.catalog_rule_matches(main.CatalogRule(name="r", nameContains="ks"), {"planCode": "x", "invoiceName": None})
+    # 没有任何条件的规则不匹配所有型号
+    assert not main.catalog_rule_matches(main.CatalogRule(name="r"), event)
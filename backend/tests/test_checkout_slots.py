@@ -0,0 +1,92 @@
+import asyncio
+
+import main
+from fake_ovh import FakeOVHClient
+
+
+def test_waiters_get_slots_by_priority_then_arrival():
+    slots = main.CheckoutSlots(1)
+    order = []
+
+    async def wait(task_id, priority):
+        assert await slots.acquire(task_id, priority)
+        order.append(task_id)
+
+    async def run():
+        assert await slots.acquire("holder", "normal")
+        waiters = [asyncio.create_task(wait(task_id, priority))
+                   for task_id, priority in (("low", "low"), ("normal-1", "normal"), ("high", "high"), ("normal-2", "normal"))]
+        await asyncio.sleep(0)
+        assert [entry["taskId"] for entry in slots.snapshot()["waiting"]] == ["high", "normal-1", "normal-2", "low"]
+        for _ in waiters:
+            slots.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+        slots.release()
+
+    asyncio.run(run())
+    assert order == ["high", "normal-1", "normal-2", "low"]
+    assert slots.active == 0
+
+
+def test_high_priority_waits_past_slot_timeout(monkeypatch):
+    monkeypatch.setattr(main, "checkout_slots", main.CheckoutSlots(1))
+    monkeypatch.setattr(main.settings, "CHECKOUT_SLOT_WAIT_SECONDS", 0.01)
+    high = main.ServerConfig(name="high", planCode="24ska01", datacenter="gra", priority="high")
+    normal = main.ServerConfig(name="normal", planCode="24ska01", datacenter="gra")
+    low = main.ServerConfig(name="low", planCode="24ska01", datacenter="gra", priority="low")
+
+    async def run():
+        assert await main.checkout_slots.acquire("holder", "normal")
+        waiting_high = asyncio.create_task(main.acquire_checkout_slot("high", high))
+        # 非高优先级任务等待超时后放弃本轮
+        assert await main.acquire_checkout_slot("normal", normal) is False
+        assert await main.acquire_checkout_slot("low", low) is False
+        assert not waiting_high.done()
+        main.checkout_slots.release()
+        assert await waiting_high is True
+
+    asyncio.run(run())
+    assert main.checkout_slots.active == 1 and main.checkout_slots.pending() == 0
+
+
+def test_order_is_skipped_when_slot_wait_times_out(monkeypatch, ovh_env):
+    client = ovh_env(FakeOVHClient())
+    monkeypatch.setattr(main, "checkout_slots", main.CheckoutSlots(1))
+    monkeypatch.setattr(main.settings, "CHECKOUT_SLOT_WAIT_SECONDS", 0.01)
+    config = main.ServerConfig(name="test", planCode="24ska01", datacenter="gra")
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+
+    async def run():
+        assert await main.checkout_slots.acquire("holder", "high")
+        await main.order_server(task.id, config)
+
+    asyncio.run(run())
+    assert task.status == "pending" and "本轮跳过" in task.message
+    assert not client.paths("POST")
+
+
+def test_fleet_uses_one_slot_per_checkout(monkeypatch, ovh_env):
+    ovh_env(FakeOVHClient(datacenters=("gra", "rbx", "sbg")))
+    slots = main.CheckoutSlots(2)
+    monkeypatch.setattr(main, "checkout_slots", slots)
+    acquired, peak = [], []
+    acquire = slots.acquire
+
+    async def recording_acquire(task_id, priority, timeout=None):
+        result = await acquire(task_id, priority, timeout)
+        acquired.append(task_id)
+        peak.append(slots.active)
+        return result
+    monkeypatch.setattr(slots, "acquire", recording_acquire)
+    config = main.ServerConfig(name="fleet", planCode="24ska01", datacenter="any", quantity=3, fleet=True, maxConcurrent=3, priority="high")
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+
+    asyncio.run(main.order_fleet(task.id, task.server_config()))
+    # 三个结账各占一个槽位，同时最多占用槽位上限个，结束后全部释放
+    assert acquired == [task.id] * 3
+    assert max(peak) == 2
+    assert slots.active == 0
+    assert task.fulfilledCount == 3 and task.status == "completed"
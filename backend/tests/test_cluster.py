@@ -0,0 +1,81 @@
+import asyncio
+
+import main
+
+
+def make_task(task_id="t1", status="pending"):
+    return main.TaskStatus(id=task_id, name="test", planCode="24ska01", datacenter="gra", status=status, createdAt="2026-01-01T00:00:00")
+
+
+def test_remote_task_update_keeps_task_object(monkeypatch):
+    task = make_task()
+    task.options = [main.AddonOption(label="memory", value="ram-64g")]
+    monkeypatch.setattr(main, "tasks", {task.id: task})
+    version = task._version
+
+    assert main.apply_task_data({**task.to_dict(), "status": "running", "message": "其他进程"})
+    assert main.tasks["t1"] is task
+    assert (task.status, task.message) == ("running", "其他进程")
+    assert task._version > version
+
+
+def test_unchanged_remote_messages_do_not_bump_versions(monkeypatch):
+    task = make_task()
+    task.options = [main.AddonOption(label="memory", value="ram-64g")]
+    order = main.OrderHistory(id="o1", planCode="24ska01", name="n", datacenter="gra", orderTime="2026-01-01T00:00:00", status="success")
+    monkeypatch.setattr(main, "tasks", {task.id: task})
+    monkeypatch.setattr(main, "orders", [order])
+    saved = []
+    monkeypatch.setattr(main, "save_tasks_to_file", lambda: saved.append("tasks"))
+    monkeypatch.setattr(main, "save_orders_to_file", lambda: saved.append("orders"))
+    versions = dict(main.latest_record_versions)
+
+    async def receive():
+        # 消息经过JSON往返，选项为字典
+        main.handle_cluster_messages([
+            {"type": "task_updated", "data": main.json_loads(task.to_json())},
+            {"type": "tasks_bulk_updated", "data": {"action": "pause", "tasks": [main.json_loads(task.to_json())], "deleted": []}},
+            {"type": "order_completed", "data": order.to_dict()},
+            {"type": "orders_updated", "data": {"orders": [order.to_dict()]}},
+        ])
+    asyncio.run(receive())
+
+    assert main.latest_record_versions == versions
+    assert saved == []
+
+
+def test_only_lease_holder_writes_state_files(tmp_path, monkeypatch):
+    db = str(tmp_path / "cluster.db")
+    first, second = main.ClusterCoordinator(db, 15), main.ClusterCoordinator(db, 15)
+    monkeypatch.setattr(main, "tasks", {"t1": make_task()})
+    monkeypatch.setattr(main, "TASKS_FILE", str(tmp_path / "tasks.json"))
+    monkeypatch.setattr(main, "save_state_files", lambda: None)
+    monkeypatch.setitem(main.startup_state, "ready", True)
+
+    def run_heartbeat(coordinator):
+        conn = coordinator.connect()
+        conn.executescript(main.COORDINATION_SCHEMA)
+        try:
+            coordinator._heartbeat(conn)
+        finally:
+            conn.close()
+
+    async def heartbeat(coordinator):
+        # 与协调线程一样在事件循环之外执行，任务快照由事件循环提供
+        coordinator.loop = asyncio.get_running_loop()
+        await asyncio.to_thread(run_heartbeat, coordinator)
+
+    asyncio.run(heartbeat(first))
+    asyncio.run(heartbeat(second))
+    assert first.holds_state_files and not second.holds_state_files
+    assert main.STATE_FILES_LEASE not in first.owned
+
+    async def save_as(coordinator):
+        monkeypatch.setattr(main, "cluster", coordinator)
+        main.save_tasks_to_file()
+
+    asyncio.run(save_as(second))
+    assert not (tmp_path / "tasks.json").exists()
+    asyncio.run(save_as(first))
+    assert (tmp_path / "tasks.json").exists()
+    assert not [path for path in tmp_path.iterdir() if path.suffix == ".tmp"]
@@ -0,0 +1,134 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def make_task(index):
+    return main.TaskStatus(id=f"t{index}", name=f"task {index}", planCode="24ska01", datacenter="gra",
+                           status="pending", createdAt="2026-01-01T00:00:00")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "tasks", {})
+    monkeypatch.setitem(main.startup_state, "ready", True)
+    return TestClient(main.app)
+
+
+def fill_tasks(count):
+    for index in range(count):
+        main.tasks[f"t{index}"] = make_task(index)
+
+
+def test_small_responses_are_not_compressed(client):
+    fill_tasks(1)
+    response = client.get("/api/tasks", headers={"Accept-Encoding": "gzip"})
+    assert len(response.content) < main.settings.COMPRESSION_MIN_SIZE
+    assert "content-encoding" not in response.headers
+    assert not response.headers["etag"].startswith("W/")
+
+
+def test_large_responses_are_gzipped_with_weak_etag(client):
+    fill_tasks(50)
+    response = client.get("/api/tasks", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.headers["etag"].startswith("W/")
+    assert len(response.json()) == 50
+
+
+def test_not_modified_keeps_etag_form_of_compressed_response(client):
+    fill_tasks(50)
+    compressed = client.get("/api/tasks", headers={"Accept-Encoding": "gzip"})
+    weak = compressed.headers["etag"]
+    response = client.get("/api/tasks", headers={"Accept-Encoding": "gzip", "If-None-Match": weak})
+    assert response.status_code == 304
+    assert response.headers["etag"] == weak
+
+    plain = client.get("/api/tasks", headers={"Accept-Encoding": "identity"})
+    strong = plain.headers["etag"]
+    assert weak == "W/" + strong
+    response = client.get("/api/tasks", headers={"Accept-Encoding": "identity", "If-None-Match": strong})
+    assert response.status_code == 304
+    assert response.headers["etag"] == strong
+
+
+def test_encoding_negotiation():
+    assert main.choose_encoding("gzip, deflate") == "gzip"
+    assert main.choose_encoding("gzip;q=0, deflate") is None
+    assert main.choose_encoding("identity") is None
+    expected = "br" if main.brotli else "gzip"
+    assert main.choose_encoding("gzip, br") == expected
+
+
+def test_brotli_is_preferred_when_installed(monkeypatch):
+    if main.brotli is None:
+        pytest.skip("brotli 未安装")
+    assert main.choose_encoding("gzip, br;q=0.5") == "br"
+    monkeypatch.setattr(main, "brotli", None)
+    assert main.choose_encoding("gzip, br") == "gzip"
+
+
+def run_middleware(chunks, accept_encoding="gzip", minimum_size=100):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(main.CompressionMiddleware(app, minimum_size)(scope, None, send))
+    return sent
+
+
+def test_streamed_chunks_are_compressed_incrementally():
+    chunks = [(b'{"n":%d,"pad":"%s"}' % (index, b"x" * 2000)) for index in range(3)]
+    sent = run_middleware(chunks)
+    start, bodies = sent[0], sent[1:]
+    assert (b"content-encoding", b"gzip") in start["headers"]
+    # 每块单独发送，不在内存中拼接完整响应体
+    assert len(bodies) >= 2 and not bodies[-1]["more_body"]
+    assert all(body["more_body"] for body in bodies[:-1])
+    assert gzip.decompress(b"".join(body["body"] for body in bodies)) == b"".join(chunks)
+
+
+def test_single_small_body_below_threshold_is_sent_as_is():
+    sent = run_middleware([b'{"ok":true}'])
+    assert all(name != b"content-encoding" for name, _ in sent[0]["headers"])
+    assert sent[1]["body"] == b'{"ok":true}'
+
+
+def test_catalog_is_recompressed_only_when_content_changes(monkeypatch, ovh_env):
+    monkeypatch.setattr(main, "catalog_cache", {})
+    monkeypatch.setattr(main, "catalog_fetch_locks", {})
+    monkeypatch.setattr(main, "catalog_fingerprints", {})
+    downloads = [b'{"plans":[{"planCode":"24ska01"}]}'] * 2 + [b'{"plans":[{"planCode":"24ska02"}]}']
+    monkeypatch.setattr(main, "download_catalog", lambda subsidiary: downloads.pop(0))
+    compressions = []
+
+    def compress_catalog(raw):
+        compressions.append(raw)
+        return {"gzip": gzip.compress(raw)}
+    monkeypatch.setattr(main, "compress_catalog", compress_catalog)
+    # 在线程池中执行，才能统计压缩次数
+    monkeypatch.setattr(main, "get_process_pool", lambda: None)
+
+    async def fetch_three_times():
+        for _ in range(3):
+            await main.fetch_product_catalog("IE", force=True)
+
+    asyncio.run(fetch_three_times())
+    assert compressions == [b'{"plans":[{"planCode":"24ska01"}]}', b'{"plans":[{"planCode":"24ska02"}]}']
+    entry = main.catalog_cache["IE"]
+    assert entry["sha1"] == main.hashlib.sha1(b'{"plans":[{"planCode":"24ska02"}]}').hexdigest()
+    assert zlib.decompress(entry["compressed"]["gzip"], 31) == entry["raw"]
+    assert set(entry["index"]) == {"24ska02"}
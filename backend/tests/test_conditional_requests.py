@@ -0,0 +1,101 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def make_task(index):
+    return main.TaskStatus(id=f"t{index}", name=f"task {index}", planCode="24ska01", datacenter="gra",
+                           status="pending", createdAt="2026-01-01T00:00:00")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "tasks", {task.id: task for task in map(make_task, range(3))})
+    return TestClient(main.app)
+
+
+def test_unchanged_collection_returns_304(client):
+    first = client.get("/api/tasks", headers=IDENTITY)
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and len(first.json()) == 3
+    assert first.headers["cache-control"] == "no-cache"
+
+    again = client.get("/api/tasks", headers={**IDENTITY, "If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == etag
+    # 弱校验形式的 ETag 同样命中
+    assert client.get("/api/tasks", headers={**IDENTITY, "If-None-Match": "W/" + etag}).status_code == 304
+
+
+def test_modified_or_removed_record_changes_etag(client):
+    etag = client.get("/api/tasks", headers=IDENTITY).headers["etag"]
+    main.tasks["t1"].status = "paused"
+    changed = client.get("/api/tasks", headers={**IDENTITY, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+    etag = changed.headers["etag"]
+    del main.tasks["t2"]
+    assert client.get("/api/tasks", headers={**IDENTITY, "If-None-Match": etag}).status_code == 200
+
+
+def test_since_returns_only_changed_records(client):
+    version = client.get("/api/tasks", headers=IDENTITY).headers["x-state-version"]
+    main.tasks["t1"].message = "changed"
+    del main.tasks["t2"]
+
+    delta = client.get("/api/tasks", params={"since": version}, headers=IDENTITY).json()
+    assert delta["full"] is False
+    assert [task["id"] for task in delta["changed"]] == ["t1"]
+    assert delta["ids"] == ["t0", "t1"]
+
+    # 以新版本再次请求时没有变化
+    unchanged = client.get("/api/tasks", params={"since": delta["version"]}, headers=IDENTITY).json()
+    assert unchanged["changed"] == [] and unchanged["full"] is False
+
+
+@pytest.mark.parametrize("since", ["otherboot.5", "garbage", f"{main.STATE_BOOT_ID}.x"])
+def test_unusable_since_falls_back_to_full(client, since):
+    delta = client.get("/api/tasks", params={"since": since}, headers=IDENTITY).json()
+    assert delta["full"] is True
+    assert [task["id"] for task in delta["changed"]] == ["t0", "t1", "t2"]
+
+
+def test_large_collections_stream_valid_json(monkeypatch, client):
+    monkeypatch.setattr(main, "tasks", {task.id: task for task in map(make_task, range(main.STREAM_BATCH_SIZE * 2 + 1))})
+    response = client.get("/api/tasks")
+    assert [task["id"] for task in response.json()] == list(main.tasks)
+
+
+def test_ndjson_export(client):
+    response = client.get("/api/tasks", params={"format": "ndjson"}, headers=IDENTITY)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["t0", "t1", "t2"]
+    # NDJSON 与 JSON 的 ETag 不同，互不命中
+    etag = client.get("/api/tasks", headers=IDENTITY).headers["etag"]
+    assert response.headers["etag"] != etag
+    assert client.get("/api/tasks", params={"format": "ndjson"}, headers={**IDENTITY, "If-None-Match": etag}).status_code == 200
+
+
+def test_logs_since_returns_new_entries(monkeypatch, client):
+    monkeypatch.setattr(main, "logs", [])
+    monkeypatch.setattr(main, "logs_appended", 0)
+    main.append_log_entry({"timestamp": "t", "level": "info", "message": "first"})
+    version = client.get("/api/logs", headers=IDENTITY).headers["x-state-version"]
+    main.append_log_entry({"timestamp": "t", "level": "info", "message": "second"})
+
+    delta = client.get("/api/logs", params={"since": version}, headers=IDENTITY).json()
+    assert delta["full"] is False
+    assert [entry["message"] for entry in delta["entries"]] == ["second"]
+
+
+def test_unchanged_cluster_message_keeps_etag(monkeypatch, client):
+    monkeypatch.setattr(main, "save_tasks_to_file", lambda: None)
+    etag = client.get("/api/tasks", headers=IDENTITY).headers["etag"]
+    # 其他进程广播的内容与本地相同，不应使 ETag 失效
+    main.apply_task_data(main.json_loads(main.tasks["t0"].to_json()))
+    assert client.get("/api/tasks", headers={**IDENTITY, "If-None-Match": etag}).status_code == 304
@@ -0,0 +1,80 @@
+import asyncio
+
+import main
+from fake_ovh import FakeOVHClient
+
+
+def add_task(**fields):
+    config = main.ServerConfig(name="test", planCode="24ska01", datacenter="any", **fields)
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+    return task
+
+
+def run_attempt(task):
+    config = task.server_config()
+    coro = main.order_fleet(task.id, config) if config.is_fleet else main.order_server(task.id, config)
+    asyncio.run(coro)
+
+
+def carts_created(client):
+    return [path for path in client.paths("POST") if path == "/order/cart"]
+
+
+def test_quantity_without_fleet_orders_all_units_in_one_cart(ovh_env):
+    client = ovh_env(FakeOVHClient())
+    task = add_task(quantity=3)
+    assert not task.is_fleet
+
+    run_attempt(task)
+
+    assert len(carts_created(client)) == 1
+    item = next(kwargs for method, path, kwargs in client.calls if method == "POST" and path.endswith("/eco"))
+    assert item["quantity"] == 3
+    assert task.status == "completed" and task.fulfilledCount == 0
+
+
+def test_fleet_reaches_target_over_rounds_within_concurrency(ovh_env):
+    client = ovh_env(FakeOVHClient(datacenters=("gra", "rbx")))
+    task = add_task(quantity=3, fleet=True, maxConcurrent=2)
+
+    run_attempt(task)
+    # 第一轮按并发上限结账2台，分布在两个有货的数据中心
+    assert len(carts_created(client)) == 2
+    assert task.fulfilledCount == 2 and task.status == "pending"
+    assert sorted(order.datacenter for order in main.orders) == ["gra", "rbx"]
+
+    run_attempt(task)
+    assert len(carts_created(client)) == 3
+    assert task.fulfilledCount == 3 and len(task.orderIds) == 3
+    assert task.status == "completed"
+    assert task.spentAmount == 30.0
+    # 每次结账只下单1台
+    assert all(kwargs["quantity"] == 1 for method, path, kwargs in client.calls if method == "POST" and path.endswith("/eco"))
+
+    # 已完成的批量任务不再建购物车
+    run_attempt(task)
+    assert len(carts_created(client)) == 3
+
+
+def test_fleet_spend_cap_aborts_checkouts_that_would_exceed_it(ovh_env):
+    client = ovh_env(FakeOVHClient(price=10.0))
+    task = add_task(quantity=5, fleet=True, maxConcurrent=3, maxSpend=25.0)
+
+    run_attempt(task)
+
+    # 三个并发结账中只有两个能在花费上限内提交，第三个购物车被删除
+    assert len(carts_created(client)) == 3
+    assert len([path for path in client.paths("POST") if path.endswith("/checkout")]) == 2
+    assert len(client.paths("DELETE")) == 1
+    assert (task.fulfilledCount, task.spentAmount, task.status) == (2, 20.0, "budget_reached")
+
+
+def test_fleet_without_price_does_not_checkout_under_spend_cap(ovh_env):
+    client = ovh_env(FakeOVHClient(price=None))
+    task = add_task(quantity=2, fleet=True, maxSpend=100.0)
+
+    run_attempt(task)
+
+    assert not [path for path in client.paths("POST") if path.endswith("/checkout")]
+    assert task.fulfilledCount == 0 and task.status == "budget_reached"
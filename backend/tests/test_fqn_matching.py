@@ -0,0 +1,74 @@
+import asyncio
+
+import main
+
+AVAILABILITIES = [{
+    "fqn": "24ska01.ram-32g-ecc-2400.softraid-2x480ssd",
+    "planCode": "24ska01",
+    "memory": "ram-32g-ecc-2400",
+    "storage": "softraid-2x480ssd",
+    "datacenters": [{"datacenter": "gra", "availability": "1H-high"}],
+}]
+
+
+def make_config(*options):
+    return main.ServerConfig(name="test", planCode="24ska01", datacenter="gra",
+                             options=[main.AddonOption(label=label, value=value) for label, value in options])
+
+
+def test_matching_fqn_is_selected():
+    selected, fqn_matched = main.select_option_availabilities(AVAILABILITIES, make_config(("memory", "ram-32g")))
+    assert fqn_matched
+    assert selected == AVAILABILITIES
+
+
+def test_mismatched_options_select_nothing():
+    selected, fqn_matched = main.select_option_availabilities(AVAILABILITIES, make_config(("memory", "ram-64g-ecc-2133-24ska01")))
+    assert fqn_matched
+    assert selected == []
+
+
+def test_options_outside_fqn_fall_back_to_plan_code():
+    selected, fqn_matched = main.select_option_availabilities(AVAILABILITIES, make_config(("bandwidth", "bandwidth-300-24ska01")))
+    assert not fqn_matched
+    assert selected == AVAILABILITIES
+
+
+class AvailabilityOnlyClient:
+    """只应答可用性查询，建购物车等其他调用都会被记录"""
+    def __init__(self):
+        self.other_calls = []
+
+    def get(self, path, **kwargs):
+        if path == "/dedicated/server/datacenter/availabilities":
+            return AVAILABILITIES
+        self.other_calls.append(("GET", path))
+        return {}
+
+    def post(self, path, **kwargs):
+        self.other_calls.append(("POST", path))
+        return {}
+
+    def delete(self, path, **kwargs):
+        self.other_calls.append(("DELETE", path))
+
+
+def test_order_server_skips_cart_when_options_do_not_match(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    client = AvailabilityOnlyClient()
+    monkeypatch.setattr(main, "get_ovh_client", lambda task_id=None: client)
+    monkeypatch.setattr(main, "api_config", main.ApiConfig(appKey="a", appSecret="b", consumerKey="c"))
+    monkeypatch.setattr(main, "tasks", {})
+    main.availability_cache.clear()
+    config = make_config(("memory", "ram-64g"))
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+
+    async def attempt():
+        await main.order_server(task.id, config)
+        await asyncio.sleep(0)
+
+    asyncio.run(attempt())
+    assert client.other_calls == []
+    assert task.status == "pending"
+    assert "无货" in task.message
@@ -0,0 +1,73 @@
+import asyncio
+
+import main
+
+
+def add_task(monkeypatch, ovh_env):
+    monkeypatch.setattr(main, "inflight_attempts", {})
+    config = main.ServerConfig(name="test", planCode="24ska01", datacenter="gra")
+    task = main.build_task(config)
+    main.tasks[task.id] = task
+    return task
+
+
+def slow_order(monkeypatch, started, seconds=10):
+    async def order_server(task_id, config):
+        started.append(task_id)
+        main.update_task_status(task_id, "running", "正在下单")
+        await asyncio.sleep(seconds)
+    monkeypatch.setattr(main, "order_server", order_server)
+
+
+def test_only_one_attempt_per_task_is_inflight(monkeypatch, ovh_env):
+    task = add_task(monkeypatch, ovh_env)
+    started = []
+    slow_order(monkeypatch, started, seconds=0.05)
+
+    async def launch_twice():
+        first = main.launch_attempt(task.id, task.server_config())
+        second = main.launch_attempt(task.id, task.server_config())
+        runner = main.inflight_attempts[task.id]["runner"]
+        await runner
+        return first, second
+
+    first, second = asyncio.run(launch_twice())
+    assert first and second is None
+    assert started == [task.id]
+    assert main.inflight_attempts == {}
+
+
+def test_attempt_is_aborted_after_timeout(monkeypatch, ovh_env):
+    task = add_task(monkeypatch, ovh_env)
+    slow_order(monkeypatch, [])
+    monkeypatch.setattr(main.settings, "ATTEMPT_TIMEOUT", 0.05)
+
+    async def launch():
+        main.launch_attempt(task.id, task.server_config())
+        await main.inflight_attempts[task.id]["runner"]
+
+    asyncio.run(launch())
+    assert task.status == "error" and "已中止" in task.message
+    assert main.inflight_attempts == {}
+
+
+def test_cancelled_attempt_leaves_task_retryable(monkeypatch, ovh_env):
+    task = add_task(monkeypatch, ovh_env)
+    slow_order(monkeypatch, [])
+
+    async def launch_and_cancel():
+        attempt_id = main.launch_attempt(task.id, task.server_config())
+        runner = main.inflight_attempts[task.id]["runner"]
+        await asyncio.sleep(0.01)
+        result = await main.cancel_task_attempt(task.id)
+        await asyncio.wait([runner])
+        return attempt_id, result
+
+    attempt_id, result = asyncio.run(launch_and_cancel())
+    assert result["attempt"]["attemptId"] == attempt_id
+    assert task.status == "cancelled"
+    assert main.inflight_attempts == {}
+    assert task.status in main.RETRYABLE_TASK_STATUSES
+
+    asyncio.run(main.retry_task(task.id))
+    assert task.status == "pending" and task.retryCount == 0
@@ -0,0 +1,42 @@
+import asyncio
+import socket
+import sys
+import threading
+import time
+
+import main
+
+
+def test_audit_hook_records_blocking_socket_call():
+    sys.addaudithook(main.blocking_call_audit_hook)
+    main.blocking_calls.clear()
+
+    async def send_udp():
+        main.loop_watchdog.loop_thread_id = threading.get_ident()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(b"ping", ("127.0.0.1", 9))
+        finally:
+            sock.close()
+
+    asyncio.run(send_udp())
+    events = {entry["event"] for entry in main.blocking_calls.values()}
+    assert "socket.sendto" in events
+
+
+def test_watchdog_captures_stack_of_blocking_call():
+    watchdog = main.EventLoopWatchdog(0.05)
+
+    async def block_loop():
+        watchdog.start(asyncio.get_running_loop())
+        runner = asyncio.create_task(watchdog.run())
+        await asyncio.sleep(0.1)
+        time.sleep(0.5)  # 同步调用阻塞事件循环
+        await asyncio.sleep(0.2)
+        runner.cancel()
+
+    asyncio.run(block_loop())
+    assert watchdog.stalls
+    stall = watchdog.stalls[0]
+    assert stall["lagMs"] >= 300
+    assert "block_loop" in stall["location"]
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+class StatusClient:
+    """按路径应答订单状态和付款查询，并记录调用时间"""
+    def __init__(self, statuses, payment_date="2026-10-18T10:00:00+02:00"):
+        self.statuses = statuses
+        self.payment_date = payment_date
+        self.calls = []
+
+    def get(self, path, **kwargs):
+        self.calls.append((time.monotonic(), path))
+        order_id = path.split("/")[3]
+        if path.endswith("/payment"):
+            return {"paymentDate": self.payment_date}
+        status = self.statuses[order_id]
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+
+def make_order(order_id, age_seconds=0, **fields):
+    order_time = datetime.fromtimestamp(time.time() - age_seconds).isoformat()
+    return main.OrderHistory(id=f"o{order_id}", planCode="24ska01", name="n", datacenter="gra",
+                             orderTime=order_time, status="success", orderId=str(order_id), **fields)
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "orders", [])
+    monkeypatch.setattr(main, "api_config", None)
+    monkeypatch.setattr(main, "cluster", None)
+    monkeypatch.setitem(main.startup_state, "ready", True)
+    return tmp_path
+
+
+def run_tracker(tracker, client, monkeypatch):
+    monkeypatch.setattr(main, "get_ovh_client", lambda task_id=None: client)
+    return asyncio.run(tracker.run_once())
+
+
+def test_poll_interval_backs_off_with_order_age():
+    tracker = main.OrderStatusTracker(60, 20, 30)
+    intervals = [tracker.poll_interval(make_order(1, age)) for age in (60, 2 * 3600, 2 * 86400, 10 * 86400)]
+    assert intervals == [60, 600, 3600, 6 * 3600]
+
+
+def test_tracked_orders_exclude_final_failed_and_expired(state):
+    tracker = main.OrderStatusTracker(60, 20, 30)
+    assert tracker.tracked(make_order(1))
+    assert not tracker.tracked(make_order(2, orderStatus="delivered"))
+    assert not tracker.tracked(make_order(3, age_seconds=31 * 86400))
+    failed = make_order(4)
+    failed.status = "failed"
+    assert not tracker.tracked(failed)
+
+
+def test_status_change_records_payment_and_delivery(state, monkeypatch):
+    paid, delivered, unchanged = make_order(1), make_order(2, paidAt="2026-10-17T00:00:00"), make_order(3, orderStatus="notPaid")
+    main.orders.extend([paid, delivered, unchanged])
+    version = unchanged._version
+    tracker = main.OrderStatusTracker(60, 6000, 30)
+    client = StatusClient({"1": "checking", "2": "delivered", "3": "notPaid"})
+
+    changed = run_tracker(tracker, client, monkeypatch)
+
+    assert changed == [paid, delivered]
+    assert (paid.orderStatus, paid.paidAt, paid.deliveredAt) == ("checking", "2026-10-18T10:00:00+02:00", None)
+    assert delivered.orderStatus == "delivered" and delivered.deliveredAt
+    # 已有付款时间的订单不再查询付款，状态未变化的订单不修改（版本不变）
+    assert [path for _, path in client.calls if path.endswith("/payment")] == ["/me/order/1/payment"]
+    assert unchanged._version == version
+    assert set(tracker.last_checked) == {"o1", "o2", "o3"}
+    assert (state / "orders.json").exists()
+    # 已交付的订单不再跟踪，其余订单按间隔排到下一轮之后
+    assert tracker.due_orders() == []
+
+
+def test_calls_are_spaced_and_batched(state, monkeypatch):
+    main.orders.extend(make_order(i) for i in range(1, 6))
+    # 每分钟600次调用，间隔0.1秒；60秒的轮询间隔内最多600个订单
+    tracker = main.OrderStatusTracker(60, 600, 30)
+    assert tracker.batch_size == 600
+    tracker.batch_size = 3
+    client = StatusClient({str(i): "notPaid" for i in range(1, 6)})
+
+    run_tracker(tracker, client, monkeypatch)
+
+    times = [called for called, _ in client.calls]
+    assert len(times) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+    assert [order.orderId for order in tracker.due_orders()] == ["4", "5"]
+
+
+def test_failed_poll_is_counted_and_retried_later(state, monkeypatch):
+    order = make_order(1)
+    main.orders.append(order)
+    tracker = main.OrderStatusTracker(60, 6000, 30)
+
+    changed = run_tracker(tracker, StatusClient({"1": RuntimeError("503")}), monkeypatch)
+
+    assert changed == [] and tracker.stats["errors"] == 1
+    assert tracker.next_check["o1"] > time.time() + 30
+    assert order.orderStatus is None
+
+
+def test_only_the_owning_worker_polls(state, monkeypatch):
+    class OtherOwner:
+        worker_id = "me"
+        workers = ["me", "other"]
+
+        def preferred_owner(self, key):
+            return "other"
+
+    monkeypatch.setattr(main, "cluster", OtherOwner())
+    monkeypatch.setattr(main, "api_config", main.ApiConfig(appKey="a", appSecret="b", consumerKey="c"))
+    tracker = main.OrderStatusTracker(0, 20, 30)
+    polled = []
+
+    async def run_once():
+        polled.append(True)
+    tracker.run_once = run_once
+
+    async def run_briefly():
+        task = asyncio.create_task(tracker.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+    asyncio.run(run_briefly())
+    assert polled == []
+
+
+def test_refresh_endpoint_schedules_tracked_orders_only(state, monkeypatch):
+    monkeypatch.setattr(main, "order_tracker", main.OrderStatusTracker(60, 20, 30))
+    order = make_order(1)
+    main.orders.extend([order, make_order(2, orderStatus="delivered")])
+    main.order_tracker.next_check["o1"] = time.time() + 3600
+    client = TestClient(main.app)  # 不进入 lifespan，不读写配置和状态文件
+
+    assert client.post("/api/orders/o1/refresh").status_code == 200
+    assert main.order_tracker.next_check["o1"] == 0
+    assert client.post("/api/orders/o2/refresh").status_code == 400
+    assert client.post("/api/orders/missing/refresh").status_code == 404
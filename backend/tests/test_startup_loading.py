@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+import httpx
+
+import main
+
+
+def test_readiness_and_writes_wait_for_state_loading(monkeypatch, ovh_env):
+    monkeypatch.setitem(main.startup_state, "ready", False)
+    monkeypatch.setitem(main.startup_state, "pendingSaves", set())
+    monkeypatch.setattr(main, "shutting_down", False)
+    monkeypatch.setattr(main, "cluster", None)
+    saved = main.TaskStatus(id="saved", name="saved", planCode="24ska01", datacenter="gra", status="pending", createdAt="2026-01-01T00:00:00")
+    release = threading.Event()
+
+    def read_tasks_file():
+        # 模拟读取较大的任务文件
+        release.wait(5)
+        return {saved.id: saved}
+    monkeypatch.setattr(main, "read_tasks_file", read_tasks_file)
+    monkeypatch.setattr(main, "read_orders_file", lambda: None)
+    monkeypatch.setattr(main, "save_tasks_to_file", lambda: None)
+    monkeypatch.setattr(main, "save_orders_to_file", lambda: None)
+
+    async def recover_interrupted_attempts():
+        pass
+    monkeypatch.setattr(main, "recover_interrupted_attempts", recover_interrupted_attempts)
+
+    async def task_execution_loop():
+        pass
+    monkeypatch.setattr(main, "task_execution_loop", task_execution_loop)
+
+    async def run():
+        loading = asyncio.create_task(main.load_state())
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test",
+                                     headers={"Accept-Encoding": "identity"}) as client:
+            response = await client.get("/readyz")
+            assert response.status_code == 503
+            assert response.json()["stateLoaded"] is False
+            assert (await client.get("/healthz")).status_code == 200
+            # 加载期间可以读取已有的数据，修改数据的请求返回503
+            assert (await client.get("/api/tasks")).status_code == 200
+            for method, path in (("POST", "/api/tasks/bulk/pause"), ("DELETE", "/api/tasks/saved"), ("PUT", "/api/config")):
+                response = await client.request(method, path, json={})
+                assert response.status_code == 503, path
+                assert response.headers["retry-after"] == "2"
+            assert not loading.done()
+
+            release.set()
+            await loading
+            response = await client.get("/readyz")
+            assert response.status_code == 200
+            assert response.json()["tasks"] == 1
+            assert (await client.delete("/api/tasks/saved")).status_code == 200
+            assert "saved" not in main.tasks
+
+    asyncio.run(run())
+    assert main.startup_state["loadMs"] is not None
@@ -124,6 +124,12 @@ export function useWebSocket(useFallbackApi: boolean = true) {
     queryClient.invalidateQueries({ queryKey: ['tasks'] });
   }, [queryClient]);
 
+  // 处理批量任务操作 - 使tasks查询失效
+  const handleTasksBulkUpdated = useCallback((data: { action: string; tasks: TaskStatus[]; deleted: string[] }) => {
+    console.log(`收到批量任务事件: ${data.action}, 更新 ${data.tasks.length} 个, 删除 ${data.deleted.length} 个`);
+    queryClient.invalidateQueries({ queryKey: ['tasks'] });
+  }, [queryClient]);
+
   // 处理所有任务清除 - 使tasks查询失效
   const handleTasksCleared = useCallback((data: { count: number }) => {
     console.log(`收到任务清除事件: ${data.count} 个任务被清除`);
@@ -149,6 +155,12 @@ export function useWebSocket(useFallbackApi: boolean = true) {
     queryClient.invalidateQueries({ queryKey: ['orders'] });
   }, [queryClient]);
 
+  // 处理订单状态变化(付款、交付) - 使orders查询失效
+  const handleOrdersUpdated = useCallback((data: { orders: OrderHistory[] }) => {
+    console.log(`收到订单状态更新事件: ${data.orders.length} 个订单`);
+    queryClient.invalidateQueries({ queryKey: ['orders'] });
+  }, [queryClient]);
+
   // 处理日志 - 使logs查询失效
   const handleLog = useCallback((log: LogEntry) => {
     console.log('收到日志事件:', log.level, log.message.substring(0, 50));
@@ -216,8 +228,10 @@ export function useWebSocket(useFallbackApi: boolean = true) {
     webSocketManager.on('task_updated', handleTaskUpdated);
     webSocketManager.on('task_deleted', handleTaskDeleted);
     webSocketManager.on('tasks_cleared', handleTasksCleared);
+    webSocketManager.on('tasks_bulk_updated', handleTasksBulkUpdated);
     webSocketManager.on('order_completed', handleOrderCompleted);
     webSocketManager.on('order_failed', handleOrderFailed);
+    webSocketManager.on('orders_updated', handleOrdersUpdated);
     webSocketManager.on('log', handleLog);
     webSocketManager.on('pong', handlePong);
     webSocketManager.on('connection_status', handleConnectionStatus);
@@ -276,8 +290,10 @@ export function useWebSocket(useFallbackApi: boolean = true) {
       webSocketManager.off('task_updated', handleTaskUpdated);
       webSocketManager.off('task_deleted', handleTaskDeleted);
       webSocketManager.off('tasks_cleared', handleTasksCleared);
+      webSocketManager.off('tasks_bulk_updated', handleTasksBulkUpdated);
       webSocketManager.off('order_completed', handleOrderCompleted);
       webSocketManager.off('order_failed', handleOrderFailed);
+      webSocketManager.off('orders_updated', handleOrdersUpdated);
       webSocketManager.off('log', handleLog);
       webSocketManager.off('pong', handlePong);
       webSocketManager.off('connection_status', handleConnectionStatus);
@@ -299,7 +315,7 @@ export function useWebSocket(useFallbackApi: boolean = true) {
   }, [
     handleOpen, handleClose, handleError, handleInitialData,
     handleTaskCreated, handleTaskUpdated, handleTaskDeleted,
-    handleTasksCleared, handleOrderCompleted, handleOrderFailed, 
+    handleTasksCleared, handleTasksBulkUpdated, handleOrderCompleted, handleOrderFailed, handleOrdersUpdated,
     handleLog, handlePong, handleConnectionStatus,
     isConnected, connectionStatus, queryClient
   ]);
@@ -21,7 +21,11 @@ import {
   List,
   Grid,
   Trash,
-  RotateCw
+  RotateCw,
+  PauseCircle,
+  XCircle,
+  Wallet,
+  Eye
 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import {
@@ -232,6 +236,14 @@ const QueuePage: React.FC = () => {
         return <AlertTriangle className="h-5 w-5 text-tech-red" />;
       case 'max_retries_reached':
         return <StopCircle className="h-5 w-5 text-tech-red" />;
+      case 'needs_review':
+        return <Eye className="h-5 w-5 text-tech-red" />;
+      case 'budget_reached':
+        return <Wallet className="h-5 w-5 text-tech-purple" />;
+      case 'paused':
+        return <PauseCircle className="h-5 w-5 text-tech-gray" />;
+      case 'cancelled':
+        return <XCircle className="h-5 w-5 text-tech-gray" />;
       default:
         return <FileSearch className="h-5 w-5 text-tech-gray" />;
     }
@@ -253,6 +265,14 @@ const QueuePage: React.FC = () => {
         return '错误';
       case 'max_retries_reached':
         return '达到重试上限';
+      case 'paused':
+        return '已暂停';
+      case 'budget_reached':
+        return '达到预算上限';
+      case 'cancelled':
+        return '已取消';
+      case 'needs_review':
+        return '待核实订单';
       default:
         return '未知';
     }
@@ -272,7 +292,13 @@ const QueuePage: React.FC = () => {
         return 'bg-tech-green/20 text-tech-green';
       case 'error':
       case 'max_retries_reached':
+      case 'needs_review':
         return 'bg-tech-red/20 text-tech-red';
+      case 'budget_reached':
+        return 'bg-tech-purple/20 text-tech-purple';
+      case 'paused':
+      case 'cancelled':
+        return 'bg-tech-gray/20 text-tech-gray';
       default:
         return 'bg-muted text-muted-foreground';
     }
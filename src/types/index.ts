@@ -138,6 +138,9 @@ export interface OrderHistory {
   orderId?: string;
   orderUrl?: string;
   error?: string;
+  orderStatus?: string;
+  paidAt?: string;
+  deliveredAt?: string;
 }
 
 export interface LogEntry {